@@ -2,4 +2,13 @@ from django.contrib import admin
 
 from authentication.models import User
 
-admin.site.register(User)
+
+class UserAdmin(admin.ModelAdmin):
+    """Display and search User objects in the Django admin."""
+
+    list_display = ('username', 'email', 'is_staff', 'date_joined')
+    search_fields = ('username',)
+    show_full_result_count = False
+
+
+admin.site.register(User, UserAdmin)
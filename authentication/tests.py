@@ -1,3 +1,117 @@
-# from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from authentication.models import User
+from authentication.throttling import get_client_ip, take_token
+
+THROTTLE = {
+    'ip': {'capacity': 20, 'period': 60},
+    'username': {'capacity': 3, 'period': 60},
+}
+
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def take(self, now, capacity=2, period=60):
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=now):
+            return take_token('test', 'client', capacity, period)
+
+    def test_burst_is_limited_to_capacity(self):
+        self.assertEqual(
+            [self.take(1000.0) for _ in range(3)], [True, True, False]
+        )
+
+    def test_no_burst_across_window_boundary(self):
+        self.assertTrue(self.take(59.0))
+        self.assertTrue(self.take(59.5))
+        self.assertFalse(self.take(60.5))
+
+    def test_tokens_refill_continuously(self):
+        self.take(1000.0)
+        self.take(1000.0)
+        self.assertFalse(self.take(1010.0))
+        self.assertTrue(self.take(1030.0))
+        self.assertFalse(self.take(1030.0))
+
+    def test_peek_does_not_consume(self):
+        with mock.patch('authentication.throttling.time.time',
+                        return_value=1000.0):
+            for _ in range(3):
+                self.assertTrue(
+                    take_token('test', 'client', 1, 60, consume=False)
+                )
+
+
+class ClientIpTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_remote_addr_without_proxy(self):
+        request = self.factory.post(
+            '/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4'
+        )
+        self.assertEqual(get_client_ip(request), '10.0.0.1')
+
+    def test_forwarded_address_of_trusted_proxy(self):
+        request = self.factory.post(
+            '/', REMOTE_ADDR='10.0.0.1',
+            HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4',
+        )
+        self.assertEqual(get_client_ip(request, 1), '1.2.3.4')
+        self.assertEqual(get_client_ip(request, 2), '6.6.6.6')
+
+
+@override_settings(LOGIN_THROTTLE=THROTTLE)
+class LoginThrottleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('victim', password='secret-pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, password, **extra):
+        return self.client.post(
+            reverse('authentication:login'),
+            {'username': 'victim', 'password': password}, **extra
+        )
+
+    def test_failed_attempts_lock_the_username(self):
+        for _ in range(3):
+            self.assertEqual(self.login('wrong').status_code, 200)
+        self.assertEqual(self.login('secret-pw').status_code, 429)
+
+    def test_successful_logins_do_not_lock_the_username(self):
+        for _ in range(5):
+            self.assertEqual(self.login('secret-pw').status_code, 302)
+            self.client.logout()
+        self.assertEqual(self.login('wrong').status_code, 200)
+
+    @override_settings(
+        LOGIN_THROTTLE={**THROTTLE, 'TRUSTED_PROXIES': 1,
+                        'ip': {'capacity': 1}}
+    )
+    def test_clients_behind_proxy_have_their_own_bucket(self):
+        self.assertEqual(
+            self.login('secret-pw', HTTP_X_FORWARDED_FOR='1.1.1.1')
+            .status_code, 302
+        )
+        self.client.logout()
+        self.assertEqual(
+            self.login('secret-pw', HTTP_X_FORWARDED_FOR='2.2.2.2')
+            .status_code, 302
+        )
+        self.client.logout()
+        self.assertEqual(
+            self.login('secret-pw', HTTP_X_FORWARDED_FOR='1.1.1.1')
+            .status_code, 429
+        )
@@ -0,0 +1,220 @@
+"""
+Throttle login and signup attempts before any password hashing.
+Every attempt takes a token from the bucket of the client IP, and failed
+attempts take one from the bucket of the username: an empty username bucket
+rejects the attempts on that account, without letting anyone lock a user
+out by sending attempts that never fail. Buckets refill continuously and
+are stored in the shared cache so that every worker sees the same counters;
+each update holds a short lock key of the bucket.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.shortcuts import render
+
+DEFAULT_LOGIN_THROTTLE = {
+    # Each bucket holds up to `capacity` tokens and refills completely in
+    # `period` seconds.
+    'ip': {'capacity': 30, 'period': 60},
+    'username': {'capacity': 5, 'period': 60},
+    # Reverse proxies in front of the application: the client IP is read
+    # from the X-Forwarded-For entry appended by the outermost one.
+    'TRUSTED_PROXIES': 0,
+    'CACHE': 'default',
+}
+
+METRICS_KEY_PREFIX = 'throttle:metrics'
+# Seconds a bucket update may hold its lock, and an attempt wait for it.
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.2
+LOCK_POLL_INTERVAL = 0.005
+
+
+def get_throttle_settings():
+    """Return the bucket limits, merged over the defaults."""
+    limits = {
+        scope: dict(values) if isinstance(values, dict) else values
+        for scope, values in DEFAULT_LOGIN_THROTTLE.items()
+    }
+    for scope, values in getattr(settings, 'LOGIN_THROTTLE', {}).items():
+        if isinstance(values, dict):
+            limits.setdefault(scope, {}).update(values)
+        else:
+            limits[scope] = values
+    return limits
+
+
+def get_cache():
+    """Return the cache holding the buckets."""
+    return caches[get_throttle_settings()['CACHE']]
+
+
+def _incr(key, timeout):
+    """Atomically increment a cache counter, creating it if needed."""
+    cache = get_cache()
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key expired or was evicted between add() and incr().
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def bucket_key(scope, identifier):
+    """Return the cache key of a bucket, whatever the identifier holds."""
+    digest = hashlib.sha256(identifier.encode()).hexdigest()[:32]
+    return f'throttle:{scope}:{digest}'
+
+
+def take_token(scope, identifier, capacity, period, consume=True):
+    """
+    Take one token from the bucket of the given identifier, or only check
+    that one is left when consume is False.
+    Return True if a token was available. Attempts that cannot lock the
+    bucket in time are rejected.
+    """
+    cache = get_cache()
+    key = bucket_key(scope, identifier)
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        now = time.time()
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * capacity / period)
+        if tokens < 1:
+            return False
+        if consume:
+            # An idle bucket is full again once the key has expired.
+            cache.set(key, (tokens - 1, now), timeout=period)
+        return True
+    finally:
+        cache.delete(lock_key)
+
+
+def record_metric(name):
+    """Increment a throttle metric counter."""
+    _incr(f'{METRICS_KEY_PREFIX}:{name}', timeout=None)
+
+
+def get_throttle_metrics():
+    """Return the admitted and rejected attempt counters."""
+    names = ('admitted', 'rejected')
+    values = get_cache().get_many(
+        [f'{METRICS_KEY_PREFIX}:{n}' for n in names]
+    )
+    return {
+        name: values.get(f'{METRICS_KEY_PREFIX}:{name}', 0)
+        for name in names
+    }
+
+
+def collect_metrics():
+    """Return the throttle counters as a Prometheus metric family."""
+    return [(
+        'litrevu_auth_attempts_total',
+        'counter',
+        'Login and signup attempts, by throttle decision.',
+        [
+            ({'decision': name}, value)
+            for name, value in get_throttle_metrics().items()
+        ],
+    )]
+
+
+def get_client_ip(request, trusted_proxies=0):
+    """
+    Return the client IP address of the request: the address appended to
+    X-Forwarded-For by the outermost trusted proxy, if any.
+    """
+    if trusted_proxies:
+        forwarded = [
+            address.strip()
+            for address in request.META.get(
+                'HTTP_X_FORWARDED_FOR', ''
+            ).split(',')
+            if address.strip()
+        ]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_username(request):
+    """Return the normalized username of an attempt."""
+    return request.POST.get('username', '').strip().lower()
+
+
+def allow_attempt(request, action):
+    """
+    Return True if the attempt may proceed, consuming one token from the
+    IP bucket and checking that the username bucket is not empty.
+    """
+    limits = get_throttle_settings()
+    ip = get_client_ip(request, limits['TRUSTED_PROXIES'])
+    username = get_username(request)
+    allowed = take_token(f'{action}:ip', ip, **limits['ip']) and (
+        not username
+        or take_token(
+            f'{action}:username', username, **limits['username'],
+            consume=False
+        )
+    )
+    record_metric('admitted' if allowed else 'rejected')
+    return allowed
+
+
+def record_failure(request, action):
+    """Take one token from the username bucket of a failed attempt."""
+    username = get_username(request)
+    if username:
+        take_token(
+            f'{action}:username', username,
+            **get_throttle_settings()['username']
+        )
+
+
+class ThrottleMixin:
+    """
+    Reject excess POST attempts before the view handles them. Views call
+    record_failure() when an attempt fails.
+    """
+
+    throttle_action = None
+    throttle_message = (
+        'Trop de tentatives. Veuillez réessayer dans quelques instants.'
+    )
+
+    def dispatch(self, request, *args, **kwargs):
+        """Return a 429 response when the attempt is throttled."""
+        if request.method == 'POST' and not allow_attempt(
+            request, self.throttle_action
+        ):
+            return self.throttled_response(request)
+        return super().dispatch(request, *args, **kwargs)
+
+    def record_failure(self, request):
+        """Count a failed attempt against its username."""
+        record_failure(request, self.throttle_action)
+
+    def throttled_response(self, request):
+        """Render the page with an unbound form and the throttle message."""
+        form = self.form_class(
+            initial={'username': request.POST.get('username', '')}
+        )
+        return render(
+            request,
+            self.template_name,
+            context={
+                'form': form,
+                'message': self.throttle_message
+            },
+            status=429
+        )
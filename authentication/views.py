@@ -8,12 +8,14 @@ from django.shortcuts import render, redirect
 from . import forms
 from django.contrib.auth import login, authenticate, logout
 from django.views.generic import View
+from .throttling import ThrottleMixin
 
 
 # Login view
-class LoginPageView(View):
+class LoginPageView(ThrottleMixin, View):
     """Display and process the user login form."""
 
+    throttle_action = 'login'
     template_name = 'authentication/login.html'
     form_class = forms.LoginForm
 
@@ -45,6 +47,7 @@ class LoginPageView(View):
                 return redirect('reviews:feed')
             else:
                 message = 'Identifiants invalides.'
+        self.record_failure(request)
         return render(
             request,
             self.template_name,
@@ -66,9 +69,10 @@ class LogoutPageView(View):
 
 
 # Signup view
-class SignupPageView(View):
+class SignupPageView(ThrottleMixin, View):
     """Display and process the user signup form."""
 
+    throttle_action = 'signup'
     template_name = 'authentication/signup.html'
     form_class = forms.SignupForm
 
@@ -84,6 +88,7 @@ class SignupPageView(View):
             user = form.save()
             login(request, user)
             return redirect('reviews:feed')
+        self.record_failure(request)
         return render(request, self.template_name, {'form': form})
 
 
@@ -2,6 +2,9 @@
 ASGI config for litrevu project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to the feed event stream are served directly by
+``reviews.events.feed_events``; all others go to Django.
+The worker is warmed up once the application is created.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'litrevu.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up.
+from litrevu.warmup import warm_up  # noqa: E402
+from reviews.events import FEED_EVENTS_PATH, feed_events  # noqa: E402
+
+warm_up()
+
+
+async def application(scope, receive, send):
+    """Route the feed event stream, and everything else to Django."""
+    if scope['type'] == 'http' and scope['path'] == FEED_EVENTS_PATH:
+        await feed_events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,39 @@
+"""
+System checks of the deployment settings the application relies on.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def is_process_local(alias='default'):
+    """Return True if a cache is not shared between processes."""
+    return isinstance(caches[alias], PROCESS_LOCAL_CACHES)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn when the login throttle and the follow suggestions are kept in a
+    cache that each worker holds for itself.
+    """
+    from authentication.throttling import get_throttle_settings
+
+    alias = get_throttle_settings()['CACHE']
+    if settings.DEBUG or not is_process_local(alias):
+        return []
+    return [Warning(
+        f"The '{alias}' cache is local to each process.",
+        hint=(
+            "Login throttle limits are multiplied by the number of workers "
+            "and precomputed follow suggestions are lost: set "
+            "CACHE_BACKEND and CACHE_LOCATION to a shared cache such as "
+            "Memcached or Redis."
+        ),
+        id='litrevu.W001',
+    )]
@@ -0,0 +1,448 @@
+"""
+Record per-view latency and SQL query histograms, and other application
+histograms and counters, and expose them in the Prometheus text format.
+Each worker process accumulates its histograms in memory and periodically
+writes them to its own file in a shared directory; the metrics endpoint
+sums the files of all workers. The files of dead workers are folded into a
+single file when a worker starts and when the metrics are read, so that
+the directory does not grow with each restart and the totals never
+decrease.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # Windows: the files of dead workers are kept.
+    fcntl = None
+
+DEFAULT_METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': 'metrics',
+    # Seconds between two writes of a worker's histograms to its file.
+    'FLUSH_INTERVAL': 5,
+    # Bearer token accepted by the endpoint, in addition to staff sessions.
+    'TOKEN': None,
+    # Dotted paths of functions returning extra metric families.
+    'COLLECTORS': [],
+}
+
+# {metric name: (description, buckets, label name)}
+HISTOGRAMS = {
+    'litrevu_request_duration_seconds': (
+        'Request duration in seconds, by view.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+        'view',
+    ),
+    'litrevu_request_queries': (
+        'Number of SQL queries per request, by view.',
+        (0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+        'view',
+    ),
+    'litrevu_write_lock_wait_seconds': (
+        'Time spent waiting for the database write lock, by write.',
+        (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        'write',
+    ),
+}
+
+# {metric name: (description, label name)}
+COUNTERS = {
+    'litrevu_write_retries_total': (
+        'Write transactions retried after a lock timeout, by write.',
+        'write',
+    ),
+    'litrevu_write_failures_total': (
+        'Write transactions abandoned after the last attempt, by write.',
+        'write',
+    ),
+    'litrevu_cache_local_hits_total': (
+        'Cache lookups served by the process cache, by namespace.',
+        'namespace',
+    ),
+    'litrevu_cache_shared_hits_total': (
+        'Cache lookups served by the shared cache, by namespace.',
+        'namespace',
+    ),
+    'litrevu_cache_waits_total': (
+        'Cache misses served by the computation of another worker, by '
+        'namespace.',
+        'namespace',
+    ),
+    'litrevu_cache_misses_total': (
+        'Cache lookups computing their value, by namespace.',
+        'namespace',
+    ),
+}
+
+
+def get_metrics_settings():
+    """Return the metrics settings, merged over the defaults."""
+    return {**DEFAULT_METRICS, **getattr(settings, 'METRICS', {})}
+
+
+def get_metrics_directory():
+    """Return the directory shared by the workers' metric files."""
+    return Path(settings.BASE_DIR, get_metrics_settings()['DIRECTORY'])
+
+
+# File holding the totals of the dead workers, and the lock of its updates.
+DEAD_WORKERS_FILE = 'dead-workers.json'
+PRUNE_LOCK_FILE = '.prune.lock'
+
+
+class HistogramStore:
+    """
+    Accumulate histograms and counters in memory and write them to a
+    process file.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = self.directory / f'{self.pid}-{time.time_ns()}.json'
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # {histogram name: {label: [bucket counts..., +Inf count, sum]}}
+        # {counter name: {label: [count]}}
+        self.values = {name: {} for name in (*HISTOGRAMS, *COUNTERS)}
+        self.next_flush = time.monotonic() + flush_interval
+        prune_dead_workers(self.directory)
+
+    def observe(self, name, label, value):
+        """Record one observation, flushing to disk when it is due."""
+        buckets = HISTOGRAMS[name][1]
+        with self.lock:
+            counts = self.values[name].get(label)
+            if counts is None:
+                counts = self.values[name][label] = [0] * (len(buckets) + 2)
+            counts[bisect_left(buckets, value)] += 1
+            counts[-1] += value
+            flush = time.monotonic() >= self.next_flush
+        if flush:
+            self.flush(blocking=False)
+
+    def increment(self, name, label, value=1):
+        """Add to a counter, flushing to disk when it is due."""
+        with self.lock:
+            counts = self.values[name].setdefault(label, [0])
+            counts[0] += value
+            flush = time.monotonic() >= self.next_flush
+        if flush:
+            self.flush(blocking=False)
+
+    def flush(self, blocking=True):
+        """Write the histograms atomically to the process file."""
+        # Requests skip the write if another thread is already doing it.
+        if not self.flush_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self.lock:
+                data = json.dumps(self.values)
+                self.next_flush = time.monotonic() + self.flush_interval
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(data)
+            os.replace(tmp_path, self.path)
+        finally:
+            self.flush_lock.release()
+
+
+def add_histograms(totals, data):
+    """Add the histograms and counters of a file to the totals."""
+    for name, labels in data.items():
+        if name not in totals:
+            continue
+        for label, counts in labels.items():
+            total = totals[name].setdefault(label, [0] * len(counts))
+            for index, count in enumerate(counts):
+                total[index] += count
+
+
+def read_file(path):
+    """Return the histograms of a file, or None if it is unreadable."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def read_histograms(directory):
+    """Return the histograms and counters of all worker files, summed."""
+    totals = {name: {} for name in (*HISTOGRAMS, *COUNTERS)}
+    for path in Path(directory).glob('*.json'):
+        data = read_file(path)
+        if data is not None:
+            add_histograms(totals, data)
+    return totals
+
+
+def is_running(pid):
+    """Return True if a process with the given id exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def prune_dead_workers(directory):
+    """
+    Add the files of the workers that are no longer running to the dead
+    workers file and delete them.
+    """
+    directory = Path(directory)
+    if fcntl is None or not directory.is_dir():
+        return
+    with open(directory / PRUNE_LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        dead_paths = []
+        for path in directory.iterdir():
+            pid = path.stem.split('-', 1)[0]
+            if path.suffix == '.tmp' and pid.isdigit():
+                # Left over by a worker killed while writing its file.
+                if not is_running(int(pid)):
+                    path.unlink(missing_ok=True)
+            elif path.suffix == '.json' and pid.isdigit():
+                if not is_running(int(pid)):
+                    dead_paths.append(path)
+        if not dead_paths:
+            return
+        dead_workers_path = directory / DEAD_WORKERS_FILE
+        totals = {name: {} for name in (*HISTOGRAMS, *COUNTERS)}
+        add_histograms(totals, read_file(dead_workers_path) or {})
+        for path in dead_paths:
+            add_histograms(totals, read_file(path) or {})
+        tmp_path = dead_workers_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(totals))
+        os.replace(tmp_path, dead_workers_path)
+        for path in dead_paths:
+            path.unlink(missing_ok=True)
+
+
+def escape_label(value):
+    """Escape a Prometheus label value."""
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def format_labels(labels):
+    """Return a Prometheus label set."""
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{key}="{escape_label(value)}"' for key, value in labels.items()
+    )
+    return f'{{{pairs}}}'
+
+
+def render_histograms(totals):
+    """Yield the Prometheus text lines of the histograms."""
+    for name, (description, buckets, label_name) in HISTOGRAMS.items():
+        yield f'# HELP {name} {description}'
+        yield f'# TYPE {name} histogram'
+        for label, counts in sorted(totals[name].items()):
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts[:-1]):
+                cumulative += count
+                labels = format_labels({label_name: label, 'le': bound})
+                yield f'{name}_bucket{labels} {cumulative}'
+            labels = format_labels({label_name: label})
+            yield f'{name}_sum{labels} {counts[-1]}'
+            yield f'{name}_count{labels} {cumulative}'
+
+
+def render_counters(totals):
+    """Yield the Prometheus text lines of the counters."""
+    for name, (description, label_name) in COUNTERS.items():
+        yield f'# HELP {name} {description}'
+        yield f'# TYPE {name} counter'
+        for label, (count,) in sorted(totals[name].items()):
+            yield f'{name}{format_labels({label_name: label})} {count}'
+
+
+def render_collectors(collectors):
+    """
+    Yield the Prometheus text lines of the collectors.
+    Each collector returns (name, type, description, samples) families,
+    where samples are (labels, value) pairs.
+    """
+    for path in collectors:
+        for name, kind, description, samples in import_string(path)():
+            yield f'# HELP {name} {description}'
+            yield f'# TYPE {name} {kind}'
+            for labels, value in samples:
+                yield f'{name}{format_labels(labels)} {value}'
+
+
+class QueryCounter:
+    """Count the SQL queries executed on a connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def finish_after_streaming(response, callback, chunk_context=nullcontext):
+    """
+    Call callback once the content of a streaming response has been sent or
+    the response closed, or at once for other responses. The content of a
+    synchronous stream is produced within chunk_context(), so that the work
+    done by its iterator can be measured like the view's.
+    """
+    if not response.streaming:
+        callback()
+        return response
+    called = False
+
+    def finish():
+        nonlocal called
+        if not called:
+            called = True
+            callback()
+
+    # The response is closed even when its content is never iterated.
+    response._resource_closers.append(finish)
+    content = response.streaming_content
+    if response.is_async:
+        async def stream():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                finish()
+    else:
+        def stream():
+            iterator = iter(content)
+            end = object()
+            try:
+                while True:
+                    with chunk_context():
+                        chunk = next(iterator, end)
+                    if chunk is end:
+                        return
+                    yield chunk
+            finally:
+                finish()
+    response.streaming_content = stream()
+    return response
+
+
+store = None
+store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the histogram store of the current process."""
+    global store
+    if store is not None and store.pid == os.getpid():
+        return store
+    with store_lock:
+        # A forked worker must not write to its parent's file.
+        if store is None or store.pid != os.getpid():
+            config = get_metrics_settings()
+            store = HistogramStore(
+                get_metrics_directory(), config['FLUSH_INTERVAL']
+            )
+            atexit.register(store.flush)
+        return store
+
+
+def flush_store():
+    """Write the metrics of the current process to its file, if any."""
+    if store is not None and store.pid == os.getpid():
+        store.flush()
+
+
+def record(method, name, label, value):
+    """Send a metric to the metrics store, when metrics are enabled."""
+    if get_metrics_settings()['ENABLED']:
+        getattr(get_store(), method)(name, label, value)
+
+
+class MetricsMiddleware:
+    """
+    Record the duration and the SQL query count of each request, including
+    the sending of streamed content.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not get_metrics_settings()['ENABLED']:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        connection = connections['default']
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        def observe():
+            duration = time.perf_counter() - start
+            match = request.resolver_match
+            label = match.view_name if match else 'unmatched'
+            metrics_store = get_store()
+            metrics_store.observe(
+                'litrevu_request_duration_seconds', label, duration
+            )
+            metrics_store.observe(
+                'litrevu_request_queries', label, counter.count
+            )
+
+        # Streamed pages are timed until their last chunk, and the queries
+        # run by their iterator are counted.
+        return finish_after_streaming(
+            response, observe, lambda: connection.execute_wrapper(counter)
+        )
+
+
+def is_authorized(request, token):
+    """Return True if the request may read the metrics."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    header = request.headers.get('Authorization', '')
+    return bool(token) and constant_time_compare(header, f'Bearer {token}')
+
+
+def metrics_view(request):
+    """Return all metrics in the Prometheus text format."""
+    config = get_metrics_settings()
+    if not is_authorized(request, config['TOKEN']):
+        return HttpResponseForbidden()
+    flush_store()
+    directory = get_metrics_directory()
+    prune_dead_workers(directory)
+    totals = read_histograms(directory)
+    lines = [
+        *render_histograms(totals),
+        *render_counters(totals),
+        *render_collectors(config['COLLECTORS']),
+    ]
+    return HttpResponse(
+        '\n'.join(lines) + '\n',
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,203 @@
+"""
+Profile individual requests on demand.
+Requests from staff users, or carrying a signed profiling header, run under
+cProfile and the result is written as a `.prof` file. A Server-Timing
+header can split the time between database, templates and Python code.
+Streamed responses are profiled while their content is produced, and
+written once it has been sent; they have no Server-Timing header, which is
+sent before their content.
+
+Generate a header token with:
+    python manage.py shell -c \
+        "from litrevu.profiling import make_profile_token; \
+        print(make_profile_token())"
+"""
+
+import cProfile
+import random
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.utils.text import slugify
+
+from litrevu.instrumentation import finish_after_streaming
+
+DEFAULT_PROFILING = {
+    'ENABLED': False,
+    'DIRECTORY': 'profiles',
+    # Share of eligible staff requests that are profiled.
+    'SAMPLE_RATE': 1.0,
+    'STAFF': True,
+    'HEADER': 'X-Profile',
+    'TOKEN_MAX_AGE': 3600,
+    'SERVER_TIMING': True,
+}
+
+TOKEN_SALT = 'litrevu.profiling'
+
+# cProfile cannot run two profilers at once.
+profiler_lock = threading.Lock()
+
+
+def get_profiling_settings():
+    """Return the profiling settings, merged over the defaults."""
+    return {**DEFAULT_PROFILING, **getattr(settings, 'PROFILING', {})}
+
+
+def make_profile_token():
+    """Return a signed token enabling profiling through the header."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def is_valid_token(token, max_age):
+    """Return True if the token was signed by make_profile_token."""
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def is_rendering_template(frame):
+    """Return True if a template is being rendered in the frame's stack."""
+    render_code = Template.render.__code__
+    while frame is not None:
+        if frame.f_code is render_code:
+            return True
+        frame = frame.f_back
+    return False
+
+
+class QueryTimer:
+    """Measure the time spent in SQL queries, inside templates or not."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.in_templates = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.total += duration
+            if is_rendering_template(sys._getframe(1)):
+                self.in_templates += duration
+
+
+class ProfilingMiddleware:
+    """Run selected requests under cProfile."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_profiling_settings()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.directory = Path(settings.BASE_DIR, self.config['DIRECTORY'])
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        if not profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request)
+        except BaseException:
+            profiler_lock.release()
+            raise
+
+    def should_profile(self, request):
+        """Return True if the request must be profiled."""
+        token = request.headers.get(self.config['HEADER'])
+        if token:
+            return is_valid_token(token, self.config['TOKEN_MAX_AGE'])
+        user = getattr(request, 'user', None)
+        return (
+            self.config['STAFF']
+            and user is not None
+            and user.is_staff
+            and random.random() < self.config['SAMPLE_RATE']
+        )
+
+    def profile(self, request):
+        """
+        Return the response, writing the profile of the request once its
+        content has been produced. The profiler lock is released then.
+        """
+        profiler = cProfile.Profile()
+        query_timer = QueryTimer()
+        elapsed = [0.0]
+
+        @contextmanager
+        def profiling():
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(query_timer)
+                    )
+                start = time.perf_counter()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    elapsed[0] += time.perf_counter() - start
+
+        with profiling():
+            response = self.get_response(request)
+
+        def finish():
+            try:
+                profiler.create_stats()
+                self.dump(profiler, request, elapsed[0])
+            finally:
+                profiler_lock.release()
+
+        if self.config['SERVER_TIMING'] and not response.streaming:
+            profiler.create_stats()
+            response['Server-Timing'] = self.server_timing(
+                profiler, query_timer, elapsed[0]
+            )
+        return finish_after_streaming(response, finish, profiling)
+
+    def dump(self, profiler, request, total):
+        """Write the profile to the profiling directory."""
+        match = request.resolver_match
+        name = match.view_name if match else request.path
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{slugify(name) or 'root'}-"
+            f"{total * 1000:.0f}ms.prof"
+        )
+        profiler.dump_stats(self.directory / filename)
+
+    def server_timing(self, profiler, query_timer, total):
+        """Return the Server-Timing header value of the request."""
+        render_code = Template.render.__code__
+        render_key = (
+            render_code.co_filename,
+            render_code.co_firstlineno,
+            render_code.co_name,
+        )
+        # Recursive calls (includes) are counted once in the cumulative time.
+        template_total = profiler.stats.get(render_key, (0, 0, 0, 0))[3]
+        template = max(template_total - query_timer.in_templates, 0.0)
+        python = max(total - query_timer.total - template, 0.0)
+        return ', '.join(
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in (
+                ('db', query_timer.total),
+                ('tpl', template),
+                ('py', python),
+                ('total', total),
+            )
+        )
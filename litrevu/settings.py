@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'litrevu.instrumentation.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'litrevu.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'litrevu.urls'
@@ -63,17 +65,30 @@ TEMPLATES = [
         'DIRS': [
             BASE_DIR.joinpath('templates'),
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per process, and reused across
+            # workers through the compiled template cache (see
+            # litrevu/template_loaders.py)
+            'loaders': [
+                ('litrevu.template_loaders.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
+TEMPLATE_CACHE = {
+    'ENABLED': os.environ.get("TEMPLATE_CACHE_ENABLED", "True") == "True",
+    'DIRECTORY': 'template_cache',
+}
+
 WSGI_APPLICATION = 'litrevu.wsgi.application'
 
 
@@ -84,9 +99,95 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Transactions take the write lock when they begin, so that
+            # concurrent writers wait for it instead of failing midway.
+            'transaction_mode': 'IMMEDIATE',
+            # Seconds a statement waits for a lock before failing; writes
+            # outside atomic_write are not retried, so keep the default.
+            'timeout': 5,
+            # Readers and the writer no longer block each other.
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
+    }
+}
+
+# Send the feed page in chunks as its items are read, instead of rendering
+# it whole before sending it
+FEED_STREAMING = os.environ.get("FEED_STREAMING", "True") == "True"
+
+# Tickets and reviews older than AGE_DAYS are moved to the archive tables
+# by the archive_posts command (see reviews/archive.py)
+ARCHIVE = {
+    'AGE_DAYS': int(os.environ.get("ARCHIVE_AGE_DAYS", "365")),
+    'BATCH_SIZE': 500,
+}
+
+# Digests of the posts of followed users, written by the send_digests
+# command (see reviews/digest.py); emails are written to files by default
+DIGEST = {
+    'BATCH_SIZE': 50000,
+    'EMAIL_BACKEND': os.environ.get(
+        'DIGEST_EMAIL_BACKEND',
+        'django.core.mail.backends.filebased.EmailBackend'
+    ),
+    'EMAIL_FILE_PATH': 'sent_emails',
+}
+
+# Retries of write transactions failing to take the lock (see
+# litrevu/writes.py)
+WRITE_RETRY = {
+    'ATTEMPTS': 4,
+    'BACKOFF': 0.05,
+    'MAX_BACKOFF': 1.0,
+}
+
+
+# On-demand request profiling (see litrevu/profiling.py)
+
+PROFILING = {
+    'ENABLED': os.environ.get("PROFILING_ENABLED") == "True",
+    'DIRECTORY': 'profiles',
+    'SAMPLE_RATE': float(os.environ.get("PROFILING_SAMPLE_RATE", "1.0")),
+    'SERVER_TIMING': True,
+}
+
+
+# Per-view metrics exposed at /metrics/ (see litrevu/instrumentation.py)
+
+METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': 'metrics',
+    'FLUSH_INTERVAL': 5,
+    'TOKEN': os.environ.get("METRICS_TOKEN"),
+    'COLLECTORS': [
+        'authentication.throttling.collect_metrics',
+    ],
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a cache shared by all workers (Memcached, Redis) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'litrevu'),
     }
 }
 
+# Hot lookups are cached in each process in front of the cache above, for
+# LOCAL_TIMEOUT seconds (see reviews/caching.py)
+TWO_TIER_CACHE = {
+    'LOCAL_TIMEOUT': 5,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'TIMEOUT': 300,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -110,6 +211,14 @@ AUTH_USER_MODEL = 'authentication.User'
 
 LOGIN_REDIRECT_URL = 'home'
 
+# Login and signup throttling: token buckets per client IP, and per
+# username for failed attempts (see authentication/throttling.py)
+LOGIN_THROTTLE = {
+    'ip': {'capacity': 30, 'period': 60},
+    'username': {'capacity': 5, 'period': 60},
+    'TRUSTED_PROXIES': int(os.environ.get("TRUSTED_PROXIES", "0")),
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -138,3 +247,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 UPLOAD_PATH = BASE_DIR / 'uploads'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = UPLOAD_PATH
+
+# Ticket images are checked while they are uploaded
+TICKET_IMAGE_UPLOAD = {
+    'MAX_SIZE': 5 * 1024 * 1024,
+    'MAX_PIXELS': 25_000_000,
+}
@@ -0,0 +1,222 @@
+"""
+Template loader keeping compiled templates in memory and on disk.
+Templates are compiled once per process, as with Django's cached loader, and
+the compiled templates are pickled to a directory shared by the workers,
+under the hash of their source: a new worker unpickles them instead of
+parsing them. In debug mode, a template whose file has changed is dropped
+from the memory cache and compiled again on its next use.
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.template import Template, TemplateDoesNotExist, smartif
+from django.template.loaders import cached
+from django.template.loaders.base import Loader as BaseLoader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATE_CACHE = {
+    'ENABLED': True,
+    # Directory of the compiled templates; it must only be writable by the
+    # application, since its files are unpickled.
+    'DIRECTORY': 'template_cache',
+}
+
+# The {% if %} operators are classes created at import time, which pickle
+# cannot find by name.
+OPERATOR_KEYS = {operator: key for key, operator in smartif.OPERATORS.items()}
+
+
+def get_template_cache_settings():
+    """Return the compiled template cache settings, merged over defaults."""
+    return {
+        **DEFAULT_TEMPLATE_CACHE, **getattr(settings, 'TEMPLATE_CACHE', {})
+    }
+
+
+def engine_fingerprint(engine):
+    """
+    Return a hash of the Django version and of the source of the tag
+    libraries of an engine, so that compiled templates are not reused once
+    their tags or filters have changed.
+    """
+    digest = hashlib.sha256(django.get_version().encode())
+    modules = sorted({*engine.libraries.values(), *engine.builtins})
+    for module_name in modules:
+        digest.update(module_name.encode())
+        path = getattr(importlib.import_module(module_name), '__file__', None)
+        if path:
+            digest.update(Path(path).read_bytes())
+    return digest.hexdigest()
+
+
+class TemplatePickler(pickle.Pickler):
+    """Pickle a template without its engine and origin."""
+
+    def __init__(self, file, template):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.template = template
+
+    def persistent_id(self, obj):
+        if obj is self.template.engine:
+            return ('engine',)
+        if obj is self.template.origin:
+            return ('origin',)
+        if isinstance(obj, type) and obj in OPERATOR_KEYS:
+            return ('operator', OPERATOR_KEYS[obj])
+        return None
+
+
+class TemplateUnpickler(pickle.Unpickler):
+    """Unpickle a template with the engine and origin of the loader."""
+
+    def __init__(self, file, engine, origin):
+        super().__init__(file)
+        self.engine = engine
+        self.origin = origin
+
+    def persistent_load(self, pid):
+        if pid[0] == 'engine':
+            return self.engine
+        if pid[0] == 'origin':
+            return self.origin
+        if pid[0] == 'operator':
+            return smartif.OPERATORS[pid[1]]
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}")
+
+
+class CompiledTemplateCacheMixin(BaseLoader):
+    """Compile the templates found by the loaders through the disk cache."""
+
+    def __init__(self, engine, *args, **kwargs):
+        super().__init__(engine, *args, **kwargs)
+        config = get_template_cache_settings()
+        self.cache_directory = (
+            Path(settings.BASE_DIR, config['DIRECTORY'])
+            if config['ENABLED'] else None
+        )
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = engine_fingerprint(self.engine)
+        return self._fingerprint
+
+    def get_template(self, template_name, skip=None):
+        tried = []
+        for origin in self.get_template_sources(template_name):
+            if skip is not None and origin in skip:
+                tried.append((origin, "Skipped to avoid recursion"))
+                continue
+            try:
+                contents = self.get_contents(origin)
+            except TemplateDoesNotExist:
+                tried.append((origin, "Source does not exist"))
+                continue
+            return self.compile(contents, origin)
+        raise TemplateDoesNotExist(template_name, tried=tried)
+
+    def cache_path(self, contents, origin):
+        """Return the file of the compiled template of a source."""
+        digest = hashlib.sha256()
+        for part in (self.fingerprint, origin.name, origin.template_name,
+                     contents):
+            digest.update(str(part).encode())
+            digest.update(b'\0')
+        return self.cache_directory / f'{digest.hexdigest()}.pickle'
+
+    def parse(self, contents, origin):
+        return Template(contents, origin, origin.template_name, self.engine)
+
+    def compile(self, contents, origin):
+        """
+        Return the compiled template of a source, read from the disk cache
+        when it was compiled before. Errors of the cache are logged and the
+        template is compiled instead.
+        """
+        if self.cache_directory is None:
+            return self.parse(contents, origin)
+        path = self.cache_path(contents, origin)
+        try:
+            with open(path, 'rb') as file:
+                return TemplateUnpickler(file, self.engine, origin).load()
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning("Compiled template %s is unreadable", path,
+                           exc_info=True)
+        template = self.parse(contents, origin)
+        self.store(path, template)
+        return template
+
+    def store(self, path, template):
+        """Write a compiled template atomically, if it can be pickled."""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=path.parent, suffix='.tmp', delete=False
+            ) as file:
+                try:
+                    TemplatePickler(file, template).dump(template)
+                except Exception:
+                    file.close()
+                    os.unlink(file.name)
+                    raise
+            os.replace(file.name, path)
+        except (pickle.PicklingError, AttributeError, TypeError,
+                RecursionError) as exc:
+            # Templates using tags that hold local functions, such as some
+            # admin templates, are only kept in memory.
+            logger.debug("Template %s is not cached on disk: %s",
+                         template.origin.name, exc)
+        except OSError:
+            logger.warning("Compiled template %s could not be written", path,
+                           exc_info=True)
+
+
+class Loader(cached.Loader, CompiledTemplateCacheMixin):
+    """
+    Cached loader compiling through the disk cache and, in debug mode,
+    dropping the templates whose file has changed.
+    """
+
+    def __init__(self, engine, loaders):
+        super().__init__(engine, loaders)
+        self.mtimes = {}
+
+    @staticmethod
+    def modification_time(template):
+        try:
+            return os.stat(template.origin.name).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def get_template(self, template_name, skip=None):
+        if not self.engine.debug:
+            return super().get_template(template_name, skip)
+        key = self.cache_key(template_name, skip)
+        cached_template = self.get_template_cache.get(key)
+        if cached_template is not None and (
+            not isinstance(cached_template, Template)
+            or self.modification_time(cached_template) != self.mtimes[key]
+        ):
+            # Missing templates are looked up again too, in case they
+            # have been created since.
+            del self.get_template_cache[key]
+        template = super().get_template(template_name, skip)
+        if template is not cached_template:
+            self.mtimes[key] = self.modification_time(template)
+        return template
+
+    def reset(self):
+        super().reset()
+        self.mtimes.clear()
@@ -0,0 +1,366 @@
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from django import template
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Engine, Template
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings
+)
+
+from litrevu import template_loaders
+from litrevu.instrumentation import MetricsMiddleware
+from litrevu.profiling import (
+    ProfilingMiddleware, QueryTimer, make_profile_token
+)
+from litrevu.warmup import warm_up
+from litrevu.writes import DatabaseBusy, atomic_write
+from reviews import duplicates
+
+# Tag library of the template cache tests.
+register = template.Library()
+
+
+@override_settings(WRITE_RETRY={'ATTEMPTS': 3, 'BACKOFF': 0})
+class AtomicWriteTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        patcher = mock.patch('litrevu.writes.record')
+        self.record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recorded(self, name):
+        return [
+            call.args[2] for call in self.record.call_args_list
+            if call.args[1] == name
+        ]
+
+    def failing(self, errors):
+        """Return a write raising the given errors, then returning 'ok'."""
+        return mock.Mock(side_effect=[*errors, 'ok'])
+
+    def test_lock_errors_are_retried(self):
+        write = self.failing([OperationalError('database is locked')])
+        self.assertEqual(atomic_write(write, name='write')(), 'ok')
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(self.recorded('litrevu_write_retries_total'),
+                         ['write'])
+        self.assertEqual(
+            self.recorded('litrevu_write_lock_wait_seconds'), ['write']
+        )
+
+    def test_busy_after_the_last_attempt(self):
+        write = self.failing([OperationalError('database is locked')] * 3)
+        with self.assertRaises(DatabaseBusy):
+            atomic_write(write, name='write')()
+        self.assertEqual(write.call_count, 3)
+        self.assertEqual(
+            self.recorded('litrevu_write_failures_total'), ['write']
+        )
+
+    def test_other_errors_are_not_retried(self):
+        write = self.failing([OperationalError('no such table: x')])
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            atomic_write(write, name='write')()
+        self.assertEqual(write.call_count, 1)
+
+    def test_nested_write_runs_in_the_outer_transaction(self):
+        write = self.failing([OperationalError('database is locked')])
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                atomic_write(write, name='write')()
+        self.assertEqual(write.call_count, 1)
+
+    def test_label_defaults_to_the_qualified_name(self):
+        @atomic_write
+        def save_things():
+            return 'ok'
+
+        save_things()
+        self.assertEqual(
+            self.recorded('litrevu_write_lock_wait_seconds'),
+            [save_things.__wrapped__.__qualname__]
+        )
+
+
+class StreamingMetricsTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        patcher = mock.patch('litrevu.instrumentation.get_store')
+        self.store = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def observed(self):
+        return {
+            call.args[0]: call.args[2]
+            for call in self.store.observe.call_args_list
+        }
+
+    def streaming_view(self, request):
+        def content():
+            yield 'head'
+            connection.cursor().execute('SELECT 1')
+            time.sleep(0.05)
+            yield 'tail'
+        return StreamingHttpResponse(content())
+
+    def test_streamed_content_is_timed_and_counted(self):
+        middleware = MetricsMiddleware(self.streaming_view)
+        response = middleware(self.factory.get('/'))
+        self.assertEqual(self.observed(), {})
+        self.assertEqual(b''.join(response.streaming_content), b'headtail')
+        observed = self.observed()
+        self.assertGreaterEqual(
+            observed['litrevu_request_duration_seconds'], 0.05
+        )
+        self.assertEqual(observed['litrevu_request_queries'], 1)
+        response.close()
+        self.assertEqual(self.store.observe.call_count, 2)
+
+    def test_closed_stream_is_recorded(self):
+        middleware = MetricsMiddleware(self.streaming_view)
+        middleware(self.factory.get('/')).close()
+        self.assertEqual(self.observed()['litrevu_request_queries'], 0)
+
+    def test_other_responses_are_recorded_at_once(self):
+        middleware = MetricsMiddleware(lambda request: HttpResponse('ok'))
+        middleware(self.factory.get('/'))
+        self.assertEqual(self.store.observe.call_count, 2)
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def view(self, request):
+        connection.cursor().execute('SELECT 1')
+        return HttpResponse(Template('{{ user }}').render(Context({
+            'user': request.user,
+        })))
+
+    def get(self, is_staff=False, headers=None, **config):
+        profiling = {
+            'ENABLED': True, 'DIRECTORY': str(self.directory), **config
+        }
+        with self.settings(PROFILING=profiling):
+            middleware = ProfilingMiddleware(self.view)
+        request = self.factory.get('/', headers=headers)
+        request.user = SimpleNamespace(is_staff=is_staff)
+        return middleware(request)
+
+    def profiles(self):
+        return list(self.directory.glob('*.prof'))
+
+    def test_disabled_middleware_is_not_used(self):
+        with self.settings(PROFILING={'ENABLED': False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(self.view)
+
+    def test_staff_requests_are_profiled(self):
+        response = self.get(is_staff=True)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=\d+\.\d, tpl;dur=\d+\.\d, py;dur=\d+\.\d, '
+            r'total;dur=\d+\.\d$'
+        )
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_other_users_are_not_profiled(self):
+        self.assertNotIn('Server-Timing', self.get())
+        self.assertNotIn('Server-Timing', self.get(is_staff=True, STAFF=False))
+        self.assertEqual(self.profiles(), [])
+
+    def test_signed_header_enables_profiling(self):
+        response = self.get(headers={'X-Profile': make_profile_token()})
+        self.assertIn('Server-Timing', response)
+        response = self.get(headers={'X-Profile': 'forged'})
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_server_timing_can_be_turned_off(self):
+        response = self.get(is_staff=True, SERVER_TIMING=False)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(self.profiles()), 1)
+
+
+class QueryTimerTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_queries_run_by_templates_are_told_apart(self):
+        timer = QueryTimer()
+
+        def query():
+            connection.cursor().execute('SELECT 1')
+            return ''
+
+        with connection.execute_wrapper(timer):
+            query()
+            outside = timer.total
+            self.assertGreater(outside, 0)
+            self.assertEqual(timer.in_templates, 0)
+            Template('{{ query }}').render(Context({'query': query}))
+        self.assertGreater(timer.in_templates, 0)
+        self.assertAlmostEqual(timer.total, outside + timer.in_templates)
+
+
+class WarmUpTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            duplicates, 'title_index', duplicates.TitleIndex()
+        )
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+        # The test database connection must stay open.
+        patcher = mock.patch.object(duplicates, 'connection')
+        self.connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_steps_are_run_and_timed(self):
+        durations = warm_up()
+        self.assertEqual(
+            list(durations), ['templates', 'urls', 'pillow', 'duplicates']
+        )
+        self.assertTrue(self.index.loaded)
+        self.connection.close.assert_called_once_with()
+
+    def test_failed_step_does_not_stop_the_warm_up(self):
+        with mock.patch(
+            'litrevu.warmup.import_image_plugins', side_effect=ImportError
+        ), self.assertLogs('litrevu.warmup', 'ERROR'):
+            durations = warm_up()
+        self.assertIn('pillow', durations)
+        self.assertTrue(self.index.loaded)
+
+    @override_settings(WARM_UP={'ENABLED': False})
+    def test_disabled_warm_up(self):
+        self.assertEqual(warm_up(), {})
+        self.assertFalse(self.index.loaded)
+
+
+class LocalFunctionNode(template.Node):
+    """Node holding a local function, which pickle cannot store."""
+
+    def __init__(self):
+        self.render_value = lambda: 'local'
+
+    def render(self, context):
+        return self.render_value()
+
+
+@register.tag
+def local_function(parser, token):
+    return LocalFunctionNode()
+
+
+TEMPLATES = {
+    'base.html': (
+        '<title>{% block title %}Base{% endblock %}</title>'
+        '{% block content %}{% endblock %}'
+    ),
+    'page.html': (
+        '{% extends "base.html" %}'
+        '{% block title %}Page{% endblock %}'
+        '{% block content %}'
+        '{% if count > 2 and not hidden or name in names %}many'
+        '{% elif count <= 2 %}few{% endif %}'
+        '{% for item in items %}{{ item|upper }},{% endfor %}'
+        '{% url "reviews:review-create" 7 %}'
+        '{% csrf_token %}'
+        '{% include "part.html" with who=name %}'
+        '{% endblock %}'
+    ),
+    'part.html': 'Bonjour {{ who }}',
+    'local.html': '{% load tests %}{% local_function %}',
+}
+
+
+class CompiledTemplateCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.templates = Path(tempfile.mkdtemp())
+        cache_directory = Path(tempfile.mkdtemp())
+        for directory in (self.templates, cache_directory):
+            self.addCleanup(shutil.rmtree, directory)
+        for name, source in TEMPLATES.items():
+            (self.templates / name).write_text(source)
+        self.enterContext(self.settings(
+            TEMPLATE_CACHE={'ENABLED': True, 'DIRECTORY': cache_directory}
+        ))
+        self.cache_directory = cache_directory
+
+    def engine(self, debug=False):
+        """Return a new engine, as in a new worker."""
+        return Engine(
+            dirs=[self.templates], debug=debug,
+            libraries={'tests': 'litrevu.tests'},
+            loaders=[('litrevu.template_loaders.Loader', [
+                'django.template.loaders.filesystem.Loader',
+            ])],
+        )
+
+    def render(self, engine, name='page.html'):
+        return engine.get_template(name).render(Context({
+            'count': 3, 'hidden': False, 'name': 'Ada', 'names': [],
+            'items': ['a', 'b'], 'csrf_token': 'token',
+        }))
+
+    def pickles(self):
+        return sorted(self.cache_directory.glob('*.pickle'))
+
+    def test_unpickled_templates_render_as_compiled_ones(self):
+        compiled = self.render(self.engine())
+        self.assertEqual(len(self.pickles()), 3)
+        with mock.patch.object(
+            template_loaders.CompiledTemplateCacheMixin, 'parse',
+            side_effect=AssertionError('parsed again'),
+        ):
+            self.assertEqual(self.render(self.engine()), compiled)
+        self.assertEqual(
+            compiled,
+            '<title>Page</title>manyA,B,/ticket/7/review/create/'
+            '<input type="hidden" name="csrfmiddlewaretoken" value="token">'
+            'Bonjour Ada'
+        )
+
+    def test_changed_sources_are_compiled_again(self):
+        engine = self.engine(debug=True)
+        self.assertIn('Bonjour Ada', self.render(engine))
+        path = self.templates / 'part.html'
+        modified = path.stat().st_mtime_ns + 10 ** 9
+        path.write_text('Salut {{ who }}')
+        os.utime(path, ns=(modified, modified))
+        self.assertIn('Salut Ada', self.render(engine))
+        self.assertIn('Salut Ada', self.render(self.engine()))
+        self.assertEqual(len(self.pickles()), 4)
+
+    def test_new_fingerprint_compiles_the_templates_again(self):
+        self.render(self.engine())
+        with mock.patch.object(
+            template_loaders, 'engine_fingerprint', return_value='other'
+        ):
+            self.render(self.engine())
+        self.assertEqual(len(self.pickles()), 6)
+
+    def test_unpicklable_templates_are_kept_in_memory(self):
+        engine = self.engine()
+        with self.assertLogs('litrevu.template_loaders', 'DEBUG') as logs:
+            self.assertEqual(self.render(engine, 'local.html'), 'local')
+        self.assertIn('is not cached on disk', logs.output[0])
+        self.assertEqual(self.pickles(), [])
+        self.assertEqual(list(self.cache_directory.glob('*.tmp')), [])
+        self.assertEqual(self.render(engine, 'local.html'), 'local')
@@ -0,0 +1,111 @@
+"""
+Warm up a worker when its WSGI or ASGI application is created, so that the
+first request does not pay for the lazy initialisations: template
+compilation, URL resolver population, Pillow plugin imports and the loading
+of the duplicate ticket index. The index is read from the database; its
+connection is closed once it is loaded, as connections belong to the
+thread serving each request and must not be inherited by the workers a
+pre-forking server forks from the process.
+"""
+
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARM_UP = {
+    'ENABLED': True,
+    # Apps whose templates are compiled, with those of TEMPLATES DIRS.
+    'TEMPLATE_APPS': ['reviews', 'authentication'],
+}
+
+
+def get_warm_up_settings():
+    """Return the warm-up settings, merged over the defaults."""
+    return {**DEFAULT_WARM_UP, **getattr(settings, 'WARM_UP', {})}
+
+
+def template_directories(app_labels):
+    """Return the template directories of the given apps and the project."""
+    directories = [
+        Path(apps.get_app_config(label).path, 'templates')
+        for label in app_labels
+    ]
+    for engine in settings.TEMPLATES:
+        directories.extend(Path(directory) for directory in engine['DIRS'])
+    return [directory for directory in directories if directory.is_dir()]
+
+
+def template_names(app_labels):
+    """Return the names of the templates of the given apps and the project."""
+    names = set()
+    for directory in template_directories(app_labels):
+        names.update(
+            path.relative_to(directory).as_posix()
+            for path in directory.rglob('*.html')
+        )
+    return sorted(names)
+
+
+def compile_templates(app_labels):
+    """Compile the templates into the cache of the template loaders."""
+    for name in template_names(app_labels):
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as exc:
+            logger.warning("Template %s could not be compiled: %s", name, exc)
+
+
+def populate_resolvers(resolver=None):
+    """Populate the URL resolver and those of the included URLconfs."""
+    resolver = resolver or get_resolver()
+    # Reading the reverse dictionary populates the resolver.
+    resolver.reverse_dict
+    for _, namespace_resolver in resolver.namespace_dict.values():
+        populate_resolvers(namespace_resolver)
+
+
+def import_image_plugins():
+    """Import every Pillow image plugin."""
+    from PIL import Image
+
+    Image.init()
+
+
+def load_title_index():
+    """Load the duplicate ticket index, and close its connection."""
+    from reviews.duplicates import title_index
+
+    title_index.load()
+
+
+def warm_up():
+    """
+    Run each warm-up step and return their durations in seconds, by step.
+    Failures are logged: the worker must start anyway.
+    """
+    config = get_warm_up_settings()
+    if not config['ENABLED']:
+        return {}
+    steps = {
+        'templates': lambda: compile_templates(config['TEMPLATE_APPS']),
+        'urls': populate_resolvers,
+        'pillow': import_image_plugins,
+        'duplicates': load_title_index,
+    }
+    durations = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+        durations[name] = time.perf_counter() - start
+    return durations
@@ -0,0 +1,109 @@
+"""
+Coordinate database writes between worker processes.
+SQLite accepts a single writer at a time: write transactions take the write
+lock up front (transaction_mode IMMEDIATE in the database options) and are
+retried with jittered exponential backoff when the lock cannot be taken
+within the busy timeout. Lock waits, retries and abandoned writes are
+recorded in the metrics store.
+"""
+
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from django.shortcuts import render
+
+from litrevu.instrumentation import record
+
+DEFAULT_WRITE_RETRY = {
+    # Attempts of a write transaction before giving up.
+    'ATTEMPTS': 4,
+    # Seconds before the first retry; doubled at each following retry.
+    'BACKOFF': 0.05,
+    'MAX_BACKOFF': 1.0,
+}
+
+
+class DatabaseBusy(Exception):
+    """A write transaction could not take the database lock."""
+
+
+def get_write_settings():
+    """Return the write retry settings, merged over the defaults."""
+    return {**DEFAULT_WRITE_RETRY, **getattr(settings, 'WRITE_RETRY', {})}
+
+
+def is_lock_error(exc):
+    """Return True if an error reports a locked SQLite database."""
+    return isinstance(exc, OperationalError) and 'locked' in str(exc)
+
+
+def atomic_write(func=None, *, using='default', name=None):
+    """
+    Run the decorated function in a write transaction, retrying the whole
+    function when the database lock cannot be taken.
+    Raise DatabaseBusy once every attempt has failed. Inside an outer
+    transaction, the function runs as is: the lock is already held.
+    The write is recorded in the metrics under name, by default the
+    qualified name of the function; bound methods such as ticket.save
+    need an explicit one.
+    """
+    if func is None:
+        return functools.partial(atomic_write, using=using, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if connections[using].in_atomic_block:
+            return func(*args, **kwargs)
+        config = get_write_settings()
+        label = name or func.__qualname__
+        waited = 0.0
+        for attempt in range(config['ATTEMPTS']):
+            if attempt:
+                backoff = min(
+                    config['MAX_BACKOFF'],
+                    config['BACKOFF'] * 2 ** (attempt - 1)
+                )
+                # Full jitter spreads the retries of concurrent writers.
+                delay = random.uniform(0, backoff)
+                time.sleep(delay)
+                waited += delay
+                record('increment', 'litrevu_write_retries_total', label, 1)
+            start = time.perf_counter()
+            acquired = None
+            try:
+                with transaction.atomic(using=using):
+                    # BEGIN IMMEDIATE has returned: the lock is held.
+                    acquired = time.perf_counter()
+                    result = func(*args, **kwargs)
+            except OperationalError as exc:
+                # Without a write-ahead log, COMMIT may also time out
+                # waiting for readers.
+                if not is_lock_error(exc):
+                    raise
+                waited += (acquired or time.perf_counter()) - start
+                continue
+            waited += acquired - start
+            record('observe', 'litrevu_write_lock_wait_seconds', label, waited)
+            return result
+        record('increment', 'litrevu_write_failures_total', label, 1)
+        raise DatabaseBusy(label)
+
+    return wrapper
+
+
+class DatabaseBusyMixin:
+    """Answer with a 503 page when a write of the view gives up."""
+
+    busy_template_name = 'busy.html'
+    busy_retry_after = 2
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except DatabaseBusy:
+            response = render(request, self.busy_template_name, status=503)
+            response['Retry-After'] = str(self.busy_retry_after)
+            return response
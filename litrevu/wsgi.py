@@ -2,6 +2,7 @@
 WSGI config for litrevu project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+The worker is warmed up once the application is created.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
@@ -14,3 +15,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'litrevu.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up.
+from litrevu.warmup import warm_up  # noqa: E402
+
+warm_up()
@@ -1,25 +1,209 @@
 """
 Handle admin configuration for the reviews app.
+Changelists are tuned for large tables: related filters use autocomplete
+instead of listing every related object, related rows are joined, and row
+counts are estimated.
 """
 
+from urllib.parse import urlencode
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+from reviews.models import (
+    ArchivedReview, ArchivedTicket, Review, Ticket, UserFollows
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Estimate the row count of unfiltered changelists over large tables from
+    the highest primary key instead of running a COUNT(*) over the whole
+    table. Rows deleted or archived make the estimate too high: it is
+    lowered as soon as a page shows the end of the table.
+    """
+
+    # Tables up to this many rows are counted exactly.
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        """Return the estimated count, or the exact count when possible."""
+        queryset = self.object_list
+        if queryset.query.where:
+            return super().count
+        # Counting a bounded slice reads at most exact_count_limit + 1 rows.
+        count = queryset.order_by()[:self.exact_count_limit + 1].count()
+        if count <= self.exact_count_limit:
+            return count
+        self.estimated = True
+        return max(count, queryset.model._default_manager.aggregate(
+            last_pk=Max('pk')
+        )['last_pk'] or 0)
+
+    def set_count(self, count):
+        """Replace the count, and the page count computed from it."""
+        self.count = count
+        self.__dict__.pop('num_pages', None)
+
+    def page(self, number):
+        """Return a page, lowering an estimated count past the last row."""
+        page = super().page(number)
+        if not getattr(self, 'estimated', False) or (
+            len(page) == self.per_page
+        ):
+            return page
+        self.estimated = False
+        if len(page):
+            self.set_count((page.number - 1) * self.per_page + len(page))
+            return page
+        # The page is past the last row: count them to find the last page.
+        self.set_count(self.object_list.count())
+        return super().page(self.num_pages)
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Filter on a related object typed in a text field.
+    Suggestions come from the admin autocomplete view, so the sidebar never
+    loads the related table.
+    """
+
+    template = 'admin/autocomplete_filter.html'
+    field_name = None
+    search_lookup = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.model = model
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        """Return a single placeholder choice so the filter is displayed."""
+        return (('', ''),)
+
+    def queryset(self, request, queryset):
+        """Filter by related id, or by the search lookup for plain text."""
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(**{f'{self.field_name}_id': value})
+        return queryset.filter(**{self.search_lookup: value})
+
+    def choices(self, changelist):
+        """Return the context used to render the filter form."""
+        query_parts = [
+            (key, value)
+            for key, values in changelist.get_filters_params().items()
+            if key != self.parameter_name
+            for value in values
+        ]
+        autocomplete_params = urlencode({
+            'app_label': self.model._meta.app_label,
+            'model_name': self.model._meta.model_name,
+            'field_name': self.field_name,
+        })
+        yield {
+            'value': self.value() or '',
+            'parameter_name': self.parameter_name,
+            'query_parts': query_parts,
+            'autocomplete_url': (
+                f"{reverse('admin:autocomplete')}?{autocomplete_params}"
+            ),
+            'clear_query_string': changelist.get_query_string(
+                remove=[self.parameter_name]
+            ),
+        }
+
+
+class UserFilter(AutocompleteFilter):
+    title = 'utilisateur'
+    parameter_name = 'user'
+    field_name = 'user'
+    search_lookup = 'user__username'
+
+
+class TicketFilter(AutocompleteFilter):
+    title = 'ticket'
+    parameter_name = 'ticket'
+    field_name = 'ticket'
+    search_lookup = 'ticket__title__iexact'
+
 
-from reviews.models import Ticket, Review, UserFollows
+class RatingFilter(admin.SimpleListFilter):
+    """Filter reviews by rating without scanning distinct values."""
 
+    title = 'note'
+    parameter_name = 'rating'
 
-class TicketAdmin(admin.ModelAdmin):
+    def lookups(self, request, model_admin):
+        """Return the possible ratings."""
+        return [(str(i), str(i)) for i in range(6)]
+
+    def queryset(self, request, queryset):
+        """Filter by the selected rating."""
+        if self.value() is None:
+            return queryset
+        return queryset.filter(rating=self.value())
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Share the changelist settings of admins over large tables."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = 'time_created'
+    ordering = ('-time_created',)
+
+
+class TicketAdmin(LargeTableAdmin):
     """Display and filter Ticket objects in the Django admin."""
 
     list_display = ('title', 'user', 'time_created')
-    list_filter = ('user', 'time_created')
+    list_filter = (UserFilter,)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
     search_fields = ('title', 'description')
 
 
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     """Display and filter Review objects in the Django admin."""
 
     list_display = ('headline', 'rating', 'user', 'ticket', 'time_created')
-    list_filter = ('rating', 'user')
+    list_filter = (RatingFilter, UserFilter, TicketFilter)
+    list_select_related = ('user', 'ticket')
+    autocomplete_fields = ('user', 'ticket')
+    search_fields = ('headline', 'body')
+
+
+class ArchiveAdmin(LargeTableAdmin):
+    """Display archived posts, which cannot be added or changed."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedTicketAdmin(ArchiveAdmin):
+    """Display and filter ArchivedTicket objects in the Django admin."""
+
+    list_display = ('title', 'user', 'time_created', 'time_archived')
+    list_filter = (UserFilter,)
+    list_select_related = ('user',)
+    search_fields = ('title', 'description')
+
+
+class ArchivedReviewAdmin(ArchiveAdmin):
+    """Display and filter ArchivedReview objects in the Django admin."""
+
+    list_display = ('headline', 'rating', 'user', 'ticket', 'time_created')
+    list_filter = (RatingFilter, UserFilter, TicketFilter)
+    list_select_related = ('user', 'ticket')
     search_fields = ('headline', 'body')
 
 
@@ -27,9 +211,13 @@ class UserFollowsAdmin(admin.ModelAdmin):
     """Display and filter UserFollows objects in the Django admin."""
 
     list_display = ('user', 'followed_user')
+    list_select_related = ('user', 'followed_user')
+    autocomplete_fields = ('user', 'followed_user')
     search_fields = ('user__username', 'followed_user__username')
 
 
 admin.site.register(Ticket, TicketAdmin)
 admin.site.register(Review, ReviewAdmin)
 admin.site.register(UserFollows, UserFollowsAdmin)
+admin.site.register(ArchivedTicket, ArchivedTicketAdmin)
+admin.site.register(ArchivedReview, ArchivedReviewAdmin)
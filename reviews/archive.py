@@ -0,0 +1,184 @@
+"""
+Move old tickets and their reviews to the archive tables.
+A ticket is archived with all its reviews once the ticket and every review
+are older than the archive age, so that the hot tables, and their indexes,
+only hold the recent history read by the feed. Rows are copied and then
+deleted in batches, each in its own write transaction. Archived posts are
+read-only and are only read when a user pages past the hot tables, by
+(creation time, kind, id) keyset so that posts created at the same time
+are neither skipped nor repeated.
+"""
+
+from datetime import timedelta
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, Exists, OuterRef, Q, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from litrevu.writes import atomic_write
+from reviews.lookups import ticket_cache
+from reviews.models import (
+    ArchivedReview, ArchivedTicket, Review, Ticket, TicketRating
+)
+
+DEFAULT_ARCHIVE = {
+    # Age, in days, of the posts moved to the archive tables.
+    'AGE_DAYS': 365,
+    # Tickets archived per transaction, with their reviews.
+    'BATCH_SIZE': 500,
+}
+ARCHIVE_PAGE_SIZE = 50
+# Order of the kinds of posts created at the same time, within a page.
+KIND_RANKS = {'TICKET': 1, 'REVIEW': 0}
+
+
+def get_archive_settings():
+    """Return the archive settings, merged over the defaults."""
+    return {**DEFAULT_ARCHIVE, **getattr(settings, 'ARCHIVE', {})}
+
+
+def archive_cutoff(age_days=None):
+    """Return the creation time before which posts are archived."""
+    if age_days is None:
+        age_days = get_archive_settings()['AGE_DAYS']
+    return timezone.now() - timedelta(days=age_days)
+
+
+def archivable_tickets(cutoff):
+    """Return the tickets older than cutoff without any newer review."""
+    recent_reviews = Review.objects.filter(
+        ticket=OuterRef('pk'), time_created__gte=cutoff
+    )
+    return Ticket.objects.filter(time_created__lt=cutoff).exclude(
+        Exists(recent_reviews)
+    )
+
+
+def copy_rows(queryset, archive_model):
+    """Insert the rows of a queryset into an archive table."""
+    names = [
+        field.attname for field in archive_model._meta.concrete_fields
+        if field.name != 'time_archived'
+    ]
+    return len(archive_model.objects.bulk_create(
+        archive_model(**row) for row in queryset.values(*names)
+    ))
+
+
+class Archiver:
+    """Archive tickets and their reviews in batches and report progress."""
+
+    def __init__(self, batch_size=None, progress=None):
+        self.batch_size = (
+            batch_size or get_archive_settings()['BATCH_SIZE']
+        )
+        self.progress = progress
+        self.counts = {'tickets': 0, 'reviews': 0}
+
+    def report(self):
+        """Send the current counts to the progress callback."""
+        if self.progress is not None:
+            self.progress(dict(self.counts))
+
+    @atomic_write
+    def archive_batch(self, tickets, after_id):
+        """
+        Archive the tickets following after_id in primary key order, up to
+        the batch size, and return their ids and their review count.
+        """
+        ids = list(
+            tickets.filter(pk__gt=after_id).order_by('pk')
+            .values_list('pk', flat=True)[:self.batch_size]
+        )
+        if not ids:
+            return ids, 0
+        reviews = Review.objects.filter(ticket_id__in=ids)
+        copy_rows(Ticket.objects.filter(pk__in=ids), ArchivedTicket)
+        review_count = copy_rows(reviews, ArchivedReview)
+        # Skip the collector: post_delete would remove the image files,
+        # which the archived tickets keep, and update each rating.
+        using = Ticket.objects.db
+        reviews._raw_delete(using)
+        TicketRating.objects.filter(ticket_id__in=ids)._raw_delete(using)
+        Ticket.objects.filter(pk__in=ids)._raw_delete(using)
+        # Nor any cache invalidation: drop the cached tickets once moved.
+        transaction.on_commit(lambda: ticket_cache.delete(*ids))
+        return ids, review_count
+
+    def archive(self, cutoff):
+        """Archive every ticket older than cutoff, with its reviews."""
+        tickets = archivable_tickets(cutoff)
+        last_id = 0
+        while True:
+            ids, review_count = self.archive_batch(tickets, last_id)
+            if not ids:
+                break
+            last_id = ids[-1]
+            self.counts['tickets'] += len(ids)
+            self.counts['reviews'] += review_count
+            self.report()
+
+
+def format_cursor(item):
+    """Return the cursor of the page following an archived post."""
+    return f'{item.time_created.isoformat()}|{item.content_type}|{item.pk}'
+
+
+def parse_cursor(value):
+    """
+    Return the (creation time, kind, id) of a cursor, or raise ValueError.
+    """
+    time_created, kind, pk = value.split('|')
+    time_created = parse_datetime(time_created)
+    if time_created is None or kind not in KIND_RANKS:
+        raise ValueError(f"Invalid cursor: {value!r}")
+    if timezone.is_naive(time_created):
+        time_created = timezone.make_aware(time_created)
+    return time_created, kind, int(pk)
+
+
+def after_cursor(queryset, kind, cursor):
+    """Return the posts of a kind that follow the cursor."""
+    time_created, cursor_kind, pk = cursor
+    rank, cursor_rank = KIND_RANKS[kind], KIND_RANKS[cursor_kind]
+    if rank < cursor_rank:
+        return queryset.filter(time_created__lte=time_created)
+    if rank > cursor_rank:
+        return queryset.filter(time_created__lt=time_created)
+    return queryset.filter(
+        Q(time_created__lt=time_created)
+        | Q(time_created=time_created, pk__lt=pk)
+    )
+
+
+def archived_page(tickets, reviews, before=None, size=ARCHIVE_PAGE_SIZE):
+    """
+    Return a page of archived tickets and reviews following the cursor
+    before, most recent first, and the cursor of the next page or None.
+    """
+    querysets = []
+    for queryset, kind in ((tickets, 'TICKET'), (reviews, 'REVIEW')):
+        if before is not None:
+            queryset = after_cursor(queryset, kind, before)
+        querysets.append(
+            queryset.annotate(content_type=Value(kind, CharField()))
+            .order_by('-time_created', '-pk')[:size + 1]
+        )
+    items = list(islice(
+        merge(
+            *querysets,
+            key=lambda item: (
+                item.time_created, KIND_RANKS[item.content_type], item.pk
+            ),
+            reverse=True,
+        ),
+        size + 1
+    ))
+    if len(items) <= size:
+        return items, None
+    items = items[:size]
+    return items, format_cursor(items[-1])
@@ -0,0 +1,191 @@
+"""
+Cache hot lookups in two tiers: a bounded LRU in each process in front of
+the shared Django cache.
+Keys are versioned per namespace, so that a whole namespace is invalidated
+by incrementing its version. Entries of the process tier expire after a
+short time: it is the delay after which other workers see an invalidation.
+A missing value is computed once: threads of a process wait on a lock, and
+workers wait for the holder of a lock key in the shared cache.
+Lookups are counted per namespace and tier in the metrics store.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from litrevu.instrumentation import record
+
+DEFAULT_TWO_TIER_CACHE = {
+    # Seconds an entry is kept in the process tier.
+    'LOCAL_TIMEOUT': 5,
+    # Entries kept in the process tier, per namespace.
+    'LOCAL_MAX_ENTRIES': 1000,
+    # Seconds an entry is kept in the shared cache.
+    'TIMEOUT': 300,
+    # Seconds a worker computing a value holds its lock key.
+    'LOCK_TIMEOUT': 10,
+    # Seconds the other workers wait for the value before computing it.
+    'LOCK_WAIT': 2,
+}
+LOCK_POLL_INTERVAL = 0.02
+LOCK_STRIPES = 64
+
+MISSING = object()
+
+
+def get_two_tier_cache_settings():
+    """Return the two-tier cache settings, merged over the defaults."""
+    return {
+        **DEFAULT_TWO_TIER_CACHE,
+        **getattr(settings, 'TWO_TIER_CACHE', {}),
+    }
+
+
+class LocalCache:
+    """Thread-safe LRU of values expiring after a timeout."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of a key, or MISSING."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries."""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache:
+    """Cache of the values of a namespace, computed once on a miss."""
+
+    def __init__(self, namespace):
+        config = get_two_tier_cache_settings()
+        self.namespace = namespace
+        self.timeout = config['TIMEOUT']
+        self.lock_timeout = config['LOCK_TIMEOUT']
+        self.lock_wait = config['LOCK_WAIT']
+        self.local = LocalCache(
+            config['LOCAL_MAX_ENTRIES'], config['LOCAL_TIMEOUT']
+        )
+        self.version_key = f'reviews:cache:{namespace}:version'
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def count(self, outcome):
+        """Count a lookup in the metrics store."""
+        record(
+            'increment', f'litrevu_cache_{outcome}_total', self.namespace, 1
+        )
+
+    def version(self):
+        """Return the current version of the namespace."""
+        version = self.local.get(self.version_key)
+        if version is MISSING:
+            # Versions start from the clock, so that a version evicted
+            # from the shared cache is not reused.
+            cache.add(self.version_key, time.time_ns(), timeout=None)
+            version = cache.get(self.version_key, 0)
+            self.local.set(self.version_key, version)
+        return version
+
+    def make_key(self, key):
+        return f'reviews:cache:{self.namespace}:{self.version()}:{key}'
+
+    def get_or_set(self, key, compute):
+        """
+        Return the cached value of a key, computing it with compute() and
+        caching it when missing. None is cached like any other value.
+        """
+        full_key = self.make_key(key)
+        value = self.local.get(full_key)
+        if value is not MISSING:
+            self.count('local_hits')
+            return value
+        value = self.shared_get(full_key)
+        if value is not MISSING:
+            self.local.set(full_key, value)
+            self.count('shared_hits')
+            return value
+        lock = self.locks[zlib.crc32(full_key.encode()) % LOCK_STRIPES]
+        with lock:
+            # Another thread may have computed the value meanwhile.
+            value = self.local.get(full_key)
+            if value is not MISSING:
+                self.count('local_hits')
+                return value
+            return self.compute(full_key, compute)
+
+    def shared_get(self, full_key):
+        """Return a value of the shared cache, or MISSING."""
+        # Values are wrapped so that a cached None is not a miss.
+        wrapped = cache.get(full_key)
+        return MISSING if wrapped is None else wrapped[0]
+
+    def compute(self, full_key, compute):
+        """
+        Compute a value, unless another worker holding the lock key stores
+        it within the lock wait.
+        """
+        lock_key = f'{full_key}:lock'
+        locked = cache.add(lock_key, 1, timeout=self.lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                value = self.shared_get(full_key)
+                if value is not MISSING:
+                    self.local.set(full_key, value)
+                    self.count('waits')
+                    return value
+        try:
+            value = compute()
+            cache.set(full_key, (value,), timeout=self.timeout)
+            self.local.set(full_key, value)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        self.count('misses')
+        return value
+
+    def delete(self, *keys):
+        """Drop the cached values of some keys."""
+        full_keys = [self.make_key(key) for key in keys]
+        cache.delete_many(full_keys)
+        for full_key in full_keys:
+            self.local.delete(full_key)
+
+    def invalidate(self):
+        """Drop every value of the namespace by moving to a new version."""
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, time.time_ns(), timeout=None)
+        self.local.clear()
@@ -0,0 +1,231 @@
+"""
+Handle bulk deletion of tickets, reviews and user accounts, archived
+posts included.
+Rows are deleted in batches, each in its own short transaction, without
+firing per-row signals; the rating aggregates of the affected tickets are
+refreshed once per batch, and their post log events and cached tickets
+are dropped with them, as are the cached follow lists and suggestions of
+deleted follows. Image files are removed after each commit by a pool
+of worker threads; failed removals are logged.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from reviews.lookups import invalidate_follows, ticket_cache
+from reviews.models import (
+    ArchivedReview, ArchivedTicket, PostEvent, Review, Ticket, TicketRating,
+    UserFollows
+)
+from reviews.ratings import refresh_ticket_ratings
+from reviews.suggestions import invalidate_suggestions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FILE_WORKERS = 4
+
+
+def remove_files(names):
+    """
+    Remove the given files from the storage, ignoring missing ones. Files
+    that cannot be removed are logged and skipped.
+    """
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.exception("Could not remove file %s", name)
+
+
+def log_failed_removal(future):
+    """Log the error of a file removal task."""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(
+            "File removal failed", exc_info=future.exception()
+        )
+
+
+def delete_events(kind, object_ids):
+    """Delete the post log events of the given tickets or reviews."""
+    PostEvent.objects.filter(
+        kind=kind, object_id__in=object_ids
+    )._raw_delete(PostEvent.objects.db)
+
+
+class BulkDeleter:
+    """Delete tickets and reviews in batches and report progress."""
+
+    def __init__(
+        self,
+        batch_size=DEFAULT_BATCH_SIZE,
+        file_workers=DEFAULT_FILE_WORKERS,
+        progress=None,
+    ):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.executor = ThreadPoolExecutor(max_workers=file_workers)
+        self.futures = []
+        self.counts = {'tickets': 0, 'reviews': 0, 'follows': 0, 'files': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Wait for pending file removals and stop the worker pool."""
+        wait(self.futures)
+        self.executor.shutdown()
+
+    def report(self):
+        """Send the current counts to the progress callback."""
+        if self.progress is not None:
+            self.progress(dict(self.counts))
+
+    def schedule_file_removal(self, names):
+        """Remove the files in the worker pool once the batch is committed."""
+        if not names:
+            return
+        self.counts['files'] += len(names)
+        transaction.on_commit(lambda: self.submit_file_removal(names))
+
+    def submit_file_removal(self, names):
+        future = self.executor.submit(remove_files, names)
+        future.add_done_callback(log_failed_removal)
+        self.futures.append(future)
+
+    def delete_tickets(self, tickets):
+        """Delete the given tickets, their reviews and image files."""
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    tickets.order_by('pk')
+                    .values_list('pk', 'image')[:self.batch_size]
+                )
+                if not batch:
+                    break
+                ids = [pk for pk, _ in batch]
+                # Skip the collector: post_delete would update the ratings
+                # of each review and remove each image inside the
+                # transaction, which schedule_file_removal defers.
+                using = Ticket.objects.db
+                reviews = Review.objects.filter(ticket_id__in=ids)
+                delete_events(PostEvent.REVIEW, reviews.values('pk'))
+                delete_events(PostEvent.TICKET, ids)
+                self.counts['reviews'] += reviews._raw_delete(using)
+                TicketRating.objects.filter(
+                    ticket_id__in=ids
+                )._raw_delete(using)
+                self.counts['tickets'] += Ticket.objects.filter(
+                    pk__in=ids
+                )._raw_delete(using)
+                self.schedule_file_removal(
+                    [image for _, image in batch if image]
+                )
+                # The deletes sent no signals: drop the cached tickets.
+                transaction.on_commit(
+                    lambda ids=ids: ticket_cache.delete(*ids)
+                )
+            self.report()
+
+    def delete_reviews(self, reviews):
+        """Delete the given reviews."""
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    reviews.order_by('pk')
+                    .values_list('pk', 'ticket_id')[:self.batch_size]
+                )
+                if not batch:
+                    return
+                ids = [pk for pk, _ in batch]
+                delete_events(PostEvent.REVIEW, ids)
+                self.counts['reviews'] += Review.objects.filter(
+                    pk__in=ids
+                )._raw_delete(Review.objects.db)
+                refresh_ticket_ratings({ticket_id for _, ticket_id in batch})
+            self.report()
+
+    def delete_archived_reviews(self, reviews):
+        """Delete the given archived reviews."""
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    reviews.order_by('pk')
+                    .values_list('pk', flat=True)[:self.batch_size]
+                )
+                if not ids:
+                    return
+                self.counts['reviews'] += ArchivedReview.objects.filter(
+                    pk__in=ids
+                )._raw_delete(ArchivedReview.objects.db)
+            self.report()
+
+    def delete_archived_tickets(self, tickets):
+        """Delete the given archived tickets, their reviews and images."""
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    tickets.order_by('pk')
+                    .values_list('pk', 'image')[:self.batch_size]
+                )
+                if not batch:
+                    return
+                ids = [pk for pk, _ in batch]
+                using = ArchivedTicket.objects.db
+                self.counts['reviews'] += ArchivedReview.objects.filter(
+                    ticket_id__in=ids
+                )._raw_delete(using)
+                self.counts['tickets'] += ArchivedTicket.objects.filter(
+                    pk__in=ids
+                )._raw_delete(using)
+                self.schedule_file_removal(
+                    [image for _, image in batch if image]
+                )
+            self.report()
+
+    def delete_follows(self, follows):
+        """
+        Delete the given follows, then drop the follow lists and the
+        suggestions they changed once each batch is committed.
+        """
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    follows.order_by('pk').values_list(
+                        'pk', 'user_id', 'followed_user_id'
+                    )[:self.batch_size]
+                )
+                if not batch:
+                    return
+                self.counts['follows'] += UserFollows.objects.filter(
+                    pk__in=[pk for pk, _, _ in batch]
+                )._raw_delete(UserFollows.objects.db)
+                pairs = [(user_id, followed) for _, user_id, followed in batch]
+                transaction.on_commit(
+                    lambda pairs=pairs: self.drop_cached_follows(pairs)
+                )
+            self.report()
+
+    @staticmethod
+    def drop_cached_follows(pairs):
+        """Drop the caches depending on the deleted (user, followed) ids."""
+        invalidate_follows(pairs)
+        invalidate_suggestions({user_id for user_id, _ in pairs})
+
+    def delete_user(self, user):
+        """Delete a user account and everything it has posted."""
+        self.delete_reviews(Review.objects.filter(user=user))
+        self.delete_tickets(Ticket.objects.filter(user=user))
+        self.delete_archived_reviews(ArchivedReview.objects.filter(user=user))
+        self.delete_archived_tickets(ArchivedTicket.objects.filter(user=user))
+        self.delete_follows(UserFollows.objects.filter(user=user))
+        self.delete_follows(UserFollows.objects.filter(followed_user=user))
+        with transaction.atomic():
+            user.delete()
+        self.report()
@@ -0,0 +1,177 @@
+"""
+Gather the posts of followed users into periodic digests.
+Saving a ticket or review appends a single event to the post log, whatever
+the number of followers. A digest run reads the events after the cursor of
+the previous run, groups them by author, reads the followers of those
+authors in one query and writes one digest per follower, so that its cost
+grows with the number of events and of their recipients, never with their
+product. The digests, and the cursor, are written in one transaction;
+emails are sent once it is committed.
+"""
+
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Max
+from django.template.loader import render_to_string
+
+from litrevu.writes import atomic_write
+from reviews.models import Digest, DigestRun, PostEvent, UserFollows
+
+User = get_user_model()
+
+DEFAULT_DIGEST = {
+    # Events read by a run; the following ones are left to the next run.
+    'BATCH_SIZE': 50000,
+    # Ticket titles, and review headlines, listed per followed user in a
+    # digest.
+    'TITLES_PER_AUTHOR': 5,
+    'EMAIL_BACKEND': 'django.core.mail.backends.filebased.EmailBackend',
+    'EMAIL_FILE_PATH': 'sent_emails',
+    'EMAIL_SUBJECT': "LITRevu : les nouvelles publications de vos abonnements",
+}
+
+EMAIL_BATCH_SIZE = 500
+
+
+def get_digest_settings():
+    """Return the digest settings, merged over the defaults."""
+    return {**DEFAULT_DIGEST, **getattr(settings, 'DIGEST', {})}
+
+
+def log_post(kind, post, title):
+    """Append a posted ticket or review to the post log."""
+    PostEvent.objects.create(
+        kind=kind, object_id=post.pk, title=title, user_id=post.user_id
+    )
+
+
+def digest_cursor():
+    """Return the id of the last event gathered by a digest run."""
+    return DigestRun.objects.aggregate(
+        cursor=Max('last_event_id')
+    )['cursor'] or 0
+
+
+def summarize_authors(events, titles_per_author):
+    """
+    Return the posts of each author of the events: ticket and review
+    counts, and the latest ticket titles and review headlines, by kind.
+    """
+    authors = defaultdict(lambda: {
+        PostEvent.TICKET: 0, PostEvent.REVIEW: 0,
+        'titles': {PostEvent.TICKET: [], PostEvent.REVIEW: []},
+    })
+    for author_id, kind, title in events:
+        summary = authors[author_id]
+        summary[kind] += 1
+        summary['titles'][kind].append(title)
+    for summary in authors.values():
+        for kind, titles in summary['titles'].items():
+            summary['titles'][kind] = titles[-titles_per_author:][::-1]
+    return authors
+
+
+def build_digests(authors):
+    """
+    Return the digests of the followers of the given authors, by follower
+    id, as (event count, author summaries) pairs.
+    """
+    usernames = dict(
+        User.objects.filter(pk__in=authors).values_list('pk', 'username')
+    )
+    counts = Counter()
+    entries = defaultdict(list)
+    for user_id, author_id in (
+        UserFollows.objects.filter(followed_user_id__in=authors)
+        .values_list('user_id', 'followed_user_id').iterator()
+    ):
+        summary = authors[author_id]
+        counts[user_id] += summary[PostEvent.TICKET]
+        counts[user_id] += summary[PostEvent.REVIEW]
+        entries[user_id].append({
+            'username': usernames[author_id],
+            'tickets': summary[PostEvent.TICKET],
+            'reviews': summary[PostEvent.REVIEW],
+            'ticket_titles': summary['titles'][PostEvent.TICKET],
+            'review_headlines': summary['titles'][PostEvent.REVIEW],
+        })
+    return {
+        user_id: (
+            counts[user_id],
+            sorted(user_entries, key=lambda entry: entry['username'])
+        )
+        for user_id, user_entries in entries.items()
+    }
+
+
+@atomic_write
+def run_digest(batch_size=None):
+    """
+    Gather the events following the cursor into digests and advance the
+    cursor. Return the run, or None when there was no new event.
+    """
+    config = get_digest_settings()
+    start = time.perf_counter()
+    events = list(
+        PostEvent.objects.filter(pk__gt=digest_cursor()).order_by('pk')
+        .values_list('pk', 'user_id', 'kind', 'title')
+        [:batch_size or config['BATCH_SIZE']]
+    )
+    if not events:
+        return None
+    authors = summarize_authors(
+        [event[1:] for event in events], config['TITLES_PER_AUTHOR']
+    )
+    digests = build_digests(authors)
+    run = DigestRun.objects.create(
+        last_event_id=events[-1][0],
+        event_count=len(events),
+        digest_count=len(digests),
+        duration=0,
+    )
+    Digest.objects.bulk_create(
+        Digest(user_id=user_id, run=run, event_count=count, authors=entries)
+        for user_id, (count, entries) in digests.items()
+    )
+    run.duration = time.perf_counter() - start
+    run.save(update_fields=['duration'])
+    return run
+
+
+def prune_events(run):
+    """Delete the events gathered up to a run."""
+    return PostEvent.objects.filter(pk__lte=run.last_event_id).delete()[0]
+
+
+def send_digest_emails(run):
+    """
+    Email the digests of a run to their users with the digest email
+    backend and return the number of emails sent. Users without an email
+    address are skipped.
+    """
+    config = get_digest_settings()
+    connection = get_connection(
+        config['EMAIL_BACKEND'],
+        file_path=settings.BASE_DIR / config['EMAIL_FILE_PATH'],
+    )
+    digests = run.digests.select_related('user').exclude(
+        user__email=''
+    ).iterator(chunk_size=EMAIL_BATCH_SIZE)
+    sent = 0
+    while batch := list(islice(digests, EMAIL_BATCH_SIZE)):
+        sent += connection.send_messages([
+            EmailMessage(
+                subject=config['EMAIL_SUBJECT'],
+                body=render_to_string('reviews/digest_email.txt', {
+                    'digest': digest,
+                }),
+                to=[digest.user.email],
+            )
+            for digest in batch
+        ]) or 0
+    return sent
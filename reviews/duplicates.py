@@ -0,0 +1,253 @@
+"""
+Find tickets whose titles nearly match, to suggest existing tickets before
+a duplicate is created and to cluster the duplicates already posted.
+Titles are indexed by trigram in memory: each process loads the index when
+it is warmed up, or in the background on first use, and picks up the
+tickets created since, by any process, with a primary key range scan.
+Candidates are read from the rarest trigrams of a title only, within a
+fixed number of postings, then scored against the stored titles.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+
+from django.db import DatabaseError, connection
+
+from reviews.models import Ticket
+
+logger = logging.getLogger(__name__)
+
+MIN_SIMILARITY = 0.4
+SIMILAR_TICKETS_COUNT = 5
+# Candidates scored against their titles for each lookup.
+CANDIDATES_COUNT = 50
+# Postings read by a lookup: trigrams shared by too many titles, such as
+# those of articles, are skipped to bound the lookup time.
+MAX_POSTINGS_READ = 5000
+# Seconds between two scans for tickets created by other processes.
+REFRESH_INTERVAL = 1.0
+
+
+def normalize_title(title):
+    """Return the title in lower case, without accents or punctuation."""
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return re.sub(r'[\W_]+', ' ', title.lower()).strip()
+
+
+def title_trigrams(title):
+    """Return the set of trigrams of the words of a title."""
+    trigrams = set()
+    for word in normalize_title(title).split():
+        word = f'  {word} '
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def similarity(trigrams, other_trigrams):
+    """Return the Jaccard similarity of two trigram sets."""
+    if not trigrams or not other_trigrams:
+        return 0.0
+    shared = len(trigrams & other_trigrams)
+    return shared / (len(trigrams) + len(other_trigrams) - shared)
+
+
+class TitleIndex:
+    """
+    Inverted index from title trigrams to ticket ids.
+    Postings are only ever appended to: tickets deleted or renamed since
+    they were indexed are discarded when candidates are scored against the
+    current titles.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.last_id = 0
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+        self.loader = None
+
+    @property
+    def loaded(self):
+        return self.refreshed_at is not None
+
+    @property
+    def nbytes(self):
+        """Return the memory used by the posting arrays."""
+        return sum(
+            postings.buffer_info()[1] * postings.itemsize
+            for postings in self.postings.values()
+        )
+
+    def add(self, ticket_id, title):
+        """Index the title of a ticket."""
+        for trigram in title_trigrams(title):
+            postings = self.postings.get(trigram)
+            if postings is None:
+                postings = self.postings[trigram] = array('q')
+            postings.append(ticket_id)
+
+    def add_tickets(self, tickets):
+        """Index (ticket id, title) pairs ordered by id."""
+        for ticket_id, title in tickets:
+            self.add(ticket_id, title)
+            self.last_id = max(self.last_id, ticket_id)
+
+    def refresh(self, force=False):
+        """Index the tickets created since the last refresh."""
+        now = time.monotonic()
+        if (
+            not force and self.loaded
+            and now - self.refreshed_at < REFRESH_INTERVAL
+        ):
+            return
+        with self.lock:
+            self.add_tickets(
+                Ticket.objects.filter(pk__gt=self.last_id).order_by('pk')
+                .values_list('pk', 'title').iterator(chunk_size=10000)
+            )
+            self.refreshed_at = now
+
+    def load_in_background(self):
+        """Build the index in a thread, once."""
+        with self.lock:
+            if self.loader is None:
+                self.loader = threading.Thread(target=self.load, daemon=True)
+                self.loader.start()
+
+    def load(self):
+        """
+        Build the index from the tickets table. A failed load is logged and
+        started again by the next lookup.
+        """
+        try:
+            self.refresh(force=True)
+        except DatabaseError:
+            logger.exception("Could not load the title index")
+            with self.lock:
+                self.loader = None
+        finally:
+            connection.close()
+
+    def candidates(self, trigrams, min_similarity=MIN_SIMILARITY,
+                   count=CANDIDATES_COUNT, max_read=MAX_POSTINGS_READ):
+        """
+        Return up to count (ticket id, shared trigrams) pairs for tickets
+        that may reach min_similarity with the given trigrams.
+        A title reaching it shares at least min_similarity of the trigrams,
+        so it appears in the postings of the rarest ones, which are the
+        only ones read. Postings past max_read are left out, making the
+        result approximate for titles made of common words.
+        """
+        postings = sorted(
+            (self.postings.get(trigram, ()) for trigram in trigrams), key=len
+        )
+        required = max(1, math.ceil(min_similarity * len(postings)))
+        counts = Counter()
+        read = 0
+        for ticket_ids in postings[:len(postings) - required + 1]:
+            read += len(ticket_ids)
+            if read > max_read:
+                break
+            counts.update(ticket_ids)
+        return counts.most_common(count)
+
+
+title_index = TitleIndex()
+
+
+def find_similar_tickets(title, exclude_id=None,
+                         min_similarity=MIN_SIMILARITY,
+                         count=SIMILAR_TICKETS_COUNT):
+    """
+    Return the existing tickets whose title is close to a title.
+    No tickets are found until the index of the process is loaded.
+    """
+    trigrams = title_trigrams(title)
+    if not trigrams:
+        return []
+    if not title_index.loaded:
+        title_index.load_in_background()
+        return []
+    title_index.refresh()
+    candidate_ids = [
+        ticket_id
+        for ticket_id, _ in title_index.candidates(trigrams, min_similarity)
+        if ticket_id != exclude_id
+    ]
+    tickets = Ticket.objects.filter(pk__in=candidate_ids).select_related(
+        'user'
+    ).only('title', 'time_created', 'user__username')
+    scored = [
+        (similarity(trigrams, title_trigrams(ticket.title)), ticket)
+        for ticket in tickets
+    ]
+    scored = [item for item in scored if item[0] >= min_similarity]
+    scored.sort(key=lambda item: (-item[0], item[1].pk))
+    return [ticket for _, ticket in scored[:count]]
+
+
+def index_ticket(ticket):
+    """
+    Add a saved ticket to the index of this process, if loaded: a new
+    ticket with the range scan, so that it is indexed once, and a renamed
+    ticket under its new title.
+    Call it once the ticket is committed: the id of a rolled back ticket
+    is given to the next one, which the range scan would skip.
+    """
+    if not title_index.loaded:
+        return
+    if ticket.pk > title_index.last_id:
+        title_index.refresh(force=True)
+    elif getattr(ticket, '_stored_title', ticket.title) != ticket.title:
+        with title_index.lock:
+            title_index.add(ticket.pk, ticket.title)
+
+
+def cluster_duplicates(tickets, min_similarity=MIN_SIMILARITY,
+                       max_read=MAX_POSTINGS_READ):
+    """
+    Group near-duplicate tickets from (ticket id, title) pairs ordered by
+    id. Return the clusters of at least two ticket ids, oldest first.
+    """
+    index = TitleIndex()
+    trigrams_by_id = {}
+    for ticket_id, title in tickets:
+        trigrams_by_id[ticket_id] = title_trigrams(title)
+        index.add(ticket_id, title)
+
+    parents = {}
+
+    def find(ticket_id):
+        root = ticket_id
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while ticket_id != root:
+            parents[ticket_id], ticket_id = root, parents[ticket_id]
+        return root
+
+    for ticket_id, trigrams in trigrams_by_id.items():
+        for candidate_id, _ in index.candidates(
+            trigrams, min_similarity, max_read=max_read
+        ):
+            if candidate_id <= ticket_id:
+                continue
+            score = similarity(trigrams, trigrams_by_id[candidate_id])
+            if score >= min_similarity:
+                root, other = find(ticket_id), find(candidate_id)
+                if root != other:
+                    parents[max(root, other)] = min(root, other)
+
+    clusters = {}
+    for ticket_id in parents:
+        clusters.setdefault(find(ticket_id), []).append(ticket_id)
+    for root, ticket_ids in clusters.items():
+        ticket_ids.append(root)
+        ticket_ids.sort()
+    return sorted(clusters.values(), key=lambda ids: ids[0])
@@ -0,0 +1,176 @@
+"""
+Push new feed item notices to connected users as server-sent events.
+A single poller per process reads the new tickets and reviews with a
+primary key range scan and dispatches a notice to each connected user whose
+feed they belong to, so clients never query the database themselves.
+Clients then fetch the items from the feed updates endpoint.
+"""
+
+import asyncio
+import json
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db.models import Max
+from django.http import parse_cookie
+
+from reviews.lookups import get_followed_ids
+from reviews.models import Ticket, Review
+
+FEED_EVENTS_PATH = '/feed/events/'
+POLL_INTERVAL = 2
+KEEPALIVE_INTERVAL = 15
+# Streams are closed periodically so that reconnecting clients pick up
+# follow changes.
+MAX_STREAM_DURATION = 300
+
+
+def load_user_follows(cookie_header):
+    """Return the user id and followed user ids of a session cookie."""
+    cookies = parse_cookie(cookie_header)
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None, set()
+    engine = import_module(settings.SESSION_ENGINE)
+    user = get_user(SimpleNamespace(session=engine.SessionStore(session_key)))
+    if not user.is_authenticated:
+        return None, set()
+    return user.id, get_followed_ids(user.id)
+
+
+def latest_ids():
+    """Return the highest ticket and review primary keys."""
+    return (
+        Ticket.objects.aggregate(last=Max('pk'))['last'] or 0,
+        Review.objects.aggregate(last=Max('pk'))['last'] or 0,
+    )
+
+
+def fetch_new_items(last_ticket_id, last_review_id):
+    """
+    Return the authors of the tickets created after last_ticket_id and the
+    authors and ticket owners of the reviews created after last_review_id.
+    """
+    tickets = list(
+        Ticket.objects.filter(pk__gt=last_ticket_id)
+        .order_by('pk').values_list('pk', 'user_id')
+    )
+    reviews = list(
+        Review.objects.filter(pk__gt=last_review_id)
+        .order_by('pk').values_list('pk', 'user_id', 'ticket__user_id')
+    )
+    return tickets, reviews
+
+
+class FeedBroadcaster:
+    """Poll new items once per process and notify the subscribed users."""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.subscribers = {}
+        self.task = None
+
+    def subscribe(self, user_id, followed_ids):
+        """Return a queue receiving the number of new items for a user."""
+        queue = asyncio.Queue()
+        self.subscribers[queue] = (user_id, followed_ids)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        """Stop sending notices to a queue."""
+        self.subscribers.pop(queue, None)
+
+    async def run(self):
+        """Poll the database while users are subscribed."""
+        last_ticket_id, last_review_id = await sync_to_async(latest_ids)()
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            tickets, reviews = await sync_to_async(fetch_new_items)(
+                last_ticket_id, last_review_id
+            )
+            if tickets:
+                last_ticket_id = tickets[-1][0]
+            if reviews:
+                last_review_id = reviews[-1][0]
+            if tickets or reviews:
+                self.dispatch(tickets, reviews)
+
+    def dispatch(self, tickets, reviews):
+        """Send each subscriber the number of new items of their feed."""
+        for queue, (user_id, followed_ids) in list(self.subscribers.items()):
+            count = sum(
+                1 for _, author_id in tickets if author_id in followed_ids
+            ) + sum(
+                1 for _, author_id, owner_id in reviews
+                if author_id != user_id
+                and (author_id in followed_ids or owner_id == user_id)
+            )
+            if count:
+                queue.put_nowait(count)
+
+
+broadcaster = FeedBroadcaster()
+
+
+async def wait_for_disconnect(receive):
+    """Return once the client has disconnected."""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def feed_events(scope, receive, send):
+    """Stream new feed item notices to the logged-in user."""
+    headers = dict(scope['headers'])
+    user_id, followed_ids = await sync_to_async(load_user_follows)(
+        headers.get(b'cookie', b'').decode('latin-1')
+    )
+    if user_id is None:
+        await send({
+            'type': 'http.response.start',
+            'status': 403,
+            'headers': [(b'content-type', b'text/plain')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Forbidden'})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+        ],
+    })
+    queue = broadcaster.subscribe(user_id, followed_ids)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAX_STREAM_DURATION
+    try:
+        while not disconnect.done() and loop.time() < deadline:
+            try:
+                count = await asyncio.wait_for(
+                    queue.get(), KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                event = ': keep-alive\n\n'
+            else:
+                event = (
+                    f'event: new-items\n'
+                    f'data: {json.dumps({"count": count})}\n\n'
+                )
+            await send({
+                'type': 'http.response.body',
+                'body': event.encode(),
+                'more_body': True,
+            })
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broadcaster.unsubscribe(queue)
+        disconnect.cancel()
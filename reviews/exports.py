@@ -0,0 +1,124 @@
+"""
+Serialize a user's tickets and reviews for download.
+Rows are produced lazily from database iterators so that an export uses
+constant memory, whatever the size of the user's history.
+"""
+
+import csv
+import json
+from heapq import merge
+
+from reviews.models import ArchivedReview, ArchivedTicket, Review, Ticket
+
+EXPORT_CHUNK_SIZE = 500
+TICKET_MODELS = (Ticket, ArchivedTicket)
+
+CSV_HEADER = [
+    'type', 'id', 'time_created', 'title', 'description', 'image_url',
+    'headline', 'rating', 'body', 'ticket_id', 'ticket_title',
+    'ticket_description', 'ticket_image_url', 'ticket_user',
+]
+
+
+class Echo:
+    """Pseudo-buffer returning written values instead of storing them."""
+
+    def write(self, value):
+        """Return the value to write."""
+        return value
+
+
+def image_url(request, ticket):
+    """Return the absolute URL of the ticket image, or an empty string."""
+    if not ticket.image:
+        return ''
+    return request.build_absolute_uri(ticket.image.url)
+
+
+def ticket_to_dict(request, ticket):
+    """Return the exported fields of a ticket."""
+    return {
+        'id': ticket.id,
+        'time_created': ticket.time_created.isoformat(),
+        'title': ticket.title,
+        'description': ticket.description,
+        'image_url': image_url(request, ticket),
+        'user': ticket.user.username,
+    }
+
+
+def review_to_dict(request, review):
+    """Return the exported fields of a review with its embedded ticket."""
+    return {
+        'id': review.id,
+        'time_created': review.time_created.isoformat(),
+        'headline': review.headline,
+        'rating': review.rating,
+        'body': review.body,
+        'ticket': ticket_to_dict(request, review.ticket),
+    }
+
+
+def iter_user_posts(user):
+    """
+    Yield the user's tickets and reviews, archived ones included, in
+    reverse chronological order.
+    The querysets are read in chunks and merged on the fly.
+    """
+    querysets = [
+        model.objects.filter(user=user)
+        .select_related(related)
+        .order_by('-time_created')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        for model, related in (
+            (Ticket, 'user'),
+            (Review, 'ticket__user'),
+            (ArchivedTicket, 'user'),
+            (ArchivedReview, 'ticket__user'),
+        )
+    ]
+    return merge(
+        *querysets,
+        key=lambda item: item.time_created,
+        reverse=True
+    )
+
+
+def iter_jsonl(request, user):
+    """Yield one JSON document per line for each ticket and review."""
+    for item in iter_user_posts(user):
+        if isinstance(item, TICKET_MODELS):
+            data = {'type': 'ticket', **ticket_to_dict(request, item)}
+        else:
+            data = {'type': 'review', **review_to_dict(request, item)}
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+
+def iter_csv(request, user):
+    """Yield CSV lines, one per ticket and review, after a header line."""
+    writer = csv.DictWriter(Echo(), fieldnames=CSV_HEADER)
+    yield writer.writerow(dict(zip(CSV_HEADER, CSV_HEADER)))
+    for item in iter_user_posts(user):
+        if isinstance(item, TICKET_MODELS):
+            row = ticket_to_dict(request, item)
+            row['type'] = 'ticket'
+            del row['user']
+        else:
+            data = review_to_dict(request, item)
+            ticket = data.pop('ticket')
+            row = {
+                'type': 'review',
+                **data,
+                'ticket_id': ticket['id'],
+                'ticket_title': ticket['title'],
+                'ticket_description': ticket['description'],
+                'ticket_image_url': ticket['image_url'],
+                'ticket_user': ticket['user'],
+            }
+        yield writer.writerow(row)
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,150 @@
+"""
+Build the querysets of the tickets and reviews visible in a user's feed.
+Each set is expressed as a single query, so that it can be filtered on
+time_created and read with an index range scan.
+"""
+
+from heapq import merge
+from operator import attrgetter
+
+from django.db.models import CharField, Exists, OuterRef, Q, Value
+
+from reviews.models import (
+    ArchivedReview, ArchivedTicket, Review, Ticket, UserFollows
+)
+
+FEED_UPDATES_LIMIT = 100
+FEED_CHUNK_SIZE = 200
+
+
+def feed_user_ids(user):
+    """Return a subquery of the ids of the users followed by the user."""
+    return UserFollows.objects.filter(user=user).values('followed_user_id')
+
+
+def visible_tickets(user):
+    """
+    Return the tickets of the user and followed users, excluding tickets
+    reviewed by their own author, with their feed annotations.
+    """
+    self_reviewed = Review.objects.filter(
+        ticket=OuterRef('pk'), user=OuterRef('user')
+    )
+    return (
+        Ticket.objects
+        .filter(Q(user=user) | Q(user_id__in=feed_user_ids(user)))
+        .exclude(Exists(self_reviewed))
+        .annotate(
+            content_type=Value('TICKET', CharField()),
+            has_review=Exists(Review.objects.filter(ticket=OuterRef('pk'))),
+        )
+        .select_related('user')
+    )
+
+
+def visible_reviews(user):
+    """
+    Return the reviews of the user and followed users, and the reviews of
+    the user's tickets.
+    """
+    return (
+        Review.objects
+        .filter(
+            Q(user=user)
+            | Q(user_id__in=feed_user_ids(user))
+            | Q(ticket__user=user)
+        )
+        .annotate(content_type=Value('REVIEW', CharField()))
+        .select_related('user', 'ticket__user')
+    )
+
+
+def archived_tickets(user):
+    """
+    Return the archived tickets of the user and followed users, excluding
+    tickets reviewed by their own author. Archived tickets cannot be
+    reviewed any more.
+    """
+    self_reviewed = ArchivedReview.objects.filter(
+        ticket=OuterRef('pk'), user=OuterRef('user')
+    )
+    return (
+        ArchivedTicket.objects
+        .filter(Q(user=user) | Q(user_id__in=feed_user_ids(user)))
+        .exclude(Exists(self_reviewed))
+        .select_related('user')
+    )
+
+
+def archived_reviews(user):
+    """
+    Return the archived reviews of the user and followed users, and those
+    of the user's archived tickets.
+    """
+    return (
+        ArchivedReview.objects
+        .filter(
+            Q(user=user)
+            | Q(user_id__in=feed_user_ids(user))
+            | Q(ticket__user=user)
+        )
+        .select_related('user', 'ticket__user')
+    )
+
+
+def iter_review_button(tickets, user):
+    """
+    Yield the tickets with show_review_button set on those the user may
+    still review.
+    """
+    for ticket in tickets:
+        ticket.show_review_button = (
+            ticket.user_id != user.id and not ticket.has_review
+        )
+        yield ticket
+
+
+def mark_review_button(tickets, user):
+    """Set show_review_button on tickets the user may still review."""
+    return list(iter_review_button(tickets, user))
+
+
+def iter_feed_items(user, chunk_size=FEED_CHUNK_SIZE):
+    """
+    Yield the visible items, most recent first.
+    Both querysets are read in chunks and merged on the fly.
+    """
+    tickets = iter_review_button(
+        visible_tickets(user).order_by('-time_created')
+        .iterator(chunk_size=chunk_size),
+        user
+    )
+    reviews = (
+        visible_reviews(user).order_by('-time_created')
+        .iterator(chunk_size=chunk_size)
+    )
+    return merge(
+        tickets, reviews, key=attrgetter('time_created'), reverse=True
+    )
+
+
+def feed_items_since(user, since, limit=FEED_UPDATES_LIMIT):
+    """
+    Return the oldest `limit` visible items created after `since`, most
+    recent first, and whether more items were created after them.
+    The caller moves its cursor to the most recent returned item, so that
+    the next call returns the following items.
+    """
+    tickets = mark_review_button(
+        visible_tickets(user)
+        .filter(time_created__gt=since)
+        .order_by('time_created')[:limit + 1],
+        user
+    )
+    reviews = (
+        visible_reviews(user)
+        .filter(time_created__gt=since)
+        .order_by('time_created')[:limit + 1]
+    )
+    items = sorted([*tickets, *reviews], key=attrgetter('time_created'))
+    return items[:limit][::-1], len(items) > limit
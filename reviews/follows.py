@@ -0,0 +1,123 @@
+"""
+Handle follow changes and bulk follow imports.
+Resolve a list of usernames in a single query and create the missing
+follow relations in a single insert.
+"""
+
+import csv
+import io
+
+from django.contrib.auth import get_user_model
+
+from litrevu.writes import atomic_write
+from reviews.lookups import invalidate_follows
+from reviews.models import UserFollows
+from reviews.suggestions import invalidate_suggestions
+
+User = get_user_model()
+
+MAX_BULK_FOLLOWS = 1000
+# Bytes of an imported CSV file: enough for MAX_BULK_FOLLOWS usernames of
+# the maximum length, with a few more columns.
+MAX_BULK_FOLLOW_FILE_SIZE = 256 * 1024
+
+FOLLOWED = 'followed'
+ALREADY_FOLLOWED = 'already_followed'
+NOT_FOUND = 'not_found'
+SELF_FOLLOW = 'self'
+
+STATUS_LABELS = {
+    FOLLOWED: 'Abonnement ajouté',
+    ALREADY_FOLLOWED: 'Déjà suivi',
+    NOT_FOUND: 'Utilisateur introuvable',
+    SELF_FOLLOW: 'Vous ne pouvez pas vous suivre vous-même',
+}
+
+
+def parse_usernames(text='', csv_file=None):
+    """
+    Return the unique usernames found in a text and an optional CSV file,
+    in order of first appearance.
+    The text holds one username per line or separated by commas; the CSV
+    file holds one username in the first column of each row.
+    """
+    candidates = text.replace(',', '\n').splitlines()
+    if csv_file is not None:
+        content = io.TextIOWrapper(csv_file, encoding='utf-8-sig')
+        for row in csv.reader(content):
+            if row and row[0].strip().lower() != 'username':
+                candidates.append(row[0])
+
+    usernames = []
+    seen = set()
+    for username in candidates:
+        username = username.strip()
+        if username and username not in seen:
+            seen.add(username)
+            usernames.append(username)
+    return usernames
+
+
+def bulk_follow(user, usernames):
+    """
+    Follow every existing user among the given usernames.
+    Return a list of (username, status) pairs in input order.
+    """
+    users_by_name = dict(
+        User.objects.filter(username__in=usernames)
+        .values_list('username', 'id')
+    )
+    already_followed = set(
+        UserFollows.objects.filter(
+            user=user,
+            followed_user_id__in=users_by_name.values()
+        ).values_list('followed_user_id', flat=True)
+    )
+
+    report = []
+    to_create = []
+    for username in usernames:
+        followed_id = users_by_name.get(username)
+        if followed_id is None:
+            status = NOT_FOUND
+        elif followed_id == user.id:
+            status = SELF_FOLLOW
+        elif followed_id in already_followed:
+            status = ALREADY_FOLLOWED
+        else:
+            status = FOLLOWED
+            to_create.append(
+                UserFollows(user=user, followed_user_id=followed_id)
+            )
+        report.append((username, status))
+
+    create_follows(to_create)
+    # bulk_create sends no signals: invalidate the suggestions and the
+    # follow lists at once.
+    if to_create:
+        invalidate_suggestions([user.id])
+        invalidate_follows(
+            (follow.user_id, follow.followed_user_id) for follow in to_create
+        )
+    return report
+
+
+@atomic_write
+def create_follows(follows):
+    """Insert follow relations, skipping those that already exist."""
+    # The unique_together constraint guards against concurrent imports.
+    UserFollows.objects.bulk_create(follows, ignore_conflicts=True)
+
+
+@atomic_write
+def follow_user(user, followed_user):
+    """Make a user follow another one."""
+    UserFollows.objects.get_or_create(user=user, followed_user=followed_user)
+
+
+@atomic_write
+def unfollow_user(user, followed_user):
+    """Make a user stop following another one."""
+    UserFollows.objects.filter(
+        user=user, followed_user=followed_user
+    ).delete()
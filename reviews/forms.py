@@ -3,7 +3,12 @@ Handle forms for tickets, reviews, and following users.
 
 """
 
+import csv
+
 from django import forms
+from .follows import (
+    MAX_BULK_FOLLOW_FILE_SIZE, MAX_BULK_FOLLOWS, parse_usernames
+)
 from .models import Ticket, Review
 
 
@@ -15,6 +20,16 @@ class TicketForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 4}),
         }
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean_image(self):
+        """Report the image rejected while it was being uploaded."""
+        if 'image' in self.upload_errors:
+            raise forms.ValidationError(self.upload_errors['image'])
+        return self.cleaned_data['image']
+
 
 class ReviewForm(forms.ModelForm):
     class Meta:
@@ -35,3 +50,48 @@ class FollowUserForm(forms.Form):
             'placeholder': "Nom d'utilisateur",
         })
     )
+
+
+class BulkFollowForm(forms.Form):
+    usernames = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={
+            'rows': 4,
+            'placeholder': "Un nom d'utilisateur par ligne",
+        })
+    )
+    csv_file = forms.FileField(required=False)
+
+    def clean_csv_file(self):
+        """Reject the files too large to be parsed."""
+        csv_file = self.cleaned_data['csv_file']
+        if csv_file and csv_file.size > MAX_BULK_FOLLOW_FILE_SIZE:
+            raise forms.ValidationError(
+                f"Le fichier CSV ne doit pas dépasser "
+                f"{MAX_BULK_FOLLOW_FILE_SIZE // 1024} Ko."
+            )
+        return csv_file
+
+    def clean(self):
+        """Parse the usernames from the text and the CSV file."""
+        cleaned_data = super().clean()
+        if self.has_error('csv_file'):
+            return cleaned_data
+        try:
+            usernames = parse_usernames(
+                cleaned_data.get('usernames', ''),
+                cleaned_data.get('csv_file'),
+            )
+        except (UnicodeDecodeError, ValueError, csv.Error):
+            raise forms.ValidationError("Le fichier CSV est illisible.")
+        if not usernames:
+            raise forms.ValidationError(
+                "Indiquez au moins un nom d'utilisateur."
+            )
+        if len(usernames) > MAX_BULK_FOLLOWS:
+            raise forms.ValidationError(
+                f"Vous ne pouvez pas importer plus de {MAX_BULK_FOLLOWS} "
+                f"utilisateurs à la fois."
+            )
+        cleaned_data['username_list'] = usernames
+        return cleaned_data
@@ -0,0 +1,94 @@
+"""
+Cached lookups of the hot paths: users by name or id, follow lists and
+tickets, read through the two-tier cache and invalidated by reviews.signals
+when the underlying rows change.
+"""
+
+import hashlib
+
+from django.contrib.auth import get_user_model
+
+from reviews.caching import TwoTierCache
+from reviews.models import Ticket, UserFollows
+
+User = get_user_model()
+
+user_cache = TwoTierCache('users')
+follow_cache = TwoTierCache('follows')
+ticket_cache = TwoTierCache('tickets')
+
+
+def username_key(username):
+    """
+    Return the cache key of a username, which may hold any character and
+    is hashed to make a valid key for every cache backend.
+    """
+    return f'name:{hashlib.sha256(username.encode()).hexdigest()[:32]}'
+
+
+def get_user_by_username(username):
+    """Return the user with a username, with only its id and username."""
+    return user_cache.get_or_set(
+        username_key(username),
+        lambda: User.objects.only('username').filter(
+            username=username
+        ).first()
+    )
+
+
+def get_user_by_id(user_id):
+    """Return the user with an id, with only its id and username."""
+    return user_cache.get_or_set(
+        f'id:{user_id}',
+        lambda: User.objects.only('username').filter(pk=user_id).first()
+    )
+
+
+def get_following(user_id):
+    """Return the (id, username) pairs of the users followed by a user."""
+    return follow_cache.get_or_set(
+        f'following:{user_id}',
+        lambda: list(
+            UserFollows.objects.filter(user_id=user_id).order_by('pk')
+            .values_list('followed_user_id', 'followed_user__username')
+        )
+    )
+
+
+def get_followers(user_id):
+    """Return the usernames of the followers of a user."""
+    return follow_cache.get_or_set(
+        f'followers:{user_id}',
+        lambda: list(
+            UserFollows.objects.filter(followed_user_id=user_id)
+            .order_by('pk').values_list('user__username', flat=True)
+        )
+    )
+
+
+def get_followed_ids(user_id):
+    """Return the set of the ids of the users followed by a user."""
+    return {followed_id for followed_id, _ in get_following(user_id)}
+
+
+def invalidate_follows(follows):
+    """Drop the follow lists changed by the given (user, followed) ids."""
+    keys = set()
+    for user_id, followed_user_id in follows:
+        keys.add(f'following:{user_id}')
+        keys.add(f'followers:{followed_user_id}')
+    if keys:
+        follow_cache.delete(*keys)
+
+
+def get_ticket(ticket_id):
+    """
+    Return the ticket with an id, with the username of its author, or
+    None. The rest of the author's account is left out of the cache.
+    """
+    return ticket_cache.get_or_set(
+        ticket_id,
+        lambda: Ticket.objects.select_related('user').only(
+            'title', 'description', 'image', 'time_created', 'user__username'
+        ).filter(pk=ticket_id).first()
+    )
@@ -0,0 +1,69 @@
+"""
+Move the tickets and reviews older than the archive age to the archive
+tables, in batches, with progress reporting.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.archive import (
+    Archiver, archivable_tickets, archive_cutoff, get_archive_settings
+)
+
+
+class Command(BaseCommand):
+    help = "Move old tickets and their reviews to the archive tables."
+
+    def add_arguments(self, parser):
+        config = get_archive_settings()
+        parser.add_argument(
+            '--age-days',
+            type=int,
+            default=config['AGE_DAYS'],
+            help="Age of the tickets and reviews to archive, in days.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=config['BATCH_SIZE'],
+            help="Number of tickets archived per transaction.",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only count the tickets that would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options['age_days'] < 0 or options['batch_size'] < 1:
+            raise CommandError(
+                "--age-days must be positive and --batch-size at least 1."
+            )
+        cutoff = archive_cutoff(options['age_days'])
+        if options['dry_run']:
+            count = archivable_tickets(cutoff).count()
+            self.stdout.write(
+                f"{count} tickets created before {cutoff:%Y-%m-%d %H:%M} "
+                f"would be archived."
+            )
+            return
+
+        start = time.perf_counter()
+        archiver = Archiver(
+            batch_size=options['batch_size'], progress=self.report_progress
+        )
+        archiver.archive(cutoff)
+        counts = archiver.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {counts['tickets']} tickets and {counts['reviews']} "
+            f"reviews created before {cutoff:%Y-%m-%d %H:%M} in "
+            f"{time.perf_counter() - start:.2f}s."
+        ))
+
+    def report_progress(self, counts):
+        """Write the running totals."""
+        self.stdout.write(
+            f"  {counts['tickets']} tickets, {counts['reviews']} reviews "
+            f"archived"
+        )
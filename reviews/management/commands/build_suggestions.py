@@ -0,0 +1,99 @@
+"""
+Compute and cache the follow suggestions of every user, or benchmark the
+suggestion graph on a synthetic dataset.
+"""
+
+import random
+import time
+import tracemalloc
+from array import array
+
+from django.core.management.base import BaseCommand, CommandError
+
+from litrevu.checks import is_process_local
+from reviews.suggestions import FollowGraph, build_all_suggestions
+
+
+class Command(BaseCommand):
+    help = "Compute and cache friends-of-friends follow suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmark-edges',
+            type=int,
+            metavar='EDGES',
+            help="Benchmark a random graph of EDGES follows instead.",
+        )
+        parser.add_argument(
+            '--benchmark-users',
+            type=int,
+            default=100000,
+            help="Number of users of the benchmark graph.",
+        )
+        parser.add_argument(
+            '--benchmark-samples',
+            type=int,
+            default=1000,
+            help="Number of users whose suggestions are timed.",
+        )
+
+    def handle(self, *args, **options):
+        if options['benchmark_edges']:
+            self.benchmark(options)
+            return
+        if is_process_local():
+            raise CommandError(
+                "The default cache is local to this process: the "
+                "suggestions would be lost when the command exits. "
+                "Configure a shared cache (CACHE_BACKEND, CACHE_LOCATION)."
+            )
+
+        start = time.perf_counter()
+        graph = FollowGraph.from_database()
+        built = time.perf_counter()
+        users = build_all_suggestions(graph)
+        done = time.perf_counter()
+        self.stdout.write(self.style.SUCCESS(
+            f"Cached suggestions of {users} users: graph of "
+            f"{len(graph.targets)} follows built in {built - start:.2f}s "
+            f"({graph.nbytes / 1024:.0f} KiB), suggestions computed in "
+            f"{done - built:.2f}s."
+        ))
+
+    def benchmark(self, options):
+        """Build a random graph and time the suggestions."""
+        rng = random.Random(0)
+        user_count = options['benchmark_users']
+        edge_count = options['benchmark_edges']
+        sources = sorted(
+            rng.randrange(user_count) for _ in range(edge_count)
+        )
+        edges = [(source, rng.randrange(user_count)) for source in sources]
+        ids = array('q', range(user_count))
+
+        start = time.perf_counter()
+        graph = FollowGraph.from_edges(ids, edges)
+        build_time = time.perf_counter() - start
+        # Build again under tracemalloc, which slows allocations down.
+        tracemalloc.start()
+        FollowGraph.from_edges(ids, edges)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        samples = [
+            rng.randrange(user_count)
+            for _ in range(options['benchmark_samples'])
+        ]
+        start = time.perf_counter()
+        for index in samples:
+            graph.suggest(index)
+        suggest_time = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{edge_count} follows, {user_count} users\n"
+            f"  build: {build_time:.2f}s, peak allocation "
+            f"{peak / 1024 ** 2:.1f} MiB\n"
+            f"  graph size: {graph.nbytes / 1024 ** 2:.1f} MiB\n"
+            f"  suggestions: {suggest_time / len(samples) * 1000:.3f} ms "
+            f"per user"
+        )
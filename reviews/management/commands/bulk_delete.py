@@ -0,0 +1,84 @@
+"""
+Delete user accounts or tickets in batches, with progress reporting.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.deletion import (
+    BulkDeleter, DEFAULT_BATCH_SIZE, DEFAULT_FILE_WORKERS
+)
+from reviews.models import Ticket
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Delete users and everything they posted, or tickets, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            default=[],
+            metavar='USERNAME',
+            help="Username of an account to delete (repeatable).",
+        )
+        parser.add_argument(
+            '--ticket',
+            action='append',
+            default=[],
+            type=int,
+            metavar='ID',
+            help="Id of a ticket to delete (repeatable).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of rows deleted per transaction.",
+        )
+        parser.add_argument(
+            '--file-workers',
+            type=int,
+            default=DEFAULT_FILE_WORKERS,
+            help="Number of threads removing image files.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['user'] and not options['ticket']:
+            raise CommandError("Specify at least one --user or --ticket.")
+
+        users = list(User.objects.filter(username__in=options['user']))
+        missing = set(options['user']) - {user.username for user in users}
+        if missing:
+            raise CommandError(
+                f"Unknown users: {', '.join(sorted(missing))}"
+            )
+
+        with BulkDeleter(
+            batch_size=options['batch_size'],
+            file_workers=options['file_workers'],
+            progress=self.report_progress,
+        ) as deleter:
+            if options['ticket']:
+                deleter.delete_tickets(
+                    Ticket.objects.filter(pk__in=options['ticket'])
+                )
+            for user in users:
+                deleter.delete_user(user)
+                self.stdout.write(f"Deleted user {user.username}")
+
+        counts = deleter.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {counts['tickets']} tickets, {counts['reviews']} "
+            f"reviews, {counts['follows']} follows and {counts['files']} "
+            f"image files."
+        ))
+
+    def report_progress(self, counts):
+        """Write the running totals."""
+        self.stdout.write(
+            f"  {counts['tickets']} tickets, {counts['reviews']} reviews "
+            f"deleted"
+        )
@@ -0,0 +1,60 @@
+"""
+Group existing tickets whose titles nearly match and list the clusters.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from reviews.duplicates import (
+    MAX_POSTINGS_READ, MIN_SIMILARITY, cluster_duplicates
+)
+from reviews.models import Ticket
+
+
+class Command(BaseCommand):
+    help = "List clusters of near-duplicate tickets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-similarity',
+            type=float,
+            default=MIN_SIMILARITY,
+            help="Trigram similarity of two duplicate titles, from 0 to 1.",
+        )
+        parser.add_argument(
+            '--max-read',
+            type=int,
+            default=MAX_POSTINGS_READ,
+            help="Postings read to find the candidates of each ticket.",
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=50,
+            help="Number of clusters listed, largest first.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        titles = dict(
+            Ticket.objects.order_by('pk').values_list('pk', 'title')
+            .iterator(chunk_size=10000)
+        )
+        clusters = cluster_duplicates(
+            titles.items(),
+            min_similarity=options['min_similarity'],
+            max_read=options['max_read'],
+        )
+        elapsed = time.perf_counter() - start
+
+        clusters.sort(key=len, reverse=True)
+        for ticket_ids in clusters[:options['limit']]:
+            self.stdout.write(f"{len(ticket_ids)} tickets:")
+            for ticket_id in ticket_ids:
+                self.stdout.write(f"  #{ticket_id} {titles[ticket_id]}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(clusters)} clusters of "
+            f"{sum(len(ids) for ids in clusters)} tickets among "
+            f"{len(titles)} tickets, found in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,475 @@
+"""
+Replay a mix of logged-in requests against the WSGI application to
+measure the throughput and latency one worker sustains.
+A dataset of users, tickets, reviews and follows is generated first and
+removed at the end unless --keep-data is given. The write retries, lock
+waits and abandoned writes recorded in the metrics store during the run
+are reported with the latencies.
+"""
+
+import io
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from importlib import import_module
+from multiprocessing.util import Finalize
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+)
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils.crypto import get_random_string
+from PIL import Image
+
+from litrevu.instrumentation import (
+    HISTOGRAMS, flush_store, get_metrics_directory, get_metrics_settings,
+    read_histograms,
+)
+from reviews.deletion import BulkDeleter
+from reviews.models import Ticket, Review, UserFollows
+from reviews.ratings import refresh_ticket_ratings
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'loadtest-'
+DEFAULT_MIX = 'feed=60,posts=15,ticket_create=10,follow=10,unfollow=5'
+OPERATIONS = ('feed', 'posts', 'ticket_create', 'follow', 'unfollow')
+WRITE_METRICS = (
+    'litrevu_write_retries_total',
+    'litrevu_write_failures_total',
+    'litrevu_write_lock_wait_seconds',
+)
+
+request_state = threading.local()
+
+
+def record_lock_error(sender, request=None, **kwargs):
+    """Flag the current request when SQLite reports a locked database."""
+    exc = sys.exc_info()[1]
+    if isinstance(exc, OperationalError) and 'locked' in str(exc):
+        request_state.lock_error = True
+
+
+got_request_exception.connect(
+    record_lock_error, dispatch_uid='loadtest_lock_errors'
+)
+
+
+def parse_mix(value):
+    """Return the operation weights of a 'name=weight,...' string."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS or not weight.strip().isdigit():
+            raise CommandError(f"Invalid mix entry: {part!r}")
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at the given fraction of a sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = round(fraction * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def make_png():
+    """Return the bytes of a small PNG image."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 96), color=(120, 80, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def build_environ(spec, host):
+    """Return the WSGI environ of a request spec."""
+    body = spec.get('body', b'')
+    environ = {
+        'REQUEST_METHOD': spec['method'],
+        'PATH_INFO': spec['path'],
+        'QUERY_STRING': '',
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'HTTP_COOKIE': '; '.join(
+            f'{name}={value}' for name, value in spec['cookies'].items()
+        ),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if body:
+        environ['CONTENT_TYPE'] = spec['content_type']
+    return environ
+
+
+def run_request(spec):
+    """
+    Send one request to the WSGI application.
+    Return (operation, status, duration, lock_error).
+    """
+    from litrevu.wsgi import application
+
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    request_state.lock_error = False
+    environ = build_environ(spec, spec['host'])
+    start = time.perf_counter()
+    try:
+        response = application(environ, start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        status = statuses[0]
+    except OperationalError as exc:
+        status = 500
+        request_state.lock_error = 'locked' in str(exc)
+    duration = time.perf_counter() - start
+    return spec['operation'], status, duration, request_state.lock_error
+
+
+def init_process():
+    """Prepare a worker process of the process pool."""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+    # Pool workers exit without running atexit handlers.
+    Finalize(None, flush_store, exitpriority=10)
+
+
+def write_metrics():
+    """
+    Return the write metrics of every worker, summed over their labels, by
+    metric name, or None when metrics are disabled.
+    """
+    if not get_metrics_settings()['ENABLED']:
+        return None
+    flush_store()
+    totals = read_histograms(get_metrics_directory())
+    metrics = {}
+    for name in WRITE_METRICS:
+        size = len(HISTOGRAMS[name][1]) + 2 if name in HISTOGRAMS else 1
+        counts = metrics[name] = [0] * size
+        for label_counts in totals[name].values():
+            for index, count in enumerate(label_counts):
+                counts[index] += count
+    return metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay logged-in requests against litrevu.wsgi.application and "
+        "report throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--tickets-per-user', type=int, default=20)
+        parser.add_argument('--reviews-per-user', type=int, default=10)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help="Total number of requests to send.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help="Number of threads or processes sending requests.",
+        )
+        parser.add_argument(
+            '--pool',
+            choices=('thread', 'process'),
+            default='thread',
+        )
+        parser.add_argument(
+            '--mix',
+            default=DEFAULT_MIX,
+            help="Weights of the operations, e.g. 'feed=80,posts=20'.",
+        )
+        parser.add_argument(
+            '--host',
+            help="Host header; defaults to the first ALLOWED_HOSTS entry.",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keep-data',
+            action='store_true',
+            help="Keep the generated dataset after the run.",
+        )
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(
+                "A load-test dataset already exists; remove the "
+                f"'{USERNAME_PREFIX}*' users first."
+            )
+        rng = random.Random(options['seed'])
+        mix = parse_mix(options['mix'])
+        if not options['host']:
+            hosts = [h for h in settings.ALLOWED_HOSTS if '*' not in h]
+            options['host'] = hosts[0].lstrip('.') if hosts else 'localhost'
+            if not hosts and not settings.DEBUG:
+                raise CommandError(
+                    "ALLOWED_HOSTS is empty; pass --host with an allowed "
+                    "host name."
+                )
+
+        self.stdout.write("Generating the dataset...")
+        users = self.create_dataset(rng, options)
+        try:
+            specs = self.build_plan(rng, users, mix, options)
+            self.stdout.write(
+                f"Sending {len(specs)} requests with "
+                f"{options['concurrency']} {options['pool']} workers..."
+            )
+            self.report(*self.run(specs, options))
+        finally:
+            if not options['keep_data']:
+                self.stdout.write("Removing the dataset...")
+                with BulkDeleter() as deleter:
+                    for user in users:
+                        deleter.delete_user(user)
+
+    def create_dataset(self, rng, options):
+        """Create the load-test users and their posts and follows."""
+        password = make_password(get_random_string(16))
+        User.objects.bulk_create([
+            User(username=f'{USERNAME_PREFIX}{index}', password=password)
+            for index in range(options['users'])
+        ])
+        users = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+        )
+        Ticket.objects.bulk_create([
+            Ticket(user=user, title=f'Livre {index}', description='Résumé')
+            for user in users
+            for index in range(options['tickets_per_user'])
+        ])
+        ticket_ids = list(
+            Ticket.objects.filter(user__in=users)
+            .values_list('pk', flat=True)
+        )
+        Review.objects.bulk_create([
+            Review(
+                user=user,
+                ticket_id=rng.choice(ticket_ids),
+                rating=rng.randint(0, 5),
+                headline='Critique',
+                body='Texte',
+            )
+            for user in users
+            for _ in range(options['reviews_per_user'])
+        ])
+        # bulk_create does not send the signals maintaining the ratings.
+        refresh_ticket_ratings(ticket_ids)
+        follows_per_user = min(options['follows_per_user'], len(users) - 1)
+        UserFollows.objects.bulk_create([
+            UserFollows(user=user, followed_user=followed)
+            for user in users
+            for followed in rng.sample(
+                [other for other in users if other != user],
+                follows_per_user
+            )
+        ], ignore_conflicts=True)
+        return users
+
+    def login_cookies(self, user):
+        """Return the session and CSRF cookies of a logged-in user."""
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return {
+            settings.SESSION_COOKIE_NAME: session.session_key,
+            settings.CSRF_COOKIE_NAME: get_random_string(
+                32, CSRF_ALLOWED_CHARS
+            ),
+        }
+
+    def build_plan(self, rng, users, mix, options):
+        """Return the request specs to send, in a random order."""
+        cookies = {user.pk: self.login_cookies(user) for user in users}
+        image = make_png()
+        operations = rng.choices(
+            list(mix), weights=list(mix.values()), k=options['requests']
+        )
+        specs = []
+        for operation in operations:
+            user = rng.choice(users)
+            spec = {
+                'operation': operation,
+                'host': options['host'],
+                'cookies': cookies[user.pk],
+                'method': 'GET',
+            }
+            csrf_token = cookies[user.pk][settings.CSRF_COOKIE_NAME]
+            if operation == 'feed':
+                spec['path'] = '/'
+            elif operation == 'posts':
+                spec['path'] = '/posts/'
+            else:
+                if operation == 'ticket_create':
+                    path = '/ticket/create/'
+                    image_file = io.BytesIO(image)
+                    image_file.name = 'cover.png'
+                    data = {
+                        'title': 'Nouveau livre',
+                        'description': 'Demande de critique',
+                        'image': image_file,
+                        # Skip the similar tickets check of repeated titles.
+                        'confirm_new': '1',
+                    }
+                elif operation == 'follow':
+                    path = '/subscriptions/'
+                    data = {'username': rng.choice(users).username}
+                else:
+                    path = '/subscriptions/'
+                    data = {'unfollow_user_id': rng.choice(users).pk}
+                data['csrfmiddlewaretoken'] = csrf_token
+                spec.update({
+                    'method': 'POST',
+                    'path': path,
+                    'body': encode_multipart(BOUNDARY, data),
+                    'content_type': MULTIPART_CONTENT,
+                })
+            specs.append(spec)
+        return specs
+
+    def run(self, specs, options):
+        """
+        Send the requests and return the results, the elapsed time and the
+        write statistics of the run.
+        """
+        if options['pool'] == 'process':
+            # Forked workers must not share the parent's connections.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=options['concurrency'],
+                initializer=init_process,
+            )
+            chunksize = max(1, len(specs) // (options['concurrency'] * 8))
+        else:
+            executor = ThreadPoolExecutor(max_workers=options['concurrency'])
+            chunksize = 1
+        before = write_metrics()
+        start = time.perf_counter()
+        with executor:
+            results = list(
+                executor.map(run_request, specs, chunksize=chunksize)
+            )
+        elapsed = time.perf_counter() - start
+        return results, elapsed, self.write_stats(before, write_metrics())
+
+    @staticmethod
+    def write_stats(before, after):
+        """Return the write retries, failures and lock waits of the run."""
+        if before is None or after is None:
+            return None
+        retries, failures, waits = (
+            [
+                count - previous
+                for count, previous in zip(after[name], before[name])
+            ]
+            for name in WRITE_METRICS
+        )
+        # Histograms end with the +Inf count and the sum of the values.
+        wait_count = sum(waits[:-1])
+        return {
+            'retries': retries[0],
+            'failures': failures[0],
+            'lock_waits': wait_count,
+            'lock_wait_mean': waits[-1] / wait_count if wait_count else 0.0,
+        }
+
+    def report(self, results, elapsed, write_stats):
+        """Write throughput, latency percentiles and error counts."""
+        durations = defaultdict(list)
+        statuses = defaultdict(Counter)
+        lock_errors = 0
+        for operation, status, duration, lock_error in results:
+            durations[operation].append(duration)
+            statuses[operation][status] += 1
+            lock_errors += bool(lock_error)
+
+        self.stdout.write(
+            f"\n{len(results)} requests in {elapsed:.2f}s: "
+            f"{len(results) / elapsed:.1f} requests/s"
+        )
+        self.stdout.write(
+            f"{'operation':<15}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}"
+            f"{'errors':>8}  statuses"
+        )
+        all_durations = []
+        for operation in OPERATIONS:
+            if operation not in durations:
+                continue
+            values = sorted(durations[operation])
+            all_durations.extend(values)
+            errors = sum(
+                count for status, count in statuses[operation].items()
+                if status >= 500
+            )
+            codes = ', '.join(
+                f'{status}: {count}'
+                for status, count in sorted(statuses[operation].items())
+            )
+            self.stdout.write(
+                f"{operation:<15}{len(values):>7}"
+                f"{percentile(values, 0.5) * 1000:>10.1f}"
+                f"{percentile(values, 0.99) * 1000:>10.1f}"
+                f"{errors:>8}  {codes}"
+            )
+        all_durations.sort()
+        self.stdout.write(
+            f"{'all':<15}{len(all_durations):>7}"
+            f"{percentile(all_durations, 0.5) * 1000:>10.1f}"
+            f"{percentile(all_durations, 0.99) * 1000:>10.1f}"
+        )
+        busy = sum(counts[503] for counts in statuses.values())
+        self.stdout.write(f"Writes abandoned (503 responses): {busy}")
+        if write_stats is None:
+            self.stdout.write("Write retries and lock waits: metrics disabled")
+        else:
+            self.stdout.write(
+                f"Write retries: {write_stats['retries']}, abandoned "
+                f"writes: {write_stats['failures']}"
+            )
+            self.stdout.write(
+                f"Write lock waits: {write_stats['lock_waits']} writes, mean "
+                f"{write_stats['lock_wait_mean'] * 1000:.1f} ms"
+            )
+        self.stdout.write(
+            f"Unhandled SQLite 'database is locked' errors: {lock_errors}"
+        )
@@ -0,0 +1,38 @@
+"""
+Recompute the ticket rating aggregates from the reviews.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reviews.models import Ticket
+from reviews.ratings import refresh_ticket_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the rating aggregates of every ticket."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of tickets reconciled per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        changed = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Ticket.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                changed += refresh_ticket_ratings(ids)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled ticket ratings: {changed} aggregates fixed."
+        ))
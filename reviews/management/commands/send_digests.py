@@ -0,0 +1,56 @@
+"""
+Gather the events of the post log into digests for the followers of their
+authors, and optionally email them. Meant to be run periodically.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.digest import (
+    digest_cursor, get_digest_settings, prune_events, run_digest,
+    send_digest_emails
+)
+
+
+class Command(BaseCommand):
+    help = "Write the digests of the posts logged since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=get_digest_settings()['BATCH_SIZE'],
+            help="Number of events gathered per run.",
+        )
+        parser.add_argument(
+            '--email',
+            action='store_true',
+            help="Email the digests with the digest email backend.",
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help="Delete the events once gathered.",
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        self.stdout.write(f"Cursor at event {digest_cursor()}")
+        totals = {'events': 0, 'digests': 0, 'emails': 0, 'pruned': 0}
+        while run := run_digest(options['batch_size']):
+            totals['events'] += run.event_count
+            totals['digests'] += run.digest_count
+            self.stdout.write(
+                f"  {run.event_count} events up to {run.last_event_id}, "
+                f"{run.digest_count} digests in {run.duration:.2f}s "
+                f"({run.events_per_second:.0f} events/s)"
+            )
+            if options['email']:
+                totals['emails'] += send_digest_emails(run)
+            if options['prune']:
+                totals['pruned'] += prune_events(run)
+        self.stdout.write(self.style.SUCCESS(
+            f"Gathered {totals['events']} events into {totals['digests']} "
+            f"digests, sent {totals['emails']} emails, pruned "
+            f"{totals['pruned']} events."
+        ))
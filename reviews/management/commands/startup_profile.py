@@ -0,0 +1,120 @@
+"""
+Report where worker startup time goes: the import time of each module when
+running manage.py or loading litrevu.wsgi, and the duration of each
+warm-up step.
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+TARGETS = {
+    'manage': ['manage.py', 'check'],
+    'wsgi': ['-c', 'import litrevu.wsgi'],
+}
+
+
+def parse_import_times(output):
+    """
+    Return (module, self µs, cumulative µs) tuples from the output of
+    python -X importtime.
+    """
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative, module = line[12:].split('|')
+        if not self_time.strip().isdigit():
+            # Header line.
+            continue
+        times.append(
+            (module.strip(), int(self_time), int(cumulative))
+        )
+    return times
+
+
+def group_by_package(times):
+    """Return the self time of the modules summed by top-level package."""
+    totals = {}
+    for module, self_time, _ in times:
+        package = module.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_time
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Report per-module import times and warm-up step durations."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target',
+            choices=[*TARGETS, 'all'],
+            default='all',
+            help="Startup measured: manage.py check or litrevu.wsgi import.",
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help="Number of modules and packages listed.",
+        )
+
+    def handle(self, *args, **options):
+        targets = list(TARGETS) if options['target'] == 'all' else [
+            options['target']
+        ]
+        for target in targets:
+            self.report_imports(target, options['limit'])
+        self.report_warm_up()
+
+    def report_imports(self, target, limit):
+        """Run the target in a new interpreter and list its imports."""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', *TARGETS[target]],
+            cwd=Path(settings.BASE_DIR),
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(
+                f"{target} failed to start:\n{result.stderr[-2000:]}"
+            )
+        times = parse_import_times(result.stderr)
+        total = sum(self_time for _, self_time, _ in times)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{target}: {len(times)} modules imported in "
+            f"{total / 1000:.1f} ms"
+        ))
+
+        self.stdout.write(f"  {'cumulative ms':>14}{'self ms':>10}  module")
+        slowest = sorted(times, key=lambda item: item[2], reverse=True)
+        for module, self_time, cumulative in slowest[:limit]:
+            self.stdout.write(
+                f"  {cumulative / 1000:>14.1f}{self_time / 1000:>10.1f}"
+                f"  {module}"
+            )
+
+        self.stdout.write(f"  {'self ms':>14}{'share':>10}  package")
+        packages = sorted(
+            group_by_package(times).items(),
+            key=lambda item: item[1], reverse=True
+        )
+        for package, self_time in packages[:limit]:
+            self.stdout.write(
+                f"  {self_time / 1000:>14.1f}{self_time / total:>10.1%}"
+                f"  {package}"
+            )
+
+    def report_warm_up(self):
+        """Run the warm-up steps in this process and list their durations."""
+        from litrevu.warmup import warm_up
+
+        durations = warm_up()
+        self.stdout.write(self.style.MIGRATE_HEADING("Warm-up"))
+        if not durations:
+            self.stdout.write("  Disabled by the WARM_UP setting.")
+        for step, duration in durations.items():
+            self.stdout.write(f"  {duration * 1000:>14.1f} ms  {step}")
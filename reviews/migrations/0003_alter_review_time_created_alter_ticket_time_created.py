@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0002_alter_ticket_image'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='review',
+            name='time_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='time_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
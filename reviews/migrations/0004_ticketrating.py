@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_ticket_ratings(apps, schema_editor):
+    """Compute the rating aggregates of the existing reviews."""
+    Review = apps.get_model('reviews', 'Review')
+    TicketRating = apps.get_model('reviews', 'TicketRating')
+    ratings = {}
+    for ticket_id, rating in Review.objects.values_list('ticket_id', 'rating'):
+        aggregate = ratings.setdefault(
+            ticket_id, TicketRating(ticket_id=ticket_id)
+        )
+        field = f'rating_{rating}'
+        setattr(aggregate, field, getattr(aggregate, field) + 1)
+        aggregate.count += 1
+        aggregate.total += rating
+    for aggregate in ratings.values():
+        aggregate.average = aggregate.total / aggregate.count
+    TicketRating.objects.bulk_create(ratings.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0003_alter_review_time_created_alter_ticket_time_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketRating',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='reviews.ticket')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('rating_0', models.PositiveIntegerField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-average', '-count'], name='ticketrating_top_idx')],
+            },
+        ),
+        migrations.RunPython(
+            populate_ticket_ratings, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 15:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0006_postevent_digestrun_digest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postevent',
+            index=models.Index(fields=['kind', 'object_id'], name='reviews_pos_kind_5b4aaf_idx'),
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from .utils import ticket_image_upload_path
 
 
@@ -16,7 +16,7 @@ class Ticket(models.Model):
         null=True,
         blank=True
     )
-    time_created = models.DateTimeField(auto_now_add=True)
+    time_created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -37,11 +37,17 @@ class Review(models.Model):
         to=settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
-    time_created = models.DateTimeField(auto_now_add=True)
+    time_created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.headline} ({self.rating}/5)"
 
+    def save(self, *args, **kwargs):
+        # Keep the ticket rating aggregates, updated by signals, in the
+        # same transaction as the review.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class UserFollows(models.Model):
     user = models.ForeignKey(
@@ -60,3 +66,162 @@ class UserFollows(models.Model):
 
     def __str__(self):
         return f"{self.user} follows {self.followed_user}"
+
+
+class TicketRating(models.Model):
+    """Maintained aggregates of the ratings given to a ticket."""
+
+    ticket = models.OneToOneField(
+        to=Ticket,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rating_stats'
+    )
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0)
+    # Number of reviews per rating value, from 0 to 5
+    rating_0 = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-average', '-count'],
+                name='ticketrating_top_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.ticket_id}: {self.average:.2f} ({self.count})"
+
+    @property
+    def histogram(self):
+        """Return the number of reviews per rating value."""
+        return [getattr(self, f'rating_{i}') for i in range(6)]
+
+
+class ArchivedTicket(models.Model):
+    """
+    Ticket moved out of the tickets table with its reviews, once they have
+    all grown older than the archive age (see reviews/archive.py).
+    """
+
+    # Primary key of the ticket before it was archived
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=128)
+    description = models.TextField(max_length=2048, blank=True)
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_tickets'
+    )
+    image = models.ImageField(
+        upload_to=ticket_image_upload_path,
+        null=True,
+        blank=True
+    )
+    time_created = models.DateTimeField(db_index=True)
+    time_archived = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.title
+
+
+class ArchivedReview(models.Model):
+    """Review archived with its ticket."""
+
+    # Primary key of the review before it was archived
+    id = models.BigIntegerField(primary_key=True)
+    ticket = models.ForeignKey(
+        to=ArchivedTicket,
+        on_delete=models.CASCADE,
+        related_name='reviews'
+    )
+    rating = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(0), MaxValueValidator(5)]
+    )
+    headline = models.CharField(max_length=128)
+    body = models.TextField(max_length=8192, blank=True)
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_reviews'
+    )
+    time_created = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.headline} ({self.rating}/5)"
+
+
+class PostEvent(models.Model):
+    """
+    Entry of the append-only log of posted tickets and reviews, read by the
+    digest of the followers of their author (see reviews/digest.py).
+    """
+
+    TICKET = 'TICKET'
+    REVIEW = 'REVIEW'
+    KIND_CHOICES = [(TICKET, 'Ticket'), (REVIEW, 'Critique')]
+
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # Ticket title or review headline, as posted
+    title = models.CharField(max_length=128)
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    time_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Bulk deletes drop the events of the deleted posts.
+        indexes = [models.Index(fields=['kind', 'object_id'])]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} by {self.user_id}"
+
+
+class DigestRun(models.Model):
+    """Pass of the digest over the events following the previous pass."""
+
+    last_event_id = models.BigIntegerField()
+    event_count = models.PositiveIntegerField()
+    digest_count = models.PositiveIntegerField()
+    duration = models.FloatField()
+    time_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event_count} events up to {self.last_event_id}"
+
+    @property
+    def events_per_second(self):
+        return self.event_count / self.duration if self.duration else 0.0
+
+
+class Digest(models.Model):
+    """Posts of the followed users of a user, gathered by a digest run."""
+
+    user = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='digests'
+    )
+    run = models.ForeignKey(
+        to=DigestRun,
+        on_delete=models.CASCADE,
+        related_name='digests'
+    )
+    event_count = models.PositiveIntegerField()
+    # Per followed user: username, ticket and review counts, latest ticket
+    # titles and review headlines
+    authors = models.JSONField()
+    time_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.event_count} posts"
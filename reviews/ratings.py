@@ -0,0 +1,132 @@
+"""
+Maintain the rating aggregates of tickets and read the top-rated listing.
+Aggregates are updated incrementally when a review is saved or deleted,
+and can be recomputed from the reviews with refresh_ticket_ratings.
+"""
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Case, Count, F, FloatField, Value, When
+from django.db.models.functions import Cast
+
+from reviews.models import Review, TicketRating
+
+TOP_RATED_PAGE_SIZE = 20
+TOP_RATED_CACHE_TIMEOUT = 60
+# Tickets need this many reviews to appear in the top-rated listing.
+TOP_RATED_MIN_REVIEWS = 1
+
+
+def apply_rating_change(ticket_id, rating, delta):
+    """
+    Add (delta=1) or remove (delta=-1) a rating from the ticket aggregates
+    with a single atomic UPDATE.
+    """
+    if delta > 0:
+        TicketRating.objects.get_or_create(ticket_id=ticket_id)
+    count = F('count') + delta
+    total = F('total') + delta * rating
+    TicketRating.objects.filter(ticket_id=ticket_id).update(
+        count=count,
+        total=total,
+        average=Case(
+            When(count__lte=-delta, then=Value(0.0)),
+            default=Cast(total, FloatField()) / count,
+            output_field=FloatField(),
+        ),
+        **{f'rating_{rating}': F(f'rating_{rating}') + delta}
+    )
+
+
+def refresh_ticket_ratings(ticket_ids=None):
+    """
+    Recompute the aggregates of the given tickets, or of all tickets, from
+    their reviews. Return the number of aggregates that were changed.
+    """
+    reviews = Review.objects.all()
+    ratings = TicketRating.objects.all()
+    if ticket_ids is not None:
+        reviews = reviews.filter(ticket_id__in=ticket_ids)
+        ratings = ratings.filter(ticket_id__in=ticket_ids)
+
+    expected = {}
+    for ticket_id, rating, count in (
+        reviews.values_list('ticket_id', 'rating')
+        .annotate(count=Count('pk')).order_by()
+    ):
+        aggregate = expected.setdefault(ticket_id, TicketRating(
+            ticket_id=ticket_id
+        ))
+        setattr(aggregate, f'rating_{rating}', count)
+        aggregate.count += count
+        aggregate.total += rating * count
+    for aggregate in expected.values():
+        aggregate.average = aggregate.total / aggregate.count
+
+    fields = ['count', 'total', 'average'] + [
+        f'rating_{i}' for i in range(6)
+    ]
+    current = {aggregate.ticket_id: aggregate for aggregate in ratings}
+    to_create = []
+    to_update = []
+    for ticket_id, aggregate in expected.items():
+        existing = current.pop(ticket_id, None)
+        if existing is None:
+            to_create.append(aggregate)
+        elif any(
+            getattr(existing, field) != getattr(aggregate, field)
+            for field in fields
+        ):
+            to_update.append(aggregate)
+
+    TicketRating.objects.bulk_create(to_create, batch_size=500)
+    TicketRating.objects.bulk_update(to_update, fields, batch_size=500)
+    # Aggregates left over belong to tickets without any review.
+    TicketRating.objects.filter(pk__in=list(current)).delete()
+    return len(to_create) + len(to_update) + len(current)
+
+
+def top_rated_queryset():
+    """
+    Return the rated tickets, best average first, with the fields the
+    listing displays only: the pages are kept in the shared cache, which
+    must not hold the rest of the authors' accounts.
+    """
+    return (
+        TicketRating.objects
+        .filter(count__gte=TOP_RATED_MIN_REVIEWS)
+        .select_related('ticket__user')
+        .only(
+            'count', 'average', 'ticket__title', 'ticket__description',
+            'ticket__image', 'ticket__time_created', 'ticket__user__username',
+        )
+        .order_by('-average', '-count', 'ticket_id')
+    )
+
+
+def top_rated_page(number):
+    """
+    Return a cached page of the top-rated listing as a dict holding the
+    ratings and the pagination state. Invalid page numbers give the first
+    page, and numbers past the end the last one.
+    """
+    try:
+        number = max(int(number), 1)
+    except (TypeError, ValueError):
+        number = 1
+    page = cache.get(f'reviews:top-rated:{number}')
+    if page is None:
+        paginator = Paginator(top_rated_queryset(), TOP_RATED_PAGE_SIZE)
+        current = paginator.get_page(number)
+        page = {
+            'number': current.number,
+            'num_pages': paginator.num_pages,
+            'ratings': list(current.object_list),
+        }
+        # Pages are only cached under their own number, so that requests
+        # past the end do not fill the cache.
+        cache.set(
+            f'reviews:top-rated:{current.number}', page,
+            TOP_RATED_CACHE_TIMEOUT
+        )
+    return page
@@ -1,30 +1,55 @@
 """
-Handle deletion of ticket images.
+Handle deletion of ticket images and ticket rating aggregates.
 Delete the image file from the filesystem when a Ticket is deleted
 or when its image is updated.
+Update the rating aggregates of a ticket when one of its reviews is
+created, updated or deleted.
+Invalidate the cached follow suggestions when a follow changes.
+Index the title of a ticket when it is saved.
+Log new tickets and reviews for the digests of their author's followers.
+Drop the cached lookups of users, follows and tickets when they change.
 """
 
 import os
-from django.db.models.signals import post_delete, pre_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Ticket
+from .digest import log_post
+from .duplicates import index_ticket
+from .lookups import (
+    follow_cache, invalidate_follows, ticket_cache, user_cache, username_key
+)
+from .models import ArchivedTicket, PostEvent, Ticket, Review, UserFollows
+from .ratings import apply_rating_change
+from .suggestions import invalidate_suggestions
 
 
 @receiver(post_delete, sender=Ticket)
+@receiver(post_delete, sender=ArchivedTicket)
 def delete_ticket_image(sender, instance, **kwargs):
     """
     Delete the ticket image file from the filesystem after ticket deletion.
+    The file is removed once the transaction is committed, so that the
+    deletion does not hold the database write lock during file operations.
     """
     if instance.image:
-        if os.path.isfile(instance.image.path):
-            os.remove(instance.image.path)
+        path = instance.image.path
+        transaction.on_commit(lambda: remove_file(path))
+
+
+def remove_file(path):
+    """Remove a file from the filesystem if it exists."""
+    if os.path.isfile(path):
+        os.remove(path)
 
 
 @receiver(pre_save, sender=Ticket)
 def delete_old_ticket_image(sender, instance, **kwargs):
     """
     Delete the old ticket image file from the filesystem before saving
-    a new image.
+    a new image. Remember the stored title, which the duplicate index
+    compares to the saved one.
     """
     if not instance.pk:
         return
@@ -34,9 +59,108 @@ def delete_old_ticket_image(sender, instance, **kwargs):
     except Ticket.DoesNotExist:
         return
 
+    instance._stored_title = old_instance.title
+
     old_image = old_instance.image
     new_image = instance.image
 
     if old_image and old_image != new_image:
-        if os.path.isfile(old_image.path):
-            os.remove(old_image.path)
+        path = old_image.path
+        transaction.on_commit(lambda: remove_file(path))
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def drop_cached_ticket(sender, instance, **kwargs):
+    """Drop the cached ticket once the change is committed."""
+    transaction.on_commit(lambda: ticket_cache.delete(instance.pk))
+
+
+@receiver(post_save, sender=Ticket)
+def index_ticket_title(sender, instance, raw=False, **kwargs):
+    """Add the ticket title to the duplicate detection index once saved."""
+    if not raw:
+        transaction.on_commit(lambda: index_ticket(instance))
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_save, sender=Review)
+def log_new_post(sender, instance, created, raw=False, **kwargs):
+    """Append a new ticket or review to the post log."""
+    if not created or raw:
+        return
+    if sender is Ticket:
+        log_post(PostEvent.TICKET, instance, instance.title)
+    else:
+        log_post(PostEvent.REVIEW, instance, instance.headline)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored ticket and rating of a review before it is updated.
+    """
+    instance._stored_rating = None
+    if instance.pk and not raw:
+        instance._stored_rating = Review.objects.filter(
+            pk=instance.pk
+        ).values_list('ticket_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def update_ticket_rating(sender, instance, raw=False, **kwargs):
+    """Move the review rating into the aggregates of its ticket."""
+    if raw:
+        return
+    stored = getattr(instance, '_stored_rating', None)
+    current = (instance.ticket_id, int(instance.rating))
+    if stored == current:
+        return
+    if stored is not None:
+        apply_rating_change(*stored, delta=-1)
+    apply_rating_change(*current, delta=1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_ticket_rating(sender, instance, **kwargs):
+    """Remove the review rating from the aggregates of its ticket."""
+    apply_rating_change(instance.ticket_id, instance.rating, delta=-1)
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def refresh_follow_suggestions(sender, instance, **kwargs):
+    """Invalidate the suggestions depending on the follower's follows."""
+    invalidate_suggestions([instance.user_id])
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def drop_cached_follows(sender, instance, **kwargs):
+    """Drop the cached follow lists of both users once committed."""
+    follow = (instance.user_id, instance.followed_user_id)
+    transaction.on_commit(lambda: invalidate_follows([follow]))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def drop_cached_users(sender, instance, created=False, update_fields=None,
+                      **kwargs):
+    """
+    Drop every cached user and follow list when a user is changed or
+    deleted: a renamed user appears in the lists of their followers.
+    A new user only replaces the cached miss of their username, and logins,
+    which only update last_login, keep the caches.
+    """
+    if created:
+        key = username_key(instance.username)
+        transaction.on_commit(lambda: user_cache.delete(key))
+        return
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+
+    def invalidate():
+        user_cache.invalidate()
+        follow_cache.invalidate()
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,174 @@
+"""
+Suggest users to follow from the follow graph (friends of friends).
+The whole graph is loaded into compact arrays in CSR form for batch
+computation; single users are refreshed with one aggregate query when
+their cached suggestions are invalidated by a follow change. Precomputed
+suggestions are only useful in a cache shared by the workers.
+"""
+
+import heapq
+from array import array
+from bisect import bisect_left
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
+
+from reviews.models import UserFollows
+
+User = get_user_model()
+
+SUGGESTIONS_COUNT = 10
+SUGGESTIONS_CACHE_TIMEOUT = 60 * 60 * 24
+SUGGESTIONS_KEY = 'reviews:suggestions:{}'
+# Followers whose suggestions are dropped when a user follows someone; the
+# suggestions of the other followers are refreshed when they expire.
+MAX_INVALIDATED_FOLLOWERS = 1000
+
+
+class FollowGraph:
+    """
+    Follow graph in compressed sparse row form.
+    `ids` holds the sorted user ids, and the users followed by the user at
+    index i are targets[offsets[i]:offsets[i + 1]], as indexes into ids.
+    """
+
+    def __init__(self, ids, offsets, targets):
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+        # Without gaps in the ids, indexes are computed without a search.
+        self.first_id = ids[0] if ids else 0
+        self.dense = bool(ids) and ids[-1] - ids[0] + 1 == len(ids)
+
+    @classmethod
+    def from_edges(cls, ids, edges):
+        """
+        Build the graph from sorted user ids and (user id, followed id)
+        edges sorted by user id.
+        """
+        graph = cls(ids, array('q', bytes(8 * (len(ids) + 1))), array('q'))
+        counts = graph.offsets
+        last_user_id = source = None
+        for user_id, followed_id in edges:
+            if user_id != last_user_id:
+                source = graph.index(user_id)
+                last_user_id = user_id
+            target = graph.index(followed_id)
+            if source is None or target is None:
+                continue
+            graph.targets.append(target)
+            counts[source + 1] += 1
+        for index in range(1, len(counts)):
+            counts[index] += counts[index - 1]
+        return graph
+
+    @classmethod
+    def from_database(cls):
+        """Build the graph from the UserFollows table."""
+        ids = array('q', User.objects.order_by('pk').values_list(
+            'pk', flat=True
+        ).iterator(chunk_size=10000))
+        edges = (
+            UserFollows.objects.order_by('user_id', 'followed_user_id')
+            .values_list('user_id', 'followed_user_id')
+            .iterator(chunk_size=10000)
+        )
+        return cls.from_edges(ids, edges)
+
+    @property
+    def nbytes(self):
+        """Return the memory used by the graph arrays."""
+        return sum(
+            values.buffer_info()[1] * values.itemsize
+            for values in (self.ids, self.offsets, self.targets)
+        )
+
+    def index(self, user_id):
+        """Return the index of a user id, or None if it is unknown."""
+        if self.dense:
+            index = user_id - self.first_id
+            return index if 0 <= index < len(self.ids) else None
+        index = bisect_left(self.ids, user_id)
+        if index < len(self.ids) and self.ids[index] == user_id:
+            return index
+        return None
+
+    def following(self, index):
+        """Return the indexes of the users followed by the user at index."""
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def suggest(self, index, count=SUGGESTIONS_COUNT):
+        """
+        Return the ids of the users most followed by the users followed by
+        the user at index, excluding the user and the users already
+        followed.
+        """
+        followed = self.following(index)
+        excluded = set(followed)
+        excluded.add(index)
+        scores = {}
+        for followed_index in followed:
+            for candidate in self.following(followed_index):
+                if candidate not in excluded:
+                    scores[candidate] = scores.get(candidate, 0) + 1
+        best = heapq.nsmallest(
+            count, scores.items(), key=lambda item: (-item[1], item[0])
+        )
+        return [self.ids[candidate] for candidate, _ in best]
+
+
+def compute_user_suggestions(user_id, count=SUGGESTIONS_COUNT):
+    """Return the suggested user ids of one user with a single query."""
+    followed = UserFollows.objects.filter(user_id=user_id).values(
+        'followed_user_id'
+    )
+    return list(
+        UserFollows.objects
+        .filter(user_id__in=followed)
+        .exclude(followed_user_id__in=followed)
+        .exclude(followed_user_id=user_id)
+        .values('followed_user_id')
+        .annotate(score=Count('pk'))
+        .order_by('-score', 'followed_user_id')
+        .values_list('followed_user_id', flat=True)[:count]
+    )
+
+
+def build_all_suggestions(graph, batch_size=1000):
+    """Compute and cache the suggestions of every user of the graph."""
+    batch = {}
+    for index, user_id in enumerate(graph.ids):
+        batch[SUGGESTIONS_KEY.format(user_id)] = graph.suggest(index)
+        if len(batch) >= batch_size:
+            cache.set_many(batch, SUGGESTIONS_CACHE_TIMEOUT)
+            batch = {}
+    cache.set_many(batch, SUGGESTIONS_CACHE_TIMEOUT)
+    return len(graph.ids)
+
+
+def get_suggestions(user):
+    """Return the users suggested to a user, best first."""
+    key = SUGGESTIONS_KEY.format(user.id)
+    suggested_ids = cache.get(key)
+    if suggested_ids is None:
+        suggested_ids = compute_user_suggestions(user.id)
+        cache.set(key, suggested_ids, SUGGESTIONS_CACHE_TIMEOUT)
+    users = User.objects.in_bulk(suggested_ids)
+    return [users[pk] for pk in suggested_ids if pk in users]
+
+
+def invalidate_suggestions(user_ids):
+    """
+    Drop the cached suggestions affected by follow changes of the given
+    users: their own and those of up to MAX_INVALIDATED_FOLLOWERS of their
+    followers.
+    """
+    user_ids = set(user_ids)
+    followers = UserFollows.objects.filter(
+        followed_user_id__in=user_ids
+    ).values_list('user_id', flat=True)[:MAX_INVALIDATED_FOLLOWERS]
+    cache.delete_many([
+        SUGGESTIONS_KEY.format(user_id)
+        for user_id in user_ids.union(followers)
+    ])
@@ -1,3 +1,1098 @@
-# from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core import mail
+from django.core.cache.backends.base import memcache_key_warnings
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import TemplateSyntaxError
+from django.template.loader import get_template
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test import (
+    Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from reviews.admin import EstimatedCountPaginator
+from reviews.archive import (
+    Archiver, archive_cutoff, archived_page, parse_cursor
+)
+from reviews import duplicates, events, suggestions
+from reviews.deletion import BulkDeleter, remove_files
+from reviews.digest import (
+    digest_cursor, prune_events, run_digest, send_digest_emails
+)
+from reviews.feed import feed_items_since
+from reviews.follows import MAX_BULK_FOLLOW_FILE_SIZE
+from reviews.forms import BulkFollowForm
+from reviews.lookups import (
+    follow_cache, get_followers, get_following, get_ticket,
+    get_user_by_username, ticket_cache, user_cache, username_key
+)
+from reviews.models import (
+    ArchivedReview, ArchivedTicket, Digest, PostEvent, Review, Ticket,
+    TicketRating, UserFollows
+)
+from reviews.ratings import refresh_ticket_ratings, top_rated_page
+from reviews.views import FeedPageView
+
+User = get_user_model()
+
+
+class CacheTestCase(TestCase):
+    """Start each test with empty caches, shared and per process."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for two_tier_cache in (user_cache, follow_cache, ticket_cache):
+            two_tier_cache.local.clear()
+
+
+class BulkFollowFormTests(SimpleTestCase):
+
+    def form(self, content):
+        return BulkFollowForm(
+            data={'usernames': ''},
+            files={'csv_file': SimpleUploadedFile('users.csv', content)},
+        )
+
+    def test_csv_usernames(self):
+        form = self.form(b'username\nalice\nbob\nalice\n')
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['username_list'], ['alice', 'bob'])
+
+    def test_oversized_file_is_rejected(self):
+        form = self.form(b'a\n' * (MAX_BULK_FOLLOW_FILE_SIZE // 2 + 1))
+        self.assertFalse(form.is_valid())
+        self.assertIn('csv_file', form.errors)
+
+    def test_oversized_csv_field_is_rejected(self):
+        form = self.form(b'"' + b'a' * 140000 + b'"\n')
+        self.assertFalse(form.is_valid())
+        self.assertIn("Le fichier CSV est illisible.", form.non_field_errors())
+
+
+class AdminChangelistQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='pw')
+        cls.author = User.objects.create_user('author', password='pw')
+        for i in range(30):
+            ticket = Ticket.objects.create(title=f'T{i}', user=cls.author)
+            Review.objects.create(
+                ticket=ticket, user=cls.author, rating=i % 6, headline='H'
+            )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def get(self, model, queries, **params):
+        url = reverse(f'admin:reviews_{model}_changelist')
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_ticket_changelist(self):
+        self.get('ticket', 6)
+
+    def test_ticket_changelist_filtered(self):
+        self.get('ticket', 6, user=self.author.pk)
+
+    def test_review_changelist(self):
+        self.get('review', 6)
+
+    def test_review_changelist_filtered(self):
+        self.get('review', 6, user='author', rating=3, ticket=1)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='pw')
+        tickets = [
+            Ticket.objects.create(title=f'T{i}', user=author)
+            for i in range(10)
+        ]
+        # Leave a gap of deleted rows below the highest primary key.
+        Ticket.objects.filter(pk__in=[t.pk for t in tickets[5:9]]).delete()
+
+    def paginator(self, limit):
+        paginator = EstimatedCountPaginator(
+            Ticket.objects.order_by('pk'), per_page=2
+        )
+        paginator.exact_count_limit = limit
+        return paginator
+
+    def test_small_table_is_counted_exactly(self):
+        self.assertEqual(self.paginator(100).count, 6)
+
+    def test_estimate_is_lowered_on_a_short_page(self):
+        paginator = self.paginator(3)
+        self.assertEqual(paginator.count, 10)
+        self.assertEqual(len(paginator.page(3)), 2)
+        self.assertEqual(paginator.num_pages, 5)
+
+    def test_page_past_the_last_row_shows_the_last_page(self):
+        paginator = self.paginator(3)
+        page = paginator.page(5)
+        self.assertEqual(page.number, 3)
+        self.assertEqual(paginator.count, 6)
+        self.assertEqual(paginator.num_pages, 3)
+
+
+class BulkDeleterTests(CacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.tickets = [
+            Ticket.objects.create(title=f'T{i}', user=cls.author)
+            for i in range(5)
+        ]
+        for ticket in cls.tickets:
+            Review.objects.create(
+                ticket=ticket, user=cls.author, rating=4, headline='H'
+            )
+
+    def test_delete_tickets_drops_events_and_cached_tickets(self):
+        ticket = self.tickets[0]
+        self.assertEqual(get_ticket(ticket.pk), ticket)
+        with self.captureOnCommitCallbacks(execute=True):
+            with BulkDeleter(batch_size=2) as deleter:
+                deleter.delete_tickets(Ticket.objects.all())
+        self.assertEqual(deleter.counts['tickets'], 5)
+        self.assertEqual(deleter.counts['reviews'], 5)
+        self.assertFalse(PostEvent.objects.exists())
+        self.assertIsNone(get_ticket(ticket.pk))
+
+    def test_failed_file_removal_is_logged(self):
+        with mock.patch.object(
+            default_storage, 'delete', side_effect=OSError
+        ), self.assertLogs('reviews.deletion', 'ERROR'):
+            remove_files(['missing.jpg'])
+
+
+class UserDeletionTests(CacheTestCase):
+
+    def create_user(self, username, follows):
+        """Create a user following and followed by other users."""
+        user = User.objects.create_user(username, password='pw')
+        others = User.objects.bulk_create(
+            User(username=f'{username}{i}') for i in range(follows)
+        )
+        UserFollows.objects.bulk_create(
+            [UserFollows(user=user, followed_user=other) for other in others]
+            + [UserFollows(user=other, followed_user=user)
+               for other in others]
+        )
+        return user, others
+
+    def delete(self, user):
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            with BulkDeleter(batch_size=100) as deleter:
+                deleter.delete_user(user)
+        return deleter, len(queries)
+
+    def test_follows_are_deleted_in_a_bounded_number_of_queries(self):
+        few, _ = self.create_user('few', 2)
+        many, _ = self.create_user('many', 45)
+        _, few_queries = self.delete(few)
+        deleter, many_queries = self.delete(many)
+        self.assertEqual(deleter.counts['follows'], 90)
+        self.assertEqual(many_queries, few_queries)
+        self.assertFalse(UserFollows.objects.exists())
+
+    def test_follow_lists_of_other_users_are_dropped(self):
+        user, (follower,) = self.create_user('gone', 1)
+        self.assertEqual(get_following(follower.pk), [(user.pk, 'gone')])
+        self.assertEqual(get_followers(follower.pk), ['gone'])
+        self.delete(user)
+        self.assertEqual(get_following(follower.pk), [])
+        self.assertEqual(get_followers(follower.pk), [])
+
+
+class RatingAggregateTests(CacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.ticket = Ticket.objects.create(title='T', user=cls.author)
+
+    def review(self, rating):
+        return Review.objects.create(
+            ticket=self.ticket, user=self.author, rating=rating, headline='H'
+        )
+
+    def stats(self):
+        return TicketRating.objects.get(ticket=self.ticket)
+
+    def test_aggregates_follow_review_changes(self):
+        first = self.review(4)
+        second = self.review(1)
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total), (2, 5))
+        self.assertEqual(stats.average, 2.5)
+        self.assertEqual((stats.rating_4, stats.rating_1), (1, 1))
+
+        second.rating = 5
+        second.save()
+        stats = self.stats()
+        self.assertEqual(
+            (stats.count, stats.total, stats.average), (2, 9, 4.5)
+        )
+        self.assertEqual((stats.rating_1, stats.rating_5), (0, 1))
+
+        first.delete()
+        second.delete()
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total, stats.average), (0, 0, 0))
+
+    def test_refresh_repairs_aggregates(self):
+        self.review(3)
+        self.review(5)
+        TicketRating.objects.filter(ticket=self.ticket).update(
+            count=7, total=1, average=0.1, rating_3=0
+        )
+        self.assertEqual(refresh_ticket_ratings([self.ticket.pk]), 1)
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total, stats.average), (2, 8, 4))
+        self.assertEqual(refresh_ticket_ratings(), 0)
+
+    def test_top_rated_page_numbers_are_normalized(self):
+        self.review(5)
+        for number in ('abc', '-3', '0', '1', 1, '99'):
+            self.assertEqual(top_rated_page(number)['number'], 1)
+        self.assertEqual(cache.get('reviews:top-rated:1')['number'], 1)
+        self.assertIsNone(cache.get('reviews:top-rated:abc'))
+        self.assertIsNone(cache.get('reviews:top-rated:99'))
+
+    def test_cached_pages_hold_the_displayed_fields_only(self):
+        self.review(5)
+        top_rated_page(1)
+        author = cache.get('reviews:top-rated:1')['ratings'][0].ticket.user
+        self.assertEqual(author.username, 'author')
+        self.assertTrue(
+            {'password', 'email', 'is_superuser'}
+            <= author.get_deferred_fields()
+        )
+        self.client.force_login(self.author)
+        # The session and the user, then the cached page.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('reviews:top-rated'))
+        self.assertContains(response, 'Ticket –')
+
+
+class SuggestionTests(CacheTestCase):
+
+    def test_build_suggestions_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'local to this process'):
+            call_command('build_suggestions')
+
+    def test_invalidation_is_capped(self):
+        users = [
+            User.objects.create_user(f'user{i}', password='pw')
+            for i in range(5)
+        ]
+        UserFollows.objects.bulk_create(
+            UserFollows(user=user, followed_user=users[0])
+            for user in users[1:]
+        )
+        with mock.patch.object(
+            suggestions, 'MAX_INVALIDATED_FOLLOWERS', 2
+        ), mock.patch.object(suggestions.cache, 'delete_many') as delete:
+            suggestions.invalidate_suggestions([users[0].pk])
+        self.assertEqual(len(delete.call_args.args[0]), 3)
+
+
+class TitleIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            duplicates, 'title_index', duplicates.TitleIndex()
+        )
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def postings(self, trigram):
+        return list(self.index.postings.get(trigram, ()))
+
+    def test_saved_tickets_are_indexed_once(self):
+        first = Ticket.objects.create(title='Dune', user=self.author)
+        self.index.refresh(force=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Ticket.objects.create(title='Dune', user=self.author)
+        self.assertEqual(self.index.last_id, second.pk)
+        self.index.refresh(force=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertEqual(self.postings(' du'), [first.pk, second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.title = 'Fondation'
+            second.save()
+        self.assertEqual(self.postings(' fo'), [second.pk])
+
+    def test_id_of_a_rolled_back_ticket_is_indexed_once_reused(self):
+        self.index.refresh(force=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    lost = Ticket.objects.create(
+                        title='Ubik', user=self.author
+                    )
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(self.index.last_id, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = Ticket.objects.create(title='Solaris', user=self.author)
+        self.assertEqual(ticket.pk, lost.pk)
+        self.assertEqual(self.postings(' so'), [ticket.pk])
+        self.assertEqual(self.postings(' ub'), [])
+
+    def test_failed_load_is_logged_and_retried(self):
+        self.index.loader = mock.Mock()
+        with mock.patch.object(
+            self.index, 'refresh',
+            side_effect=OperationalError('database table is locked'),
+        ), mock.patch.object(duplicates, 'connection'), self.assertLogs(
+            'reviews.duplicates', 'ERROR'
+        ):
+            self.index.load()
+        self.assertIsNone(self.index.loader)
+        self.assertFalse(self.index.loaded)
+
+    def test_similar_tickets_are_found_once_loaded(self):
+        ticket = Ticket.objects.create(
+            title='Le Seigneur des Anneaux', user=self.author
+        )
+        self.index.refresh(force=True)
+        self.assertEqual(
+            duplicates.find_similar_tickets('le seigneur des anneaux'),
+            [ticket]
+        )
+
+
+class ArchiveTests(CacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.reader = User.objects.create_user('reader', password='pw')
+        old = timezone.now() - timedelta(days=400)
+        for i in range(4):
+            ticket = Ticket.objects.create(title=f'T{i}', user=cls.author)
+            Review.objects.create(
+                ticket=ticket, user=cls.reader, rating=3, headline=f'R{i}'
+            )
+        # Every post shares the same creation time.
+        Ticket.objects.update(time_created=old)
+        Review.objects.update(time_created=old)
+
+    def test_archive_moves_posts_and_drops_cached_tickets(self):
+        ticket = Ticket.objects.first()
+        self.assertEqual(get_ticket(ticket.pk), ticket)
+        archiver = Archiver(batch_size=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            archiver.archive(archive_cutoff())
+        self.assertEqual(archiver.counts, {'tickets': 4, 'reviews': 4})
+        self.assertFalse(Ticket.objects.exists())
+        self.assertIsNone(get_ticket(ticket.pk))
+
+    def test_pages_do_not_skip_posts_created_at_the_same_time(self):
+        Archiver().archive(archive_cutoff())
+        seen = []
+        before = None
+        while True:
+            items, cursor = archived_page(
+                ArchivedTicket.objects.all(), ArchivedReview.objects.all(),
+                before=before and parse_cursor(before), size=3,
+            )
+            seen.extend((item.content_type, item.pk) for item in items)
+            if cursor is None:
+                break
+            before = cursor
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_archives_page(self):
+        Archiver().archive(archive_cutoff())
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('reviews:user-posts-archives'))
+        self.assertEqual(len(response.context['feed_items']), 4)
+        response = self.client.get(
+            reverse('reviews:user-posts-archives'), {'before': 'nope'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_user_removes_archives_in_batches(self):
+        Archiver().archive(archive_cutoff())
+        with BulkDeleter(batch_size=3) as deleter:
+            deleter.delete_user(self.author)
+        self.assertFalse(ArchivedTicket.objects.exists())
+        self.assertFalse(ArchivedReview.objects.exists())
+        self.assertEqual(deleter.counts['tickets'], 4)
+        self.assertEqual(deleter.counts['reviews'], 4)
+
+
+class CachedLookupTests(CacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        cls.reader = User.objects.create_user('reader', password='pw')
+        cls.ticket = Ticket.objects.create(title='Dune', user=cls.author)
+
+    def test_username_keys_are_valid_for_every_backend(self):
+        for username in ('author', 'with space', 'é' * 150, 'a\nb'):
+            key = user_cache.make_key(username_key(username))
+            self.assertEqual(list(memcache_key_warnings(key)), [])
+
+    def test_cached_ticket_holds_the_username_of_its_author_only(self):
+        get_ticket(self.ticket.pk)
+        ticket = ticket_cache.shared_get(ticket_cache.make_key(self.ticket.pk))
+        self.assertEqual(ticket.user.username, 'author')
+        self.assertTrue(
+            {'password', 'email', 'is_superuser'}
+            <= ticket.user.get_deferred_fields()
+        )
+        self.client.force_login(self.reader)
+        # The session and the user, then the cached ticket.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('reviews:review-create', args=[self.ticket.pk])
+            )
+        self.assertContains(response, 'author a demandé une critique')
+
+    def test_saved_ticket_is_dropped_on_commit(self):
+        self.assertEqual(get_ticket(self.ticket.pk).title, 'Dune')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ticket.title = 'Dune II'
+            self.ticket.save()
+        self.assertEqual(get_ticket(self.ticket.pk).title, 'Dune II')
+
+    def test_new_user_replaces_the_cached_miss(self):
+        self.assertIsNone(get_user_by_username('newcomer'))
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user('newcomer', password='pw')
+        self.assertEqual(get_user_by_username('newcomer'), user)
+
+    def test_follow_changes_drop_the_follow_lists(self):
+        self.assertEqual(get_following(self.reader.pk), [])
+        self.assertEqual(get_followers(self.author.pk), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = UserFollows.objects.create(
+                user=self.reader, followed_user=self.author
+            )
+        self.assertEqual(
+            get_following(self.reader.pk), [(self.author.pk, 'author')]
+        )
+        self.assertEqual(get_followers(self.author.pk), ['reader'])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertEqual(get_following(self.reader.pk), [])
+
+    def test_review_of_a_deleted_cached_ticket_is_not_found(self):
+        ticket = Ticket.objects.create(title='Gone', user=self.author)
+        self.assertEqual(get_ticket(ticket.pk), ticket)
+        # Raw deletes leave the cached ticket in place.
+        Ticket.objects.filter(pk=ticket.pk)._raw_delete(Ticket.objects.db)
+        self.client.force_login(self.reader)
+        response = self.client.post(
+            reverse('reviews:review-create', args=[ticket.pk]),
+            {'headline': 'H', 'rating': 3, 'body': ''},
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class UserPostsExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        now = timezone.now()
+        cls.ticket = Ticket.objects.create(
+            title='Dune', description='Herbert', user=cls.author
+        )
+        cls.other_ticket = Ticket.objects.create(title='Ubik', user=other)
+        cls.review = Review.objects.create(
+            ticket=cls.other_ticket, user=cls.author, rating=4,
+            headline='Vertigineux', body='Un classique.'
+        )
+        Review.objects.create(
+            ticket=cls.ticket, user=other, rating=1, headline='Long'
+        )
+        cls.archived = ArchivedTicket.objects.create(
+            id=1000, title='Solaris', user=cls.author,
+            time_created=now - timedelta(days=500),
+        )
+        Ticket.objects.filter(pk=cls.ticket.pk).update(
+            time_created=now - timedelta(days=3)
+        )
+        Ticket.objects.filter(pk=cls.other_ticket.pk).update(
+            time_created=now - timedelta(days=2)
+        )
+        Review.objects.filter(pk=cls.review.pk).update(
+            time_created=now - timedelta(days=1)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.author)
+
+    def export(self, export_format):
+        return self.client.get(
+            reverse('reviews:user-posts-export', args=[export_format])
+        )
+
+    def test_jsonl_lists_the_user_posts_newest_first(self):
+        response = self.export('jsonl')
+        self.assertEqual(
+            response['Content-Type'], 'application/x-ndjson; charset=utf-8'
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        posts = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [(post['type'], post['id']) for post in posts],
+            [('review', self.review.pk), ('ticket', self.ticket.pk),
+             ('ticket', self.archived.pk)]
+        )
+        self.assertEqual(posts[0]['ticket']['title'], 'Ubik')
+        self.assertEqual(posts[0]['ticket']['user'], 'other')
+        self.assertEqual(posts[1]['user'], 'author')
+
+    def test_csv_columns_of_tickets_and_reviews(self):
+        response = self.export('csv')
+        self.assertIn(
+            'litrevu-posts.csv', response['Content-Disposition']
+        )
+        content = b''.join(response.streaming_content).decode()
+        review, ticket, archived = csv.DictReader(content.splitlines())
+        self.assertEqual(review['type'], 'review')
+        self.assertEqual(
+            (review['headline'], review['rating'], review['title']),
+            ('Vertigineux', '4', '')
+        )
+        self.assertEqual(
+            (review['ticket_id'], review['ticket_title'],
+             review['ticket_user']),
+            (str(self.other_ticket.pk), 'Ubik', 'other')
+        )
+        self.assertEqual(
+            (ticket['type'], ticket['title'], ticket['description']),
+            ('ticket', 'Dune', 'Herbert')
+        )
+        self.assertEqual(
+            (ticket['headline'], ticket['ticket_id']), ('', '')
+        )
+        self.assertEqual(archived['title'], 'Solaris')
+
+    def test_unknown_format(self):
+        self.assertEqual(self.export('xml').status_code, 404)
+
+
+@override_settings(WRITE_RETRY={'BACKOFF': 0})
+class LoadTestCommandTests(TransactionTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+
+    def loadtest(self):
+        out = io.StringIO()
+        call_command(
+            'loadtest', users=3, tickets_per_user=2, reviews_per_user=1,
+            follows_per_user=1, requests=6, concurrency=1,
+            mix='feed=1,ticket_create=1', host='testserver', stdout=out,
+        )
+        return out.getvalue()
+
+    def test_requests_and_retries_are_reported(self):
+        save = Ticket.save
+        attempts = []
+
+        def save_once_locked(ticket, *args, **kwargs):
+            """Fail the first ticket save as if the database was locked."""
+            attempts.append(ticket)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return save(ticket, *args, **kwargs)
+
+        with mock.patch.object(
+            Ticket, 'save', autospec=True, side_effect=save_once_locked
+        ):
+            output = self.loadtest()
+        self.assertIn('6 requests in', output)
+        rows = dict(
+            re.findall(r'^(feed|ticket_create|all) +(\d+)', output, re.M)
+        )
+        self.assertEqual(int(rows['feed']) + int(rows['ticket_create']), 6)
+        self.assertEqual(rows['all'], '6')
+        self.assertNotRegex(output, r': 5\d\d')
+        self.assertIn('Write retries: 1, abandoned writes: 0', output)
+        self.assertIn("'database is locked' errors: 0", output)
+        self.assertFalse(User.objects.exists())
+
+
+class FeedUpdatesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('reader', password='pw')
+        cls.author = User.objects.create_user('author', password='pw')
+        UserFollows.objects.create(user=cls.reader, followed_user=cls.author)
+        cls.start = timezone.now() - timedelta(hours=1)
+        cls.tickets = []
+        for minutes in range(1, 6):
+            ticket = Ticket.objects.create(
+                title=f'T{minutes}', user=cls.author
+            )
+            Ticket.objects.filter(pk=ticket.pk).update(
+                time_created=cls.start + timedelta(minutes=minutes)
+            )
+            cls.tickets.append(ticket)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def updates(self, since):
+        return self.client.get(
+            reverse('reviews:feed-updates'), {'since': since}
+        )
+
+    def test_batches_follow_each_other_without_gaps(self):
+        since = self.start
+        seen = []
+        for expected_more in (True, True, False):
+            items, more = feed_items_since(self.reader, since, limit=2)
+            self.assertEqual(more, expected_more)
+            seen.extend(reversed(items))
+            since = items[0].time_created
+        self.assertEqual(
+            [item.pk for item in seen], [t.pk for t in self.tickets]
+        )
+
+    def test_endpoint_returns_the_items_after_the_cursor(self):
+        cursor = (self.start + timedelta(minutes=3)).isoformat()
+        data = self.updates(cursor).json()
+        self.assertEqual(data['count'], 2)
+        self.assertFalse(data['more'])
+        self.assertEqual(
+            [item['id'] for item in data['items']],
+            [self.tickets[4].pk, self.tickets[3].pk]
+        )
+        self.assertEqual(
+            data['cursor'], (self.start + timedelta(minutes=5)).isoformat()
+        )
+        self.assertIn('T5', data['items'][0]['html'])
+
+    def test_unencoded_utc_offset_is_accepted(self):
+        cursor = (self.start + timedelta(minutes=4)).isoformat()
+        self.assertIn('+00:00', cursor)
+        response = self.client.get(
+            reverse('reviews:feed-updates') + '?since=' + cursor
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.updates('yesterday').status_code, 400)
+        self.assertEqual(self.updates('').status_code, 400)
+
+    def test_event_stream_is_only_announced_by_the_asgi_application(self):
+        response = self.client.get(reverse('reviews:feed'))
+        self.assertNotContains(response, 'data-events-url')
+
+    async def test_asgi_page_announces_the_event_stream(self):
+        await self.async_client.aforce_login(self.reader)
+        response = await self.async_client.get(reverse('reviews:feed'))
+        self.assertContains(
+            response, f'data-events-url="{events.FEED_EVENTS_PATH}"'
+        )
+
+
+class FeedBroadcasterTests(SimpleTestCase):
+
+    def test_notices_are_sent_to_the_readers_of_the_items(self):
+        broadcaster = events.FeedBroadcaster()
+        reader, follower, stranger = (
+            asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+        )
+        broadcaster.subscribers = {
+            reader: (1, {2}),
+            follower: (3, {1}),
+            stranger: (4, set()),
+        }
+        # A ticket of user 2, a review of user 2 on a ticket of user 1 and
+        # a review of user 1 on their own ticket.
+        broadcaster.dispatch([(10, 2)], [(20, 2, 1), (21, 1, 1)])
+        self.assertEqual(reader.get_nowait(), 2)
+        self.assertEqual(follower.get_nowait(), 1)
+        self.assertTrue(stranger.empty())
+
+    async def test_poller_stops_with_the_last_subscriber(self):
+        broadcaster = events.FeedBroadcaster(interval=0)
+        new_items = ([(11, 2)], [(21, 2, 5)])
+        with mock.patch.object(
+            events, 'latest_ids', return_value=(10, 20)
+        ), mock.patch.object(
+            events, 'fetch_new_items', return_value=new_items
+        ) as fetch:
+            queue = broadcaster.subscribe(1, {2})
+            self.assertEqual(await asyncio.wait_for(queue.get(), 1), 2)
+            broadcaster.unsubscribe(queue)
+            await asyncio.wait_for(broadcaster.task, 1)
+        self.assertEqual(fetch.call_args_list[0].args, (10, 20))
+        self.assertEqual(fetch.call_args_list[1].args, (11, 21))
+
+    async def test_anonymous_stream_is_forbidden(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await events.feed_events({'headers': []}, None, send)
+        self.assertEqual(sent[0]['status'], 403)
+
+
+def image_file(size=(40, 30), mode='RGB', image_format='PNG'):
+    """Return an uploaded image file of the given size and format."""
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, image_format)
+    return SimpleUploadedFile(
+        f'cover.{image_format.lower()}', buffer.getvalue()
+    )
+
+
+class ImageUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='pw')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        self.client.force_login(self.user)
+
+    def post(self, image, client=None, **extra):
+        # The review fields are sent after the image.
+        return (client or self.client).post(
+            reverse('reviews:ticket-and-review-create'),
+            {
+                'title': 'Dune', 'description': '', 'image': image,
+                'headline': 'Culte', 'rating': 5, 'body': 'Relu cet été.',
+                'confirm_new': '1', **extra,
+            },
+        )
+
+    def assertRejected(self, response, message):
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Ticket.objects.exists())
+        [error] = response.context['ticket_form'].errors['image']
+        self.assertIn(message, error)
+        # The fields after the file are still read.
+        self.assertEqual(
+            response.context['review_form']['body'].value(), 'Relu cet été.'
+        )
+
+    def test_valid_image_is_stored(self):
+        response = self.post(image_file())
+        self.assertRedirects(response, reverse('reviews:user-posts'))
+        ticket = Ticket.objects.get()
+        self.assertEqual((ticket.image.width, ticket.image.height), (40, 30))
+        self.assertEqual(
+            Review.objects.get(ticket=ticket).body, 'Relu cet été.'
+        )
+
+    def test_non_image_is_rejected(self):
+        response = self.post(SimpleUploadedFile('cover.png', b'%PDF-1.4'))
+        self.assertRejected(response, "n'est pas une image valide")
+
+    def test_image_with_too_many_pixels_is_rejected(self):
+        response = self.post(image_file((6000, 5000), mode='1'))
+        self.assertRejected(response, "L'image est trop grande")
+
+    @override_settings(TICKET_IMAGE_UPLOAD={'MAX_SIZE': 1024 * 1024})
+    def test_oversized_file_is_rejected(self):
+        # Random pixels do not compress.
+        noise = Image.frombytes('L', (1100, 1000), os.urandom(1100 * 1000))
+        buffer = io.BytesIO()
+        noise.save(buffer, 'PNG')
+        response = self.post(
+            SimpleUploadedFile('cover.png', buffer.getvalue())
+        )
+        self.assertRejected(response, 'taille maximale de 1 Mo')
+
+    @override_settings(TICKET_IMAGE_UPLOAD={'FORMATS': ('JPEG',)})
+    def test_other_formats_are_rejected(self):
+        self.assertRejected(
+            self.post(image_file()), "n'est pas une image valide (JPEG)"
+        )
+        response = self.post(image_file(image_format='JPEG'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_csrf_is_checked_by_the_view(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.post(image_file(), client).status_code, 403)
+        client.get(reverse('reviews:ticket-and-review-create'))
+        token = client.cookies['csrftoken'].value
+        response = self.post(
+            image_file(), client, csrfmiddlewaretoken=token
+        )
+        self.assertEqual(response.status_code, 302)
+
+
+class OwnerRequiredTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', password='pw')
+        cls.reviewer = User.objects.create_user('reviewer', password='pw')
+        cls.intruder = User.objects.create_user('intruder', password='pw')
+        ticket = Ticket.objects.create(title='Dune', user=author)
+        cls.review = Review.objects.create(
+            ticket=ticket, user=cls.reviewer, rating=4, headline='Culte'
+        )
+        cls.url = reverse('reviews:review-update', args=[cls.review.pk])
+
+    def test_owner_check_reuses_the_loaded_review(self):
+        self.client.force_login(self.reviewer)
+        # The session, the user, then the review with its ticket.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Dune')
+        self.assertEqual(response.context['form'].instance, self.review)
+
+    def test_other_users_are_denied(self):
+        self.client.force_login(self.intruder)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        response = self.client.post(
+            self.url, {'headline': 'Nul', 'rating': 0, 'body': ''}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.headline, 'Culte')
+
+    def test_unknown_review(self):
+        self.client.force_login(self.reviewer)
+        response = self.client.get(
+            reverse('reviews:review-update', args=[self.review.pk + 1])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedStreamingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('reader', password='pw')
+        author = User.objects.create_user('author', password='pw')
+        UserFollows.objects.create(user=cls.reader, followed_user=author)
+        for i in range(5):
+            ticket = Ticket.objects.create(title=f'Livre {i}', user=author)
+            Review.objects.create(
+                ticket=ticket, user=author, rating=i, headline=f'Avis {i}'
+            )
+        Ticket.objects.create(title='Sans critique', user=author)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def get_feed(self, streaming):
+        with self.settings(FEED_STREAMING=streaming):
+            response = self.client.get(reverse('reviews:feed'))
+        self.assertEqual(response.streaming, streaming)
+        content = response.getvalue().decode()
+        # The CSRF token is masked differently on each request, and the
+        # batches are separated by the blank lines of the template.
+        content = re.sub(r'value="[\w-]{64}"', 'value="token"', content)
+        return re.sub(r'\s+', ' ', content)
+
+    def test_streamed_page_matches_the_buffered_page(self):
+        with mock.patch.object(FeedPageView, 'stream_batch_size', 2):
+            streamed = self.get_feed(True)
+        self.assertEqual(streamed.count('</html>'), 1)
+        for title in ['Sans critique'] + [f'Avis {i}' for i in range(5)]:
+            self.assertIn(title, streamed)
+        self.assertEqual(streamed, self.get_feed(False))
+
+    def test_error_while_streaming_ends_the_page(self):
+        items_template = get_template(FeedPageView.items_template_name)
+        batches = []
+
+        def render(context, request):
+            """Render the first batch, then fail."""
+            batches.append(context)
+            if len(batches) > 1:
+                raise TemplateSyntaxError('boom')
+            return items_template.render(context, request)
+
+        with mock.patch.object(
+            FeedPageView, 'stream_batch_size', 2
+        ), mock.patch('reviews.views.get_template') as get_items_template, \
+                self.assertLogs('reviews.views', 'ERROR'):
+            get_items_template.return_value.render.side_effect = render
+            page = self.get_feed(True)
+        # The first batch holds the two newest items.
+        self.assertIn('Sans critique', page)
+        self.assertIn('Avis 4', page)
+        self.assertNotIn('Avis 3', page)
+        self.assertIn(FeedPageView.stream_error, page)
+        self.assertEqual(page.count('</html>'), 1)
+
+
+IMPORT_TIMES = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      3000 |       5000 | django.db
+import time:      2000 |       2000 |   django.db.models
+import time:      1500 |       1500 | reviews.models
+"""
+
+
+class StartupProfileTests(SimpleTestCase):
+
+    def run_command(self, returncode=0):
+        result = subprocess.CompletedProcess(
+            [], returncode, stdout='', stderr=IMPORT_TIMES
+        )
+        out = io.StringIO()
+        with mock.patch('subprocess.run', return_value=result) as run, \
+                mock.patch('litrevu.warmup.warm_up',
+                           return_value={'templates': 0.0125}):
+            call_command(
+                'startup_profile', target='wsgi', limit=2, stdout=out
+            )
+        self.assertIn('importtime', run.call_args.args[0])
+        return out.getvalue()
+
+    def test_imports_and_warm_up_steps_are_reported(self):
+        lines = self.run_command().splitlines()
+        self.assertIn('wsgi: 4 modules imported in 6.6 ms', lines[0])
+        self.assertEqual(
+            [line.split()[-1] for line in lines[2:4]],
+            ['django.db', 'django.db.models']
+        )
+        self.assertEqual(lines[5].split(), ['5.0', '75.5%', 'django'])
+        self.assertEqual(lines[-1].split(), ['12.5', 'ms', 'templates'])
+
+    def test_failed_start_is_reported(self):
+        with self.assertRaisesMessage(CommandError, 'wsgi failed to start'):
+            self.run_command(returncode=1)
+
+
+@override_settings(DIGEST={
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+})
+class DigestTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        alice, bob, cls.carol, cls.dave, erin = (
+            User.objects.create_user(name, email=email, password='pw')
+            for name, email in (
+                ('alice', 'alice@example.com'), ('bob', 'bob@example.com'),
+                ('carol', 'carol@example.com'), ('dave', 'dave@example.com'),
+                ('erin', ''),
+            )
+        )
+        UserFollows.objects.bulk_create([
+            UserFollows(user=cls.carol, followed_user=alice),
+            UserFollows(user=cls.carol, followed_user=bob),
+            UserFollows(user=cls.dave, followed_user=alice),
+            UserFollows(user=erin, followed_user=bob),
+        ])
+        Ticket.objects.create(title='Dune', user=alice)
+        ubik = Ticket.objects.create(title='Ubik', user=bob)
+        Review.objects.create(
+            ticket=ubik, user=alice, rating=5, headline='Great'
+        )
+
+    def digest(self, run, user):
+        return Digest.objects.get(run=run, user=user)
+
+    def test_posts_are_grouped_by_author(self):
+        run = run_digest()
+        self.assertEqual((run.event_count, run.digest_count), (3, 3))
+        digest = self.digest(run, self.carol)
+        self.assertEqual(digest.event_count, 3)
+        self.assertEqual(digest.authors, [
+            {'username': 'alice', 'tickets': 1, 'reviews': 1,
+             'ticket_titles': ['Dune'], 'review_headlines': ['Great']},
+            {'username': 'bob', 'tickets': 1, 'reviews': 0,
+             'ticket_titles': ['Ubik'], 'review_headlines': []},
+        ])
+        authors = self.digest(run, self.dave).authors
+        self.assertEqual([author['username'] for author in authors], ['alice'])
+
+    def test_runs_advance_the_cursor(self):
+        events = list(PostEvent.objects.order_by('pk'))
+        first = run_digest(batch_size=2)
+        self.assertEqual(digest_cursor(), events[1].pk)
+        self.assertEqual(self.digest(first, self.dave).event_count, 1)
+        second = run_digest(batch_size=2)
+        self.assertEqual(second.event_count, 1)
+        self.assertEqual(digest_cursor(), events[2].pk)
+        self.assertEqual(
+            self.digest(second, self.dave).authors[0]['review_headlines'],
+            ['Great']
+        )
+        self.assertIsNone(run_digest(batch_size=2))
+
+    def test_gathered_events_are_pruned(self):
+        run = run_digest(batch_size=2)
+        self.assertEqual(prune_events(run), 2)
+        self.assertEqual(
+            list(PostEvent.objects.values_list('title', flat=True)),
+            ['Great']
+        )
+        self.assertEqual(run_digest().event_count, 1)
+
+    def test_digests_are_emailed_to_users_with_an_address(self):
+        self.assertEqual(send_digest_emails(run_digest()), 2)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ['carol@example.com', 'dave@example.com']
+        )
+        body = next(
+            message.body for message in mail.outbox
+            if message.to == ['carol@example.com']
+        )
+        self.assertIn('  - Ticket : Dune\n  - Critique : Great\n', body)
+        self.assertIn('  - Ticket : Ubik\n', body)
+
+    def test_command_emails_and_prunes(self):
+        call_command('send_digests', email=True, prune=True,
+                     stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(PostEvent.objects.exists())
@@ -0,0 +1,149 @@
+"""
+Handle ticket image uploads as a stream.
+Files are written to a temporary file chunk by chunk; the image header is
+read from the first chunks, so that non-image files, oversized files and
+images with too many pixels are rejected before the rest of the file is
+stored or decoded. The rest of the file is still read and discarded, so
+that the fields sent after it reach the form, which reports the error.
+"""
+
+import io
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    SkipFile, TemporaryFileUploadHandler
+)
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image, UnidentifiedImageError
+
+DEFAULT_TICKET_IMAGE_UPLOAD = {
+    # Largest accepted file, in bytes.
+    'MAX_SIZE': 5 * 1024 * 1024,
+    # Largest accepted image, in pixels (width × height).
+    'MAX_PIXELS': 25_000_000,
+    'FORMATS': ('JPEG', 'PNG', 'GIF', 'WEBP'),
+    # The header must be found within this many bytes, which covers large
+    # EXIF blocks placed before the JPEG frame header.
+    'HEADER_SIZE': 256 * 1024,
+}
+
+
+def get_upload_settings():
+    """Return the image upload limits, merged over the defaults."""
+    limits = dict(DEFAULT_TICKET_IMAGE_UPLOAD)
+    limits.update(getattr(settings, 'TICKET_IMAGE_UPLOAD', {}))
+    return limits
+
+
+def read_image_header(data, formats):
+    """
+    Return the format and size of the image starting with data, or None if
+    the header is incomplete or not one of the given formats.
+    Raise DecompressionBombError for images far over Pillow's pixel limit.
+    """
+    try:
+        with Image.open(io.BytesIO(data), formats=formats) as image:
+            return image.format, image.size
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded images to a temporary file and abort as soon as they
+    are known to be invalid.
+    Errors are stored in request.upload_errors by field name.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limits = get_upload_settings()
+        self.header = b''
+        self.checked = False
+        request.upload_errors = {}
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.header = b''
+        self.checked = False
+        if (
+            self.content_length is not None
+            and self.content_length > self.limits['MAX_SIZE']
+        ):
+            self.reject(self.size_message())
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limits['MAX_SIZE']:
+            self.reject(self.size_message())
+        if not self.checked:
+            self.header += raw_data
+            self.check_header(complete=False)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # The whole file is shorter than the header it should hold.
+            try:
+                self.check_header(complete=True)
+            except SkipFile:
+                return None
+        return super().file_complete(file_size)
+
+    def reject(self, message):
+        """
+        Record the error of the current file and skip the rest of it.
+        Stopping the upload instead would also drop the fields sent after
+        the file, such as the text of a review.
+        """
+        self.file.close()
+        self.request.upload_errors[self.field_name] = message
+        raise SkipFile()
+
+    def check_header(self, complete):
+        """Validate the format and dimensions once the header is read."""
+        try:
+            header = read_image_header(self.header, self.limits['FORMATS'])
+        except Image.DecompressionBombError:
+            self.reject(self.pixels_message())
+        if header is None:
+            if complete or len(self.header) >= self.limits['HEADER_SIZE']:
+                self.reject(self.format_message())
+            return
+        self.checked = True
+        self.header = b''
+        _, (width, height) = header
+        if width * height > self.limits['MAX_PIXELS']:
+            self.reject(self.pixels_message())
+
+    def size_message(self):
+        """Return the error of an oversized file."""
+        max_size = self.limits['MAX_SIZE'] / (1024 * 1024)
+        return f"Le fichier dépasse la taille maximale de {max_size:g} Mo."
+
+    def pixels_message(self):
+        """Return the error of an image with too many pixels."""
+        return (
+            f"L'image est trop grande : {self.limits['MAX_PIXELS']} pixels "
+            f"au maximum."
+        )
+
+    def format_message(self):
+        """Return the error of a file that is not an accepted image."""
+        formats = ', '.join(self.limits['FORMATS'])
+        return f"Le fichier n'est pas une image valide ({formats})."
+
+
+class ImageUploadMixin:
+    """
+    Handle the uploads of a view with ImageUploadHandler.
+    Upload handlers must be replaced before the CSRF middleware reads the
+    request body, so the CSRF check is run by the view itself.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def dispatch(self, request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
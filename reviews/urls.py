@@ -6,12 +6,28 @@ app_name = "reviews"
 
 urlpatterns = [
     path('', views.FeedPageView.as_view(), name='feed'),
+    path(
+        'archives/',
+        views.FeedArchivesPageView.as_view(),
+        name='feed-archives'
+    ),
+    path('feed/new/', views.FeedUpdatesView.as_view(), name='feed-updates'),
     path(
         'ticket/create/',
         views.TicketCreatePageView.as_view(),
         name='ticket-create'
     ),
     path('posts/', views.UserPostsPageView.as_view(), name='user-posts'),
+    path(
+        'posts/archives/',
+        views.UserPostsArchivesPageView.as_view(),
+        name='user-posts-archives'
+    ),
+    path(
+        'posts/export/<str:export_format>/',
+        views.UserPostsExportView.as_view(),
+        name='user-posts-export'
+    ),
     path(
         'ticket/<int:id>/update/',
         views.TicketUpdatePageView.as_view(),
@@ -39,9 +55,12 @@ urlpatterns = [
     ),
     path(
         'review/<int:id>/delete/',
-        views.DeletePageView.as_view(model=Review),
+        views.DeletePageView.as_view(
+            model=Review, select_related=('ticket',)
+        ),
         name='review-delete'
     ),
+    path('top-rated/', views.TopRatedPageView.as_view(), name='top-rated'),
     path(
         'subscriptions/',
         views.SubscriptionsPageView.as_view(),
@@ -3,99 +3,254 @@ Handle reviews app views.
 Handle feed display, user posts, subscriptions, tickets, and reviews.
 """
 
-from itertools import chain
+import logging
+from itertools import chain, islice
 from django.db.models import CharField, Value
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse,
+    StreamingHttpResponse
+)
 from django.shortcuts import render, redirect, get_object_or_404
+from django.middleware.csrf import get_token
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views import View
-from reviews.forms import TicketForm, ReviewForm, FollowUserForm
-from reviews.models import Ticket, UserFollows, Review
+from reviews.archive import archived_page, parse_cursor
+from reviews.duplicates import find_similar_tickets
+from reviews.events import FEED_EVENTS_PATH
+from reviews.exports import EXPORT_FORMATS
+from reviews.feed import (
+    archived_reviews, archived_tickets, feed_items_since, iter_feed_items,
+    mark_review_button, visible_reviews, visible_tickets
+)
+from litrevu.writes import DatabaseBusyMixin, atomic_write
+from reviews.follows import (
+    FOLLOWED, STATUS_LABELS, bulk_follow, follow_user, unfollow_user
+)
+from reviews.forms import (
+    TicketForm, ReviewForm, FollowUserForm, BulkFollowForm
+)
+from reviews.lookups import (
+    get_followers, get_following, get_ticket, get_user_by_id,
+    get_user_by_username
+)
+from reviews.models import ArchivedReview, ArchivedTicket, Ticket, Review
+from reviews.ratings import top_rated_page
+from reviews.suggestions import get_suggestions
+from reviews.uploads import ImageUploadMixin
+
+logger = logging.getLogger(__name__)
+
+
+def get_unconfirmed_duplicates(request, ticket_form):
+    """
+    Return the existing tickets similar to a valid new ticket, unless the
+    user already chose to create it after seeing them.
+    """
+    if request.POST.get('confirm_new'):
+        return []
+    return find_similar_tickets(ticket_form.cleaned_data['title'])
+
+
+class OwnerRequiredMixin(UserPassesTestMixin):
+    """
+    Restrict a view to the owner of the object identified by the `id` URL
+    argument. The object is loaded once per request, with the relations
+    listed in `select_related`, and reused by the handlers.
+    """
 
-User = get_user_model()
+    model = None
+    select_related = ()
+
+    def get_object(self):
+        """Return the object of the request."""
+        if not hasattr(self, 'object'):
+            queryset = self.model.objects.select_related(*self.select_related)
+            self.object = get_object_or_404(queryset, id=self.kwargs['id'])
+        return self.object
+
+    def test_func(self):
+        """Return True if current user is the owner of the object."""
+        return self.get_object().user_id == self.request.user.id
 
 
 class FeedPageView(LoginRequiredMixin, View):
     """Display the feed of tickets and reviews for the current user."""
 
     template_name = 'reviews/feed.html'
+    items_template_name = 'reviews/snippets/feed_items_snippet.html'
     login_url = 'authentication:login'
+    # Placeholder of the items in the page rendered for streaming.
+    stream_marker = '<!-- feed-items -->'
+    stream_batch_size = 20
+    # Sent in place of the remaining cards when they cannot be rendered.
+    stream_error = (
+        '<p class="card-content">'
+        "La suite de votre flux n'a pas pu être affichée."
+        '</p>'
+    )
 
     def get_users_viewable_tickets(self, user):
         """Return tickets the user can view, excluding self-reviews."""
-        # User tickets
-        tickets = Ticket.objects.filter(user=user)
-
-        # Tickets from followed users
-        follows = UserFollows.objects.filter(user=user)
-        for follow in follows:
-            tickets = tickets | Ticket.objects.filter(
-                user=follow.followed_user
-            )
-
-        # Remove tickets with self-review
-        tickets_to_remove = Ticket.objects.none()
-        for ticket in tickets:
-            if Review.objects.filter(ticket=ticket, user=ticket.user).exists():
-                tickets_to_remove = tickets_to_remove | Ticket.objects.filter(
-                    pk=ticket.pk
-                )
-
-        tickets = tickets.exclude(
-            pk__in=tickets_to_remove.values_list('pk', flat=True)
-        )
-
-        return tickets
+        return visible_tickets(user)
 
     def get_users_viewable_reviews(self, user):
         """
         Return reviews the user can view, including followed users and
         reviews on user's tickets.
         """
-        # User reviews
-        reviews = Review.objects.filter(user=user)
-
-        # Reviews from followed users
-        follows = UserFollows.objects.filter(user=user)
-        for follow in follows:
-            reviews = reviews | Review.objects.filter(
-                user=follow.followed_user
-            )
-
-        # Reviews on user's tickets
-        user_tickets = Ticket.objects.filter(user=user)
-        for ticket in user_tickets:
-            reviews = reviews | Review.objects.filter(ticket=ticket)
+        return visible_reviews(user)
 
-        return reviews
+    def get_events_url(self, request):
+        """
+        Return the URL of the new items event stream, which only the ASGI
+        application serves, or an empty string.
+        """
+        if isinstance(request, ASGIRequest):
+            return request.META['SCRIPT_NAME'] + FEED_EVENTS_PATH
+        return ''
 
     def get(self, request):
         """Display the feed page with tickets and reviews."""
+        if settings.FEED_STREAMING:
+            return self.stream(request)
         user = request.user
 
-        tickets = self.get_users_viewable_tickets(user)
-        tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
-        # Mark tickets with reviews
-        for ticket in tickets:
-            ticket.has_review = Review.objects.filter(
-                ticket=ticket
-            ).exists()
-            ticket.show_review_button = (
-                    ticket.user != user
-                    and not ticket.has_review
-            )
-
+        # Mark tickets the user can review
+        tickets = mark_review_button(
+            self.get_users_viewable_tickets(user), user
+        )
         reviews = self.get_users_viewable_reviews(user)
-        reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
 
         feed_items = sorted(
             chain(reviews, tickets),
             key=lambda item: item.time_created,
             reverse=True
         )
+        feed_cursor = (
+            feed_items[0].time_created if feed_items else timezone.now()
+        )
+
+        return render(request, self.template_name, {
+            'feed_items': feed_items,
+            'feed_cursor': feed_cursor.isoformat(),
+            'events_url': self.get_events_url(request),
+        })
+
+    def stream(self, request):
+        """
+        Send the page head at once, then the cards in batches as the items
+        are read, then the end of the page.
+        The page around the items is rendered before the response is
+        returned, so that the messages it displays are consumed and the
+        CSRF cookie is set by the middleware. The status is sent by then:
+        an error while reading or rendering the items is logged and the
+        page is ended with a notice.
+        """
+        items = iter_feed_items(request.user)
+        first_item = next(items, None)
+        if first_item is None:
+            return render(request, self.template_name, {
+                'feed_items': [],
+                'feed_cursor': timezone.now().isoformat(),
+                'events_url': self.get_events_url(request),
+            })
+        # Cards rendered later may hold forms using this token.
+        get_token(request)
+        page = render_to_string(self.template_name, {
+            'streaming': True,
+            'feed_cursor': first_item.time_created.isoformat(),
+            'events_url': self.get_events_url(request),
+        }, request=request)
+        head, tail = page.split(self.stream_marker)
+        items_template = get_template(self.items_template_name)
+
+        def content():
+            yield head
+            batches = chain([first_item], items)
+            try:
+                while batch := list(islice(batches, self.stream_batch_size)):
+                    yield items_template.render(
+                        {'feed_items': batch}, request
+                    )
+            except Exception:
+                logger.exception("Could not stream the feed items")
+                yield self.stream_error
+            yield tail
+
+        response = StreamingHttpResponse(content())
+        # Ask proxies to forward each batch as soon as it is sent.
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-        return render(request, self.template_name, {'feed_items': feed_items})
+
+class FeedUpdatesView(LoginRequiredMixin, View):
+    """Return the feed items created after a cursor."""
+
+    login_url = 'authentication:login'
+    ticket_template = 'reviews/snippets/ticket_card_snippet.html'
+    review_template = 'reviews/snippets/review_card_snippet.html'
+
+    def render_item(self, request, item):
+        """Return the card HTML of a feed item."""
+        if item.content_type == 'TICKET':
+            return render_to_string(self.ticket_template, {
+                'ticket': item,
+                'embedded': False,
+                'show_actions': False,
+                'show_review_button': item.show_review_button,
+            }, request=request)
+        return render_to_string(self.review_template, {
+            'review': item,
+            'show_actions': False,
+        }, request=request)
+
+    def get(self, request):
+        """
+        Return the items created after the `since` cursor as JSON, or as
+        HTML fragments with format=html, with the cursor of the last one.
+        At most FEED_UPDATES_LIMIT items are returned, the oldest ones
+        first; `more` tells that newer items follow the new cursor.
+        """
+        # An unencoded '+' of the UTC offset is read as a space.
+        since = parse_datetime(
+            request.GET.get('since', '').replace(' ', '+')
+        )
+        if since is None:
+            return HttpResponseBadRequest("Paramètre 'since' invalide.")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+
+        items, more = feed_items_since(request.user, since)
+        cursor = items[0].time_created.isoformat() if items else (
+            since.isoformat()
+        )
+        fragments = [self.render_item(request, item) for item in items]
+
+        if request.GET.get('format') == 'html':
+            response = HttpResponse(''.join(fragments))
+            response['X-Feed-Cursor'] = cursor
+            response['X-Feed-More'] = int(more)
+            return response
+        return JsonResponse({
+            'cursor': cursor,
+            'count': len(items),
+            'more': more,
+            'items': [
+                {
+                    'type': item.content_type.lower(),
+                    'id': item.id,
+                    'time_created': item.time_created.isoformat(),
+                    'html': fragment,
+                }
+                for item, fragment in zip(items, fragments)
+            ],
+        })
 
 
 class UserPostsPageView(LoginRequiredMixin, View):
@@ -127,68 +282,194 @@ class UserPostsPageView(LoginRequiredMixin, View):
         return render(request, self.template_name, {'feed_items': feed_items})
 
 
-class SubscriptionsPageView(LoginRequiredMixin, View):
+class ArchivesPageView(LoginRequiredMixin, View):
+    """
+    Display the archived tickets and reviews of a list, a page at a time:
+    by default, those posted by the current user.
+    Pages follow each other by the creation time, kind and id of their last
+    item.
+    """
+
+    template_name = 'reviews/archives.html'
+    login_url = 'authentication:login'
+    title = None
+    back_url = None
+
+    def get_archived_tickets(self, user):
+        """Return the archived tickets to display."""
+        return ArchivedTicket.objects.filter(user=user).select_related('user')
+
+    def get_archived_reviews(self, user):
+        """Return the archived reviews to display."""
+        return ArchivedReview.objects.filter(user=user).select_related(
+            'user', 'ticket__user'
+        )
+
+    def get(self, request):
+        """Display the archived items following the `before` cursor."""
+        before = None
+        if 'before' in request.GET:
+            try:
+                before = parse_cursor(request.GET['before'])
+            except ValueError:
+                return HttpResponseBadRequest("Paramètre 'before' invalide.")
+        items, next_cursor = archived_page(
+            self.get_archived_tickets(request.user),
+            self.get_archived_reviews(request.user),
+            before=before,
+        )
+        return render(request, self.template_name, {
+            'title': self.title,
+            'back_url': self.back_url,
+            'feed_items': items,
+            'next_cursor': next_cursor,
+        })
+
+
+class FeedArchivesPageView(ArchivesPageView):
+    """Display the archived part of the feed of the current user."""
+
+    title = "Publications archivées"
+    back_url = 'reviews:feed'
+
+    def get_archived_tickets(self, user):
+        return archived_tickets(user)
+
+    def get_archived_reviews(self, user):
+        return archived_reviews(user)
+
+
+class UserPostsArchivesPageView(ArchivesPageView):
+    """Display the current user's archived tickets and reviews."""
+
+    title = "Vos posts archivés"
+    back_url = 'reviews:user-posts'
+
+
+class UserPostsExportView(LoginRequiredMixin, View):
+    """Stream the current user's tickets and reviews as a download."""
+
+    login_url = 'authentication:login'
+
+    def get(self, request, export_format):
+        """Stream the user's posts in CSV or newline-delimited JSON."""
+        if export_format not in EXPORT_FORMATS:
+            raise Http404("Format d'export inconnu.")
+        rows, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            rows(request, request.user),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="litrevu-posts.{export_format}"'
+        )
+        return response
+
+
+class TopRatedPageView(LoginRequiredMixin, View):
+    """Display the tickets with the best average rating."""
+
+    template_name = 'reviews/top_rated.html'
+    login_url = 'authentication:login'
+
+    def get(self, request):
+        """Display a page of the top-rated tickets."""
+        page = top_rated_page(request.GET.get('page', 1))
+        return render(request, self.template_name, {'page': page})
+
+
+class SubscriptionsPageView(LoginRequiredMixin, DatabaseBusyMixin, View):
     """Display and process user's followed users."""
 
     template_name = 'reviews/subscriptions.html'
     login_url = 'authentication:login'
 
+    def render_page(self, request, **context):
+        """Render the page with the cached follow lists of the user."""
+        context.setdefault('form', FollowUserForm())
+        context.setdefault('bulk_form', BulkFollowForm())
+        context['following'] = get_following(request.user.id)
+        context['followers'] = get_followers(request.user.id)
+        return render(request, self.template_name, context)
+
     def get(self, request):
         """Display the follow user form."""
-        form = FollowUserForm()
-        return render(request, self.template_name, {
-            'form': form,
-        })
+        return self.render_page(
+            request, suggestions=get_suggestions(request.user)
+        )
+
+    def post_bulk_follow(self, request):
+        """Follow every user listed in the bulk import form."""
+        bulk_form = BulkFollowForm(request.POST, request.FILES)
+        context = {'bulk_form': bulk_form}
+        if bulk_form.is_valid():
+            report = bulk_follow(
+                request.user,
+                bulk_form.cleaned_data['username_list']
+            )
+            followed_count = sum(
+                1 for _, status in report if status == FOLLOWED
+            )
+            messages.success(
+                request,
+                f"{followed_count} nouvel(s) abonnement(s) ajouté(s)."
+            )
+            context['bulk_report'] = [
+                (username, STATUS_LABELS[status])
+                for username, status in report
+            ]
+            context['bulk_form'] = BulkFollowForm()
+        return self.render_page(request, **context)
 
     def post(self, request):
         """Process follow and unfollow actions for other users."""
+        if 'bulk_follow' in request.POST:
+            return self.post_bulk_follow(request)
+
         if 'unfollow_user_id' in request.POST:
-            user_id = request.POST.get('unfollow_user_id')
-            try:
-                user_to_unfollow = User.objects.get(id=user_id)
-                UserFollows.objects.filter(
-                    user=request.user,
-                    followed_user=user_to_unfollow
-                ).delete()
+            user_id = request.POST.get('unfollow_user_id', '')
+            user_to_unfollow = (
+                get_user_by_id(int(user_id)) if user_id.isdigit() else None
+            )
+            if user_to_unfollow is None:
+                messages.error(request, "Utilisateur introuvable.")
+            else:
+                unfollow_user(request.user, user_to_unfollow)
                 messages.success(
                     request,
                     f"Vous ne suivez plus {user_to_unfollow.username}."
                 )
-            except User.DoesNotExist:
-                messages.error(request, "Utilisateur introuvable.")
             return redirect('reviews:subscriptions')
 
         form = FollowUserForm(request.POST)
         if form.is_valid():
             username = form.cleaned_data['username']
 
-            try:
-                user_to_follow = User.objects.get(username=username)
-            except User.DoesNotExist:
+            user_to_follow = get_user_by_username(username)
+            if user_to_follow is None:
                 messages.error(
                     request,
                     f"L'utilisateur '{username}' n'existe pas."
                 )
-                return render(request, self.template_name, {'form': form})
+                return self.render_page(request, form=form)
 
-            if user_to_follow == request.user:
+            if user_to_follow.id == request.user.id:
                 messages.error(
                     request,
                     "Vous ne pouvez pas vous suivre vous-même."
                 )
-                return render(request, self.template_name, {'form': form})
+                return self.render_page(request, form=form)
 
-            UserFollows.objects.get_or_create(
-                user=request.user,
-                followed_user=user_to_follow
-            )
+            follow_user(request.user, user_to_follow)
             messages.success(request, f"Vous suivez maintenant {username}.")
             return redirect('reviews:subscriptions')
 
-        return render(request, self.template_name, {'form': form})
+        return self.render_page(request, form=form)
 
 
-class TicketCreatePageView(LoginRequiredMixin, View):
+class TicketCreatePageView(
+    LoginRequiredMixin, DatabaseBusyMixin, ImageUploadMixin, View
+):
     """Display and process the ticket creation form."""
 
     template_name = 'reviews/ticket_create.html'
@@ -201,29 +482,31 @@ class TicketCreatePageView(LoginRequiredMixin, View):
 
     def post(self, request):
         """Create a new ticket from form data and save it."""
-        form = TicketForm(request.POST, request.FILES)
+        form = TicketForm(
+            request.POST, request.FILES, upload_errors=request.upload_errors
+        )
         if form.is_valid():
+            similar_tickets = get_unconfirmed_duplicates(request, form)
+            if similar_tickets:
+                return render(request, self.template_name, {
+                    'form': form,
+                    'similar_tickets': similar_tickets,
+                })
             ticket = form.save(commit=False)
             ticket.user = request.user
-            ticket.save()
+            atomic_write(ticket.save, name='ticket.save')()
             return redirect('reviews:user-posts')
         return render(request, self.template_name, {'form': form})
 
 
-class TicketUpdatePageView(LoginRequiredMixin, UserPassesTestMixin, View):
+class TicketUpdatePageView(
+    LoginRequiredMixin, OwnerRequiredMixin, ImageUploadMixin, View
+):
     """Display and process the ticket update form for ticket owner."""
 
     template_name = 'reviews/ticket_create.html'
     login_url = 'authentication:login'
-
-    def get_object(self):
-        """Return the ticket to update."""
-        return get_object_or_404(Ticket, id=self.kwargs['id'])
-
-    def test_func(self):
-        """Return True if current user is the ticket owner."""
-        ticket = self.get_object()
-        return ticket.user == self.request.user
+    model = Ticket
 
     def get(self, request, id):
         """Display the ticket update form."""
@@ -234,14 +517,19 @@ class TicketUpdatePageView(LoginRequiredMixin, UserPassesTestMixin, View):
     def post(self, request, id):
         """Update the ticket with form data."""
         ticket = self.get_object()
-        form = TicketForm(request.POST, request.FILES, instance=ticket)
+        form = TicketForm(
+            request.POST, request.FILES, instance=ticket,
+            upload_errors=request.upload_errors
+        )
         if form.is_valid():
             form.save()
             return redirect('reviews:user-posts')
         return render(request, self.template_name, {'form': form})
 
 
-class TicketAndReviewCreatePageView(LoginRequiredMixin, View):
+class TicketAndReviewCreatePageView(
+    LoginRequiredMixin, DatabaseBusyMixin, ImageUploadMixin, View
+):
     """Display and process creation of a ticket and its review."""
 
     template_name = 'reviews/ticket_and_review_create.html'
@@ -256,38 +544,51 @@ class TicketAndReviewCreatePageView(LoginRequiredMixin, View):
             'review_form': review_form,
         })
 
+    @atomic_write
+    def save_ticket_and_review(self, ticket_form, review_form):
+        """Save the ticket and its review in a single transaction."""
+        ticket = ticket_form.save(commit=False)
+        ticket.user = self.request.user
+        ticket.save()
+
+        review = review_form.save(commit=False)
+        review.user = self.request.user
+        review.ticket = ticket
+        review.save()
+
     def post(self, request):
         """Create a ticket and review from form data and save both."""
-        ticket_form = TicketForm(request.POST, request.FILES)
+        ticket_form = TicketForm(
+            request.POST, request.FILES, upload_errors=request.upload_errors
+        )
         review_form = ReviewForm(request.POST)
 
+        similar_tickets = []
         if ticket_form.is_valid() and review_form.is_valid():
-            ticket = ticket_form.save(commit=False)
-            ticket.user = request.user
-            ticket.save()
-
-            review = review_form.save(commit=False)
-            review.user = request.user
-            review.ticket = ticket
-            review.save()
-
-            return redirect('reviews:user-posts')
+            similar_tickets = get_unconfirmed_duplicates(request, ticket_form)
+            if not similar_tickets:
+                self.save_ticket_and_review(ticket_form, review_form)
+                return redirect('reviews:user-posts')
 
         return render(request, self.template_name, {
             'ticket_form': ticket_form,
             'review_form': review_form,
+            'similar_tickets': similar_tickets,
         })
 
 
-class ReviewCreatePageView(LoginRequiredMixin, View):
+class ReviewCreatePageView(LoginRequiredMixin, DatabaseBusyMixin, View):
     """Display and process creation of a review for a ticket."""
 
     template_name = 'reviews/review_create.html'
     login_url = 'authentication:login'
 
     def get_ticket(self, id):
-        """Return the ticket for which to create the review."""
-        return get_object_or_404(Ticket, id=id)
+        """Return the cached ticket for which to display the form."""
+        ticket = get_ticket(id)
+        if ticket is None:
+            raise Http404("Ticket introuvable.")
+        return ticket
 
     def get(self, request, id):
         """Display the review form for a ticket."""
@@ -304,14 +605,17 @@ class ReviewCreatePageView(LoginRequiredMixin, View):
 
     def post(self, request, id):
         """Create a review for a ticket from form data."""
-        ticket = self.get_ticket(id)
+        # The cached ticket may have been deleted or archived since.
+        ticket = get_object_or_404(
+            Ticket.objects.select_related('user'), id=id
+        )
         form = ReviewForm(request.POST, request.FILES)
 
         if form.is_valid():
             review = form.save(commit=False)
             review.user = request.user
             review.ticket = ticket
-            review.save()
+            atomic_write(review.save, name='review.save')()
             return redirect('reviews:feed')
 
         return render(
@@ -324,20 +628,13 @@ class ReviewCreatePageView(LoginRequiredMixin, View):
         )
 
 
-class ReviewUpdatePageView(LoginRequiredMixin, UserPassesTestMixin, View):
+class ReviewUpdatePageView(LoginRequiredMixin, OwnerRequiredMixin, View):
     """Display and process the review update form for review owner."""
 
     template_name = 'reviews/review_create.html'
     login_url = 'authentication:login'
-
-    def get_object(self):
-        """Return the review to update."""
-        return get_object_or_404(Review, id=self.kwargs['id'])
-
-    def test_func(self):
-        """Return True if current user is the review owner."""
-        review = self.get_object()
-        return review.user == self.request.user
+    model = Review
+    select_related = ('ticket__user',)
 
     def get(self, request, id):
         """Display the review update form."""
@@ -363,21 +660,11 @@ class ReviewUpdatePageView(LoginRequiredMixin, UserPassesTestMixin, View):
             })
 
 
-class DeletePageView(LoginRequiredMixin, UserPassesTestMixin, View):
+class DeletePageView(LoginRequiredMixin, OwnerRequiredMixin, View):
     """Display and process deletion of a ticket or review."""
 
     template_name = 'reviews/delete_confirm.html'
     login_url = 'authentication:login'
-    model = None
-
-    def get_object(self):
-        """Return the object to delete."""
-        return get_object_or_404(self.model, id=self.kwargs['id'])
-
-    def test_func(self):
-        """Return True if current user is the owner of the object."""
-        item = self.get_object()
-        return item.user == self.request.user
 
     def get(self, request, id):
         """Display the deletion confirmation page."""